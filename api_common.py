@@ -0,0 +1,81 @@
+"""Response helpers shared by the Flask (app.py) and aiohttp (async_app.py) front ends"""
+import time
+from urllib.parse import urlparse
+from media_cache import media_cache
+from config import STATS_RESPONSE_TTL, BATCH_MAX_ITEMS, TELEGRAM_FILE_URL_BASE
+
+# (response, expires_at) of the last /api/cache-stats answer. Kept out of cache_manager,
+# whose hit rate the endpoint reports, so polling does not skew the numbers
+_stats_snapshot = (None, 0)
+
+def download_source(download_url):
+    if media_cache.is_local(download_url):
+        return "local"
+    # Links stored before a switch to a local Bot API server still point at api.telegram.org
+    if download_url.startswith(f"{TELEGRAM_FILE_URL_BASE.rstrip('/')}/") \
+            or urlparse(download_url).hostname == "api.telegram.org":
+        return "telegram"
+    return "external"
+
+def batch_items(data, field):
+    """(items, None) for a valid batch request body, or (None, error message)"""
+    items = data.get(field) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, f"Missing '{field}' list"
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, f"At most {BATCH_MAX_ITEMS} {field} per batch"
+    return items, invalid_batch_item(field, items)
+
+def invalid_batch_item(field, items):
+    """Message describing the first malformed batch element, or None when all are well-formed"""
+    for index, item in enumerate(items):
+        if field == 'urls':
+            if not isinstance(item, str):
+                return f"urls[{index}] must be a string"
+            continue
+        if not isinstance(item, dict):
+            return f"items[{index}] must be an object"
+        for name in ("key", "video_id", "type"):
+            # Missing keys are reported per line by the batch; wrong types would break it mid-stream
+            if item.get(name) is not None and not isinstance(item[name], str):
+                return f"items[{index}].{name} must be a string"
+    return None
+
+def info_line(index, url, info, error):
+    if error is not None:
+        return {"index": index, "url": url, "status": False, "message": error}
+    return {
+        "index": index,
+        "url": url,
+        "status": True,
+        "title": info["title"],
+        "duration": info["duration"],
+        "thumbnail": info["thumbnail"],
+        "key": info["key"],
+        "video_id": info["video_id"]
+    }
+
+def download_line(index, item, result, error):
+    if error is not None:
+        return {"index": index, "key": item.get("key"), "status": False, "message": error}
+    download_url, quality = result
+    file_type = item.get("type", "video")
+    return {
+        "index": index,
+        "key": item["key"],
+        "video_id": item.get("video_id"),
+        "status": True,
+        "download_url": download_url,
+        "quality" if file_type == "video" else "format": quality,
+        "type": file_type,
+        "source": download_source(download_url)
+    }
+
+def cached_stats():
+    """The last /api/cache-stats response while it is fresh, else None"""
+    response, expires_at = _stats_snapshot
+    return response if time.time() < expires_at else None
+
+def store_stats(response):
+    global _stats_snapshot
+    _stats_snapshot = (response, time.time() + STATS_RESPONSE_TTL)
@@ -1,9 +1,14 @@
+import startup  # first, so the startup report covers every import below
 import os
+import json
 import logging
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, send_file
 from ytmp4_service import OptimizedYtmp4Service
 from cache_manager import CacheManager
-from database import db_manager
+from cache_backends import create_backend
+from media_cache import media_cache
+from api_common import batch_items, cached_stats, download_line, download_source, info_line, store_stats
+import metrics
 from config import SECRET_KEY
 
 # Configure logging
@@ -12,9 +17,16 @@ logging.basicConfig(level=logging.DEBUG)
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
 
-# Initialize services
-cache_manager = CacheManager()
+startup.mark("imports")
+
+# Initialize services (no network I/O: MongoDB, Telegram and crypto load on first use)
+# In-process L1 cache, optionally backed by a shared L2 tier (CACHE_BACKEND)
+cache_manager = CacheManager(backend=create_backend())
 ytmp4_service = OptimizedYtmp4Service(cache_manager)
+startup.mark("service_init")
+startup.ready()
+# Open connections while the first requests are already being served
+startup.warm_up_in_background(ytmp4_service.warm_up_steps())
 
 @app.route('/')
 def index():
@@ -64,7 +76,7 @@ def get_download_links():
                 "download_url": download_url,
                 "quality": quality,
                 "type": "video",
-                "source": "telegram" if "telegram" in download_url else "external"
+                "source": download_source(download_url)
             })
         elif download_type == 'audio':
             download_url, format_type = ytmp4_service.get_best_audio_download(key, video_id)
@@ -73,7 +85,7 @@ def get_download_links():
                 "download_url": download_url,
                 "format": format_type,
                 "type": "audio",
-                "source": "telegram" if "telegram" in download_url else "external"
+                "source": download_source(download_url)
             })
         else:
             return jsonify({"status": False, "message": "Invalid download type"}), 400
@@ -105,17 +117,66 @@ def api_ytmp4():
         logging.error(f"Error in legacy api_ytmp4: {str(e)}")
         return jsonify({"status": False, "message": str(e)}), 500
 
+def batch_request(field):
+    """Validated list from a batch request body, or an error response"""
+    items, message = batch_items(request.get_json(silent=True), field)
+    if message:
+        return None, (jsonify({"status": False, "message": message}), 400)
+    return items, None
+
+def ndjson(lines):
+    return Response((json.dumps(line) + "\n" for line in lines), mimetype='application/x-ndjson')
+
+@app.route('/api/batch/video-info', methods=['POST'])
+def batch_video_info():
+    """Video info for many URLs, streamed as NDJSON lines in completion order"""
+    urls, error = batch_request('urls')
+    if error:
+        return error
+    
+    return ndjson(
+        info_line(index, urls[index], info, message)
+        for index, info, message in ytmp4_service.get_info_batch(urls)
+    )
+
+@app.route('/api/batch/download', methods=['POST'])
+def batch_download():
+    """Download links for many {key, video_id, type} items, streamed as NDJSON lines"""
+    items, error = batch_request('items')
+    if error:
+        return error
+    
+    return ndjson(
+        download_line(index, items[index], result, message)
+        for index, result, message in ytmp4_service.get_download_batch(items)
+    )
+
+@app.route('/media/<video_id>/<file_type>')
+def media_file(video_id, file_type):
+    """Serve a file from the local media cache, with Range/206 and ETag/If-None-Match support"""
+    cached = media_cache.lookup(video_id, file_type)
+    if cached is None:
+        return jsonify({"status": False, "message": "File not in the media cache"}), 404
+    # Whole-file responses go through wsgi.file_wrapper, which gunicorn serves with sendfile
+    return send_file(
+        cached.path, mimetype=cached.content_type, as_attachment=True, download_name=cached.filename,
+        conditional=True, etag=cached.etag, max_age=media_cache.max_age
+    )
+
 @app.route('/api/cache-stats')
 def cache_stats():
     """Get cache statistics for monitoring"""
-    cache_stats = cache_manager.get_stats()
-    db_stats = db_manager.get_stats()
-    
-    return jsonify({
-        "cache": cache_stats,
-        "database": db_stats,
-        "total_cached_videos": db_stats["videos_with_telegram_video"] + db_stats["videos_with_telegram_audio"]
-    })
+    # Every open browser tab polls this endpoint, so serve a short-lived snapshot
+    response = cached_stats()
+    if response is None:
+        response = ytmp4_service.get_stats()
+        store_stats(response)
+    return jsonify(response)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Stage timings and tier counters in the Prometheus text format"""
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
 
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=5000)
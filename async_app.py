@@ -0,0 +1,207 @@
+import startup  # first, so the startup report covers every import below
+import asyncio
+import json
+import logging
+from aiohttp import web
+from ytmp4_service import OptimizedYtmp4Service
+from database import db_manager
+from cache_manager import CacheManager
+from cache_backends import create_backend
+from media_cache import media_cache
+from api_common import batch_items, cached_stats, download_line, download_source, info_line, store_stats
+import metrics
+
+# Async serving mode: one process holds many in-flight upstream waits.
+# Run with: gunicorn async_app:app --bind 0.0.0.0:5000 --worker-class aiohttp.GunicornWebWorker
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+startup.mark("imports")
+
+# Initialize services (no network I/O: MongoDB, Telegram and crypto load on first use)
+cache_manager = CacheManager(backend=create_backend())
+ytmp4_service = OptimizedYtmp4Service(cache_manager)
+startup.mark("service_init")
+startup.ready()
+startup.warm_up_in_background(ytmp4_service.warm_up_steps())
+
+async def get_video_info(request):
+    """Get video information without download URLs - faster response"""
+    try:
+        data = await request.json()
+        url = data.get('url')
+
+        if not url:
+            return web.json_response({"status": False, "message": "Missing YouTube URL"}, status=400)
+
+        info = await ytmp4_service.get_info_async(url)
+
+        return web.json_response({
+            "status": True,
+            "title": info["title"],
+            "duration": info["duration"],
+            "thumbnail": info["thumbnail"],
+            "key": info["key"],
+            "video_id": info["video_id"]
+        })
+
+    except Exception as e:
+        logging.error(f"Error in get_video_info: {str(e)}")
+        return web.json_response({"status": False, "message": str(e)}, status=500)
+
+async def get_download_links(request):
+    """Get download links for video or audio with Telegram caching"""
+    try:
+        data = await request.json()
+        key = data.get('key')
+        video_id = data.get('video_id')
+        download_type = data.get('type', 'video')  # 'video' or 'audio'
+
+        if not key:
+            return web.json_response({"status": False, "message": "Missing video key"}, status=400)
+
+        if download_type == 'video':
+            download_url, quality = await ytmp4_service.get_best_quality_download_async(key, video_id)
+            return web.json_response({
+                "status": True,
+                "download_url": download_url,
+                "quality": quality,
+                "type": "video",
+                "source": download_source(download_url)
+            })
+        elif download_type == 'audio':
+            download_url, format_type = await ytmp4_service.get_best_audio_download_async(key, video_id)
+            return web.json_response({
+                "status": True,
+                "download_url": download_url,
+                "format": format_type,
+                "type": "audio",
+                "source": download_source(download_url)
+            })
+        else:
+            return web.json_response({"status": False, "message": "Invalid download type"}, status=400)
+
+    except Exception as e:
+        logging.error(f"Error in get_download_links: {str(e)}")
+        return web.json_response({"status": False, "message": str(e)}, status=500)
+
+async def api_ytmp4(request):
+    """Legacy endpoint for backward compatibility"""
+    url = request.query.get("url")
+    if not url:
+        return web.json_response({"status": False, "message": "Missing YouTube URL"}, status=400)
+
+    try:
+        info = await ytmp4_service.get_info_async(url)
+        download_url, selected_quality = await ytmp4_service.get_best_quality_download_async(info['key'])
+
+        return web.json_response({
+            "status": True,
+            "title": info["title"],
+            "duration": info["duration"],
+            "thumbnail": info["thumbnail"],
+            "quality": selected_quality,
+            "download_url": download_url
+        })
+    except Exception as e:
+        logging.error(f"Error in legacy api_ytmp4: {str(e)}")
+        return web.json_response({"status": False, "message": str(e)}, status=500)
+
+async def batch_request(request, field):
+    """Validated list from a batch request body, or an error response"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    items, message = batch_items(data, field)
+    if message:
+        return None, web.json_response({"status": False, "message": message}, status=400)
+    return items, None
+
+async def stream_ndjson(request, lines):
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    try:
+        async for line in lines:
+            await response.write((json.dumps(line) + "\n").encode())
+    finally:
+        # Close promptly on client disconnect so the batch still saves what it resolved
+        await lines.aclose()
+    await response.write_eof()
+    return response
+
+async def batch_video_info(request):
+    """Video info for many URLs, streamed as NDJSON lines in completion order"""
+    urls, error = await batch_request(request, 'urls')
+    if error:
+        return error
+
+    async def lines():
+        async for index, info, message in ytmp4_service.get_info_batch_async(urls):
+            yield info_line(index, urls[index], info, message)
+
+    return await stream_ndjson(request, lines())
+
+async def batch_download(request):
+    """Download links for many {key, video_id, type} items, streamed as NDJSON lines"""
+    items, error = await batch_request(request, 'items')
+    if error:
+        return error
+
+    async def lines():
+        async for index, result, message in ytmp4_service.get_download_batch_async(items):
+            yield download_line(index, items[index], result, message)
+
+    return await stream_ndjson(request, lines())
+
+async def media_file(request):
+    """Serve a file from the local media cache, with Range/206 and ETag/If-None-Match support"""
+    cached = media_cache.lookup(request.match_info['video_id'], request.match_info['file_type'])
+    if cached is None:
+        return web.json_response({"status": False, "message": "File not in the media cache"}, status=404)
+    # FileResponse streams with sendfile and answers Range and If-None-Match itself
+    return web.FileResponse(cached.path, headers={
+        "Content-Type": cached.content_type,
+        "Content-Disposition": f'attachment; filename="{cached.filename}"',
+        "Cache-Control": f"public, max-age={media_cache.max_age}"
+    })
+
+async def cache_stats(request):
+    """Get cache statistics for monitoring"""
+    response = cached_stats()
+    if response is None:
+        # Stats read MongoDB through the sync client; keep that off the event loop
+        response = await asyncio.get_running_loop().run_in_executor(None, ytmp4_service.get_stats)
+        store_stats(response)
+    return web.json_response(response)
+
+async def metrics_endpoint(request):
+    """Stage timings and tier counters in the Prometheus text format"""
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+async def warm_up_motor(app):
+    # The motor client is bound to the serving loop, so it warms up here rather than in a thread
+    app['motor_warm_up'] = asyncio.ensure_future(startup.warm_up_async("mongo_async", db_manager.warm_up_async))
+
+async def close_sessions(app):
+    await ytmp4_service.close_async()
+
+def create_app():
+    app = web.Application()
+    app.router.add_post('/api/video-info', get_video_info)
+    app.router.add_post('/api/download', get_download_links)
+    app.router.add_get('/api/ytmp4', api_ytmp4)
+    app.router.add_post('/api/batch/video-info', batch_video_info)
+    app.router.add_post('/api/batch/download', batch_download)
+    app.router.add_get('/media/{video_id}/{file_type}', media_file)
+    app.router.add_get('/api/cache-stats', cache_stats)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.on_startup.append(warm_up_motor)
+    app.on_cleanup.append(close_sessions)
+    return app
+
+app = create_app()
+
+if __name__ == "__main__":
+    web.run_app(app, host='0.0.0.0', port=5000)
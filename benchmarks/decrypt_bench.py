@@ -0,0 +1,84 @@
+"""Micro-benchmark: decrypting /v2/info payloads, previous pipeline vs the current one.
+
+    python benchmarks/decrypt_bench.py --formats 0,50,500 --iterations 300
+
+Payloads are encrypted like savetube's (fake_services.encrypt) and padded with
+`--formats` format entries to mimic large responses. Compares the previous
+decrypt (hex key per call, str decode, find/rfind, full json.loads), the current
+full decrypt and decrypt_info, which decodes only the fields get_info uses.
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from Crypto.Cipher import AES
+from fake_services import encrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ytmp4_service import INFO_FIELDS, decrypt_info_payload, decrypt_payload, parse_payload
+
+HEX_KEY = "C5D58EF67A7584E4A29F6C35BBC4EB12"
+
+def previous_decrypt(b64_encrypted):
+    """The decrypt pipeline before the fast path, kept here as the baseline"""
+    raw = bytes.fromhex(HEX_KEY)
+    data = base64.b64decode(b64_encrypted.replace("\n", "").replace(" ", ""))
+    decrypted = AES.new(raw, AES.MODE_CBC, data[:16]).decrypt(data[16:]).rstrip(b"\x00")
+    decrypted_str = decrypted.decode("utf-8").strip()
+    json_start = decrypted_str.find('{')
+    json_end = decrypted_str.rfind('}') + 1
+    if json_start >= 0 and json_end > json_start:
+        return json.loads(decrypted_str[json_start:json_end])
+    return json.loads(decrypted_str)
+
+def current_decrypt(b64_encrypted):
+    return parse_payload(decrypt_payload(b64_encrypted))
+
+def info_payload(video_id, formats):
+    """A /v2/info-shaped payload with `formats` video and audio format entries"""
+    return {
+        "title": f"Benchmark video {video_id} \"quoted\" — ünïcode",
+        "durationLabel": "1:02:03",
+        "thumbnail": f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
+        "key": f"key-{video_id}",
+        "description": "lorem ipsum " * (formats * 4),
+        "video_formats": [
+            {"quality": 144 + i, "label": f"{144 + i}p", "url": f"https://cdn.example/{video_id}/v/{i}",
+             "size": 1024 * i, "default_selected": i == 0}
+            for i in range(formats)
+        ],
+        "audio_formats": [
+            {"quality": 48 + i, "label": f"{48 + i}kbps", "url": f"https://cdn.example/{video_id}/a/{i}"}
+            for i in range(formats)
+        ]
+    }
+
+def measure(fn, payloads, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(payloads[i % len(payloads)])
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", default="0,50,500,2000", help="comma-separated format entries per payload")
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    # Warm the lazy Crypto import outside the timings
+    decrypt_payload(encrypt({}))
+    variants = [("previous", previous_decrypt), ("decrypt", current_decrypt), ("decrypt_info", decrypt_info_payload)]
+    print(f"{'formats':>8}  {'payload_kb':>10}  " + "  ".join(f"{name + '_us':>16}" for name, _ in variants))
+    for formats in [int(f) for f in args.formats.split(",")]:
+        payloads = [encrypt(info_payload(f"bm{i:09d}", formats)) for i in range(8)]
+        expected = {name: previous_decrypt(payloads[0])[name] for name in INFO_FIELDS}
+        assert {name: current_decrypt(payloads[0])[name] for name in INFO_FIELDS} == expected
+        assert decrypt_info_payload(payloads[0]) == expected
+        timings = [measure(fn, payloads, args.iterations) for _, fn in variants]
+        print(f"{formats:>8}  {len(payloads[0]) * 3 / 4 / 1024:>10.1f}  " + "  ".join(f"{t:>16.1f}" for t in timings))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""In-memory stand-in for the parts of pymongo.MongoClient the app uses.
+
+Supports equality, $in and $exists filters, $set/$inc updates with upsert,
+unordered bulk_write of UpdateOne, projections and count_documents. Every
+operation sleeps for BENCH_MONGO_LATENCY_MS to mimic a network round trip.
+"""
+import itertools
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+MONGO_LATENCY = float(os.environ.get("BENCH_MONGO_LATENCY_MS", 0)) / 1000
+
+_ids = itertools.count(1)
+
+def _round_trip():
+    if MONGO_LATENCY:
+        time.sleep(MONGO_LATENCY)
+
+def _matches(doc, query):
+    for field, condition in query.items():
+        if isinstance(condition, dict):
+            if "$in" in condition and doc.get(field) not in condition["$in"]:
+                return False
+            if "$exists" in condition and (field in doc) != condition["$exists"]:
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    included = {k for k, v in projection.items() if v and k != "_id"}
+    if included:
+        result = {k: v for k, v in doc.items() if k in included}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {k: v for k, v in doc.items() if k not in projection}
+
+class FakeCollection:
+    def __init__(self):
+        self._docs = {}
+        # video_id is the lookup key for almost every query; keep it indexed
+        self._by_video_id = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, keys, **kwargs):
+        return kwargs.get("name", "index")
+
+    def find_one(self, query, projection=None):
+        _round_trip()
+        with self._lock:
+            for doc in self._candidates(query):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        _round_trip()
+        with self._lock:
+            return [_project(doc, projection) for doc in self._candidates(query or {})]
+
+    def count_documents(self, query):
+        _round_trip()
+        with self._lock:
+            return sum(1 for _ in self._candidates(query))
+
+    def update_one(self, query, update, upsert=False):
+        _round_trip()
+        with self._lock:
+            return self._update_locked(query, update, upsert)
+
+    def replace_one(self, query, replacement, upsert=False):
+        _round_trip()
+        with self._lock:
+            existing = next(iter(self._candidates(query)), None)
+            if existing is None and not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+            doc = dict(replacement)
+            doc["_id"] = existing["_id"] if existing else query.get("_id", next(_ids))
+            self._store(doc, existing)
+            return SimpleNamespace(matched_count=int(existing is not None), modified_count=int(existing is not None),
+                                   upserted_id=None if existing else doc["_id"])
+
+    def delete_one(self, query):
+        _round_trip()
+        with self._lock:
+            doc = next(iter(self._candidates(query)), None)
+            if doc is not None:
+                self._remove(doc)
+            return SimpleNamespace(deleted_count=int(doc is not None))
+
+    def bulk_write(self, requests, ordered=True):
+        _round_trip()
+        upserted = modified = 0
+        with self._lock:
+            for request in requests:
+                result = self._update_locked(request._filter, request._doc, request._upsert)
+                upserted += result.upserted_id is not None
+                modified += result.modified_count
+        return SimpleNamespace(upserted_count=upserted, modified_count=modified)
+
+    def _candidates(self, query):
+        video_id = query.get("video_id")
+        if "_id" in query and not isinstance(query["_id"], dict):
+            docs = [self._docs[query["_id"]]] if query["_id"] in self._docs else []
+        elif isinstance(video_id, dict) and "$in" in video_id:
+            docs = [self._docs[self._by_video_id[v]] for v in video_id["$in"] if v in self._by_video_id]
+        elif video_id is not None and not isinstance(video_id, dict):
+            docs = [self._docs[self._by_video_id[video_id]]] if video_id in self._by_video_id else []
+        else:
+            docs = list(self._docs.values())
+        return [doc for doc in docs if _matches(doc, query)]
+
+    def _update_locked(self, query, update, upsert):
+        existing = next(iter(self._candidates(query)), None)
+        if existing is None and not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        if existing is None:
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc.setdefault("_id", next(_ids))
+        else:
+            doc = dict(existing)
+        doc.update(update.get("$set", {}))
+        for field, amount in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + amount
+        self._store(doc, existing)
+        return SimpleNamespace(matched_count=int(existing is not None), modified_count=int(existing is not None),
+                               upserted_id=None if existing else doc["_id"])
+
+    def _store(self, doc, existing):
+        if existing is not None:
+            self._remove(existing)
+        self._docs[doc["_id"]] = doc
+        if "video_id" in doc:
+            self._by_video_id[doc["video_id"]] = doc["_id"]
+
+    def _remove(self, doc):
+        del self._docs[doc["_id"]]
+        if self._by_video_id.get(doc.get("video_id")) == doc["_id"]:
+            del self._by_video_id[doc["video_id"]]
+
+class FakeDatabase:
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self._collections.setdefault(name, FakeCollection())
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def command(self, *args, **kwargs):
+        return {}
+
+class FakeMongoClient:
+    """Drop-in for MongoClient(uri, **kwargs); all clients share one in-memory server"""
+    _databases = {}
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self._databases.setdefault(name, FakeDatabase())
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def close(self):
+        pass
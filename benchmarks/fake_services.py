@@ -0,0 +1,199 @@
+"""Local stand-ins for the savetube CDN API and the Telegram Bot API.
+
+Both run on one background event loop. Every endpoint sleeps for an injected
+latency (base ± jitter, with an optional slow tail) before answering.
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import threading
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+from aiohttp import web
+
+# Must match ytmp4_service.AES_KEY so responses decrypt like the real API's
+AES_KEY = bytes.fromhex("C5D58EF67A7584E4A29F6C35BBC4EB12")
+# (multipart upload, URL fetch) limits of the cloud Bot API and a local telegram-bot-api server
+TELEGRAM_LIMITS = {
+    "cloud": (50 * 1024 ** 2, 20 * 1024 ** 2),
+    "local": (2000 * 1024 ** 2, 2000 * 1024 ** 2)
+}
+# Working directory a local server (--local) reports in getFile paths
+LOCAL_FILE_ROOT = "/var/lib/telegram-bot-api"
+
+class Latency:
+    """Injected delay in milliseconds: base ± jitter fraction, tail_ms for a tail_rate share of calls"""
+
+    def __init__(self, base_ms=0.0, jitter=0.0, tail_rate=0.0, tail_ms=0.0):
+        self.base_ms = base_ms
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+
+    async def wait(self):
+        if self.tail_rate and random.random() < self.tail_rate:
+            delay = self.tail_ms
+        else:
+            delay = self.base_ms * (1 + random.uniform(-self.jitter, self.jitter))
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+def encrypt(payload):
+    """Encrypt a dict the way savetube's /v2/info does (AES-CBC, IV prepended, base64)"""
+    iv = os.urandom(16)
+    cipher = AES.new(AES_KEY, AES.MODE_CBC, iv)
+    return base64.b64encode(iv + cipher.encrypt(pad(json.dumps(payload).encode(), AES.block_size))).decode()
+
+class FakeServices:
+    """Fake savetube (discovery, CDN hosts, media files) and Telegram Bot API servers"""
+
+    def __init__(self, upstream_latency=None, telegram_latency=None, cdn_count=2,
+                 unavailable_qualities=("1080",), media_bytes=256 * 1024, telegram_mode="cloud",
+                 url_fetch_limit=None, host="127.0.0.1"):
+        self.upstream_latency = upstream_latency or Latency()
+        self.telegram_latency = telegram_latency or Latency()
+        self.cdn_count = cdn_count
+        self.unavailable_qualities = set(unavailable_qualities)
+        self.media = os.urandom(media_bytes)
+        # 'local' mimics telegram-bot-api --local: higher limits, absolute getFile paths
+        self.telegram_mode = telegram_mode
+        self.upload_limit, default_fetch_limit = TELEGRAM_LIMITS[telegram_mode]
+        # Telegram only fetches URLs up to this size (sendVideo/sendAudio with a URL)
+        self.url_fetch_limit = url_fetch_limit if url_fetch_limit is not None else default_fetch_limit
+        self.host = host
+        self.ports = {}
+        self.counts = {}
+        self._telegram_files = {}
+        self._loop = None
+        self._ready = threading.Event()
+
+    # ---- Lifecycle ----
+
+    def start(self):
+        """Start every server on a daemon thread; returns once they are listening"""
+        thread = threading.Thread(target=self._run, name="fake-services", daemon=True)
+        thread.start()
+        self._ready.wait()
+        return self
+
+    def env(self):
+        """Environment variables that point the app at these servers"""
+        env = {
+            "UPSTREAM_SCHEME": "http",
+            "CDN_DISCOVERY_URL": f"{self._url('discovery')}/api/random-cdn",
+            "TELEGRAM_API_URL": self._url('telegram'),
+            "TELEGRAM_API_MODE": self.telegram_mode
+        }
+        if self.telegram_mode == "local":
+            env["TELEGRAM_FILE_URL_BASE"] = f"{self._url('telegram')}/files"
+            env["TELEGRAM_LOCAL_FILE_ROOT"] = LOCAL_FILE_ROOT
+        return env
+
+    def _url(self, name):
+        return f"http://{self.host}:{self.ports[name]}"
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _serve(self):
+        savetube = web.Application(client_max_size=1024 ** 2)
+        savetube.router.add_get('/api/random-cdn', self.random_cdn)
+        savetube.router.add_post('/v2/info', self.info)
+        savetube.router.add_post('/download', self.download)
+        savetube.router.add_get('/media/{name}', self.media_file)
+
+        telegram = web.Application(client_max_size=1024 ** 3)
+        telegram.router.add_post('/bot{token}/{method:send(?:Video|Audio|Document)}', self.send_file)
+        telegram.router.add_get('/bot{token}/getFile', self.get_file)
+        telegram.router.add_get('/file/bot{token}/{path:.+}', self.media_file)
+        # Stands in for the file server a local Bot API deployment puts in front of its --dir
+        telegram.router.add_get('/files/{path:.+}', self.media_file)
+
+        for name, app in [("discovery", savetube), ("telegram", telegram)] + \
+                [(f"cdn{i}", savetube) for i in range(self.cdn_count)]:
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, self.host, 0)
+            await site.start()
+            self.ports[name] = site._server.sockets[0].getsockname()[1]
+
+    def _count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    # ---- savetube ----
+
+    async def random_cdn(self, request):
+        self._count('random_cdn')
+        cdn = random.randrange(self.cdn_count)
+        return web.json_response({"cdn": f"{self.host}:{self.ports[f'cdn{cdn}']}"})
+
+    async def info(self, request):
+        self._count('info')
+        await self.upstream_latency.wait()
+        url = (await request.json())["url"]
+        video_id = url.rsplit("=", 1)[-1].rsplit("/", 1)[-1]
+        return web.json_response({"status": True, "data": encrypt({
+            "title": f"Benchmark video {video_id}",
+            "durationLabel": "3:21",
+            "thumbnail": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+            "key": f"key-{video_id}"
+        })})
+
+    async def download(self, request):
+        self._count('download')
+        await self.upstream_latency.wait()
+        body = await request.json()
+        if body["quality"] in self.unavailable_qualities:
+            return web.json_response({"status": False, "message": "Quality not available"})
+        return web.json_response({"status": True, "data": {
+            "downloadUrl": f"{self._url('discovery')}/media/{body['key']}-{body['quality']}.bin"
+        }})
+
+    async def media_file(self, request):
+        self._count('media')
+        return web.Response(body=self.media, content_type='application/octet-stream')
+
+    # ---- Telegram Bot API ----
+
+    async def send_file(self, request):
+        self._count('telegram_upload')
+        field = request.match_info['method'][4:].lower()
+        if request.content_type.startswith('multipart/'):
+            received = 0
+            reader = await request.multipart()
+            async for part in reader:
+                while chunk := await part.read_chunk():
+                    received += len(chunk)
+            if received > self.upload_limit:
+                return web.json_response({"ok": False, "error_code": 413,
+                                          "description": "Request Entity Too Large"}, status=413)
+        else:
+            # Sent by URL: Telegram fetches the file itself
+            self._count('telegram_url_upload')
+            await request.post()
+            if len(self.media) > self.url_fetch_limit:
+                return web.json_response({"ok": False, "error_code": 400,
+                                          "description": "Bad Request: failed to get HTTP URL content"}, status=400)
+        await self.telegram_latency.wait()
+        file_id = f"file-{len(self._telegram_files) + 1}"
+        self._telegram_files[file_id] = f"{field}s/{file_id}.bin"
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self._telegram_files),
+            field: {"file_id": file_id}
+        }})
+
+    async def get_file(self, request):
+        self._count('telegram_getfile')
+        await self.telegram_latency.wait()
+        file_path = self._telegram_files.get(request.query.get('file_id'))
+        if file_path is None:
+            return web.json_response({"ok": False, "description": "Bad Request: invalid file_id"}, status=400)
+        if self.telegram_mode == "local":
+            file_path = f"{LOCAL_FILE_ROOT}/{request.match_info['token']}/{file_path}"
+        return web.json_response({"ok": True, "result": {"file_path": file_path}})
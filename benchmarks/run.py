@@ -0,0 +1,195 @@
+"""Offline benchmark: drive the Flask endpoints against local fakes and report per scenario.
+
+    python benchmarks/run.py --videos 200 --concurrency 1,16 --upstream-latency-ms 150
+
+The savetube CDN API and the Telegram Bot API are served by fake_services.py,
+MongoDB by fake_mongo.py inside the app process. Each concurrency level gets a
+fresh app process, so every run starts cold. Reports throughput, p50/p99 latency,
+errors, app RSS and how many upstream calls each scenario caused.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from fake_services import FakeServices, Latency
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZE = 50
+
+def video_ids(count, offset=0):
+    # 11 characters, like real YouTube IDs
+    return [f"bm{i:09d}" for i in range(offset, offset + count)]
+
+def scenarios(videos):
+    """(name, description, [(path, body)]) in run order; later scenarios reuse earlier videos"""
+    ids = video_ids(videos)
+    batch_ids = video_ids(videos, offset=videos)
+    watch = lambda video_id: f"https://www.youtube.com/watch?v={video_id}"
+    variants = ("https://youtu.be/{}?t=10", "https://www.youtube.com/shorts/{}", "https://m.youtube.com/watch?v={}&feature=share")
+    variant = lambda i, video_id: variants[i % len(variants)].format(video_id)
+    return [
+        ("info_cold", "new videos: upstream /v2/info + decrypt",
+         [("/api/video-info", {"url": watch(v)}) for v in ids]),
+        ("info_warm", "same URLs again: in-memory cache",
+         [("/api/video-info", {"url": watch(v)}) for v in ids]),
+        ("info_variants", "same videos via youtu.be/shorts/m. URLs: canonical key hits memory",
+         [("/api/video-info", {"url": variant(i, v)}) for i, v in enumerate(ids)]),
+        ("download_cold", "parallel quality probes, queues Telegram uploads",
+         [("/api/download", {"key": f"key-{v}", "video_id": v, "type": "video"}) for v in ids]),
+        ("download_warm", "same downloads again: Telegram or memory tier",
+         [("/api/download", {"key": f"key-{v}", "video_id": v, "type": "video"}) for v in ids]),
+        ("batch_info", f"/api/batch/video-info, {BATCH_SIZE} new URLs per request",
+         [("/api/batch/video-info", {"urls": [watch(v) for v in batch_ids[i:i + BATCH_SIZE]]})
+          for i in range(0, len(batch_ids), BATCH_SIZE)])
+    ]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_app(fakes, args):
+    port = free_port()
+    env = dict(os.environ, **fakes.env(),
+               BENCH_MONGO_LATENCY_MS=str(args.mongo_latency_ms),
+               UPLOAD_QUEUE_STORE="sqlite",
+               UPLOAD_QUEUE_SQLITE_PATH=os.path.join(args.workdir, f"bench_jobs_{port}.db"),
+               CACHE_BACKEND="memory")
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "server.py"), "--port", str(port), "--log-level", args.log_level],
+        env=env, cwd=args.workdir
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App process exited with {process.returncode}")
+        try:
+            requests.get(f"{base_url}/metrics", timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("App process did not start listening within 30s")
+
+def rss_mb(pid):
+    """(current, peak) resident set size of pid in MB, from /proc (None elsewhere)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+def run_scenario(base_url, calls, concurrency, timeout):
+    local = threading.local()
+
+    def call(path_and_body):
+        path, body = path_and_body
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            r = session.post(f"{base_url}{path}", json=body, timeout=timeout)
+            # NDJSON lines carry per-item status; count the response as failed if any item failed
+            ok = r.status_code == 200 and '"status": false' not in r.text
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, calls))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, ok in results if not ok),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1)
+    }
+
+def print_table(rows):
+    columns = ["concurrency", "scenario", "requests", "errors", "throughput_rps", "p50_ms", "p99_ms",
+               "rss_mb", "peak_rss_mb", "upstream_calls", "telegram_calls"]
+    widths = {c: max(len(c), *(len(str(row.get(c, ""))) for row in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).rjust(widths[c]) for c in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=100, help="distinct videos per scenario")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated client concurrency levels")
+    parser.add_argument("--scenarios", help="comma-separated subset of scenario names (default: all)")
+    parser.add_argument("--upstream-latency-ms", type=float, default=100)
+    parser.add_argument("--telegram-latency-ms", type=float, default=200)
+    parser.add_argument("--mongo-latency-ms", type=float, default=5)
+    parser.add_argument("--jitter", type=float, default=0.2, help="± fraction applied to injected latencies")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="share of upstream calls that take --tail-ms")
+    parser.add_argument("--tail-ms", type=float, default=2000)
+    parser.add_argument("--cdns", type=int, default=2, help="fake CDN hosts behind /api/random-cdn")
+    parser.add_argument("--media-kb", type=int, default=256, help="size of each fake media file")
+    parser.add_argument("--telegram-mode", choices=["cloud", "local"], default="cloud",
+                        help="fake the cloud Bot API or a local telegram-bot-api server (limits, file paths)")
+    parser.add_argument("--settle", type=float, default=1.0, help="pause between scenarios for background work")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--log-level", default="WARNING", help="app log level")
+    parser.add_argument("--workdir", default=os.environ.get("TMPDIR", "/tmp"))
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    fakes = FakeServices(
+        upstream_latency=Latency(args.upstream_latency_ms, args.jitter, args.tail_rate, args.tail_ms),
+        telegram_latency=Latency(args.telegram_latency_ms, args.jitter),
+        cdn_count=args.cdns,
+        media_bytes=args.media_kb * 1024,
+        telegram_mode=args.telegram_mode
+    ).start()
+    selected = set(args.scenarios.split(",")) if args.scenarios else None
+
+    rows = []
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        process, base_url = start_app(fakes, args)
+        try:
+            for name, description, calls in scenarios(args.videos):
+                if selected and name not in selected:
+                    continue
+                before = dict(fakes.counts)
+                row = {"concurrency": concurrency, "scenario": name, "description": description}
+                row.update(run_scenario(base_url, calls, concurrency, args.timeout))
+                time.sleep(args.settle)
+                row["rss_mb"], row["peak_rss_mb"] = (round(v, 1) if v is not None else "n/a" for v in rss_mb(process.pid))
+                delta = {k: v - before.get(k, 0) for k, v in fakes.counts.items()}
+                row["upstream_calls"] = delta.get("info", 0) + delta.get("download", 0)
+                row["telegram_calls"] = delta.get("telegram_upload", 0) + delta.get("telegram_getfile", 0)
+                rows.append(row)
+                print(f"[c={concurrency}] {name}: {row['throughput_rps']} req/s, "
+                      f"p50 {row['p50_ms']}ms, p99 {row['p99_ms']}ms, {row['errors']} errors", flush=True)
+            rows[-1]["tiers"] = requests.get(f"{base_url}/api/cache-stats", timeout=args.timeout).json().get("tiers")
+        finally:
+            process.terminate()
+            process.wait()
+
+    print()
+    print_table(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Serve the Flask app against the in-memory MongoDB stand-in.
+
+Started by run.py in its own process (so memory is measured for the app alone),
+with UPSTREAM_SCHEME, CDN_DISCOVERY_URL and TELEGRAM_API_URL pointing at the fakes.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    # Configure logging before app.py does, so its DEBUG default does not apply
+    logging.basicConfig(level=args.log_level)
+    # werkzeug logs every request at INFO unless its own logger has a level
+    logging.getLogger("werkzeug").setLevel(args.log_level)
+
+    import pymongo
+    from fake_mongo import FakeMongoClient
+    pymongo.MongoClient = FakeMongoClient
+
+    from werkzeug.serving import make_server
+    from app import app
+
+    make_server("127.0.0.1", args.port, app, threaded=True).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Tuple
+from config import CACHE_BACKEND, REDIS_URL, CACHE_SQLITE_PATH, CACHE_KEY_PREFIX
+
+def serialize(value: Any) -> str:
+    return json.dumps(value, separators=(',', ':'))
+
+def deserialize(payload) -> Any:
+    return json.loads(payload)
+
+class CacheBackend(ABC):
+    """Shared (L2) cache store used behind the in-process CacheManager.
+
+    Values are JSON-serialized, so tuples come back as lists.
+    """
+
+    def __init__(self, prefix: str = CACHE_KEY_PREFIX):
+        self.prefix = prefix
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, remaining_ttl_seconds) or None"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def scan(self, key_prefix: str) -> dict:
+        """Return all live entries whose key starts with key_prefix"""
+
+class RedisBackend(CacheBackend):
+    """L2 store speaking the Redis protocol (Redis, KeyDB, Valkey, ...)"""
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = CACHE_KEY_PREFIX):
+        super().__init__(prefix)
+        try:
+            import redis
+        except ImportError:
+            raise Exception("CACHE_BACKEND=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(self.prefix + key)
+        pipe.pttl(self.prefix + key)
+        payload, pttl = pipe.execute()
+        if payload is None:
+            return None
+        # PTTL is -1 for keys without expiry; treat them as long-lived
+        remaining = pttl / 1000 if pttl and pttl > 0 else 3600
+        return deserialize(payload), remaining
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, serialize(value), px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def scan(self, key_prefix):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}{key_prefix}*", count=500))
+        if not keys:
+            return {}
+        entries = {}
+        for full_key, payload in zip(keys, self.client.mget(keys)):
+            if payload is not None:
+                name = full_key.decode() if isinstance(full_key, bytes) else full_key
+                entries[name[len(self.prefix):]] = deserialize(payload)
+        return entries
+
+class SQLiteBackend(CacheBackend):
+    """L2 store in a local SQLite file, shared by every worker on the host (and handy for tests)"""
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, prefix: str = CACHE_KEY_PREFIX):
+        super().__init__(prefix)
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT payload, expires_at FROM cache WHERE key = ?", (self.prefix + key,)
+        ).fetchone()
+        if row is None:
+            return None
+        remaining = row[1] - time.time()
+        if remaining <= 0:
+            return None
+        return deserialize(row[0]), remaining
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, payload, expires_at) VALUES (?, ?, ?)",
+            (self.prefix + key, serialize(value), time.time() + ttl)
+        )
+        conn.commit()
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE key = ?", (self.prefix + key,))
+        conn.commit()
+
+    def scan(self, key_prefix):
+        rows = self._conn().execute(
+            "SELECT key, payload FROM cache WHERE key >= ? AND key < ? AND expires_at > ?",
+            (self.prefix + key_prefix, self.prefix + key_prefix + '\uffff', time.time())
+        ).fetchall()
+        return {key[len(self.prefix):]: deserialize(payload) for key, payload in rows}
+
+    def cleanup_expired(self):
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        conn.commit()
+        return removed
+
+def create_backend(name: str = CACHE_BACKEND) -> Optional[CacheBackend]:
+    """Build the L2 backend selected by CACHE_BACKEND ('memory' means L1 only)"""
+    if name == "redis":
+        return RedisBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name not in ("memory", "", None):
+        logging.warning(f"Unknown CACHE_BACKEND '{name}', using in-process cache only")
+    return None
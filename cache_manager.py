@@ -1,91 +1,279 @@
+import asyncio
+import heapq
+import logging
+import os
+import socket
+import sys
 import time
 import threading
-from typing import Any, Optional
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from config import CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_STATS_PUBLISH_INTERVAL
+
+STATS_KEY_PREFIX = "stats_worker_"
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory footprint of a cached value in bytes"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += estimate_size(k) + estimate_size(v)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += estimate_size(item)
+    return size
 
 class CacheManager:
-    def __init__(self):
-        self._cache = {}
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES, backend=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # Optional shared L2 store (see cache_backends); this instance is the L1
+        self.backend = backend
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._last_published = 0
+        # OrderedDict keeps entries in LRU order (oldest first)
+        self._cache = OrderedDict()
+        # Min-heap of (expires_at, key) so expired entries are reclaimed in O(log n)
+        self._expiry_heap = []
+        self._size_bytes = 0
         self._lock = threading.RLock()
-        self._stats = {
+        self._stats = self._empty_stats()
+
+    def _empty_stats(self):
+        return {
             'hits': 0,
             'misses': 0,
             'sets': 0,
-            'total_requests': 0
+            'total_requests': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'rejected': 0,
+            'l2_hits': 0,
+            'l2_errors': 0
         }
 
     def get(self, key: str) -> Optional[Any]:
+        found = self.get_with_ttl(key)
+        return found[0] if found is not None else None
+
+    def get_with_ttl(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, remaining_ttl_seconds) or None"""
+        found = self._get_local(key)
+        if self.backend is None:
+            return found
+        return self._get_shared(key, found)
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        found = await self.get_with_ttl_async(key)
+        return found[0] if found is not None else None
+
+    async def get_with_ttl_async(self, key: str) -> Optional[Tuple[Any, float]]:
+        """get_with_ttl for event loops: L1 answers inline, L2 round trips run in the default executor"""
+        found = self._get_local(key)
+        if self.backend is None or (found is not None and not self._publish_due()):
+            return found
+        return await asyncio.get_running_loop().run_in_executor(None, self._get_shared, key, found)
+
+    def _get_local(self, key):
         with self._lock:
             self._stats['total_requests'] += 1
-            
-            if key not in self._cache:
-                self._stats['misses'] += 1
-                return None
-            
-            entry = self._cache[key]
             current_time = time.time()
-            
-            # Check if entry has expired
-            if current_time > entry['expires_at']:
-                del self._cache[key]
+            self._purge_expired(current_time)
+
+            entry = self._cache.get(key)
+            if entry is not None and current_time > entry['expires_at']:
+                self._remove(key)
+                self._stats['expirations'] += 1
+                entry = None
+
+            if entry is None:
+                if self.backend is None:
+                    self._stats['misses'] += 1
+                return None
+            self._cache.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry['value'], entry['expires_at'] - current_time
+
+    def _get_shared(self, key, found):
+        """Finish a lookup through the L2 tier; found is the L1 result"""
+        self._maybe_publish_stats()
+        if found is not None:
+            return found
+
+        # L1 miss: consult the shared tier outside the lock
+        found = self._backend_call('get', key)
+        with self._lock:
+            if found is None:
                 self._stats['misses'] += 1
                 return None
-            
             self._stats['hits'] += 1
-            return entry['value']
+            self._stats['l2_hits'] += 1
+
+        value, remaining_ttl = found
+        # Promote into L1 with the TTL left in L2 so both tiers expire together
+        self._set_local(key, value, remaining_ttl)
+        return value, remaining_ttl
 
     def set(self, key: str, value: Any, ttl: int = 3600):
         """Set cache entry with TTL in seconds"""
         with self._lock:
             self._stats['sets'] += 1
-            expires_at = time.time() + ttl
-            
+        self._set_local(key, value, ttl)
+        if self.backend is not None:
+            self._backend_call('set', key, value, ttl)
+
+    async def set_async(self, key: str, value: Any, ttl: int = 3600):
+        """set for event loops: L1 is updated inline, the L2 write runs in the default executor"""
+        with self._lock:
+            self._stats['sets'] += 1
+        self._set_local(key, value, ttl)
+        if self.backend is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._backend_call, 'set', key, value, ttl)
+
+    def _set_local(self, key, value, ttl):
+        with self._lock:
+            current_time = time.time()
+            expires_at = current_time + ttl
+            size = estimate_size(key) + estimate_size(value)
+
+            if key in self._cache:
+                self._remove(key)
+
+            # A single value larger than the whole budget would flush everything else
+            if size > self.max_bytes:
+                self._stats['rejected'] += 1
+                return
+
             self._cache[key] = {
                 'value': value,
                 'expires_at': expires_at,
-                'created_at': time.time()
+                'created_at': current_time,
+                'size': size
             }
+            self._size_bytes += size
+            heapq.heappush(self._expiry_heap, (expires_at, key))
+
+            self._purge_expired(current_time)
+            self._evict_over_capacity()
+            self._compact_heap()
 
     def delete(self, key: str):
         with self._lock:
             if key in self._cache:
-                del self._cache[key]
+                self._remove(key)
+        if self.backend is not None:
+            self._backend_call('delete', key)
 
     def clear(self):
+        """Clear the local tier and its stats; the shared tier is left untouched"""
         with self._lock:
             self._cache.clear()
-            self._stats = {
-                'hits': 0,
-                'misses': 0,
-                'sets': 0,
-                'total_requests': 0
-            }
+            self._expiry_heap = []
+            self._size_bytes = 0
+            self._stats = self._empty_stats()
 
     def get_stats(self):
         with self._lock:
             hit_rate = 0
             if self._stats['total_requests'] > 0:
                 hit_rate = (self._stats['hits'] / self._stats['total_requests']) * 100
-            
+
             return {
                 'cache_size': len(self._cache),
+                'size_bytes': self._size_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
                 'hits': self._stats['hits'],
                 'misses': self._stats['misses'],
                 'sets': self._stats['sets'],
+                'evictions': self._stats['evictions'],
+                'expirations': self._stats['expirations'],
+                'rejected': self._stats['rejected'],
+                'l2_hits': self._stats['l2_hits'],
+                'l2_errors': self._stats['l2_errors'],
                 'total_requests': self._stats['total_requests'],
-                'hit_rate': round(hit_rate, 2)
+                'hit_rate': round(hit_rate, 2),
+                'backend': type(self.backend).__name__ if self.backend is not None else None
             }
 
+    def get_cluster_stats(self):
+        """Sum the stats every worker has published to the shared tier"""
+        local_stats = self.get_stats()
+        if self.backend is None:
+            return None
+
+        self._maybe_publish_stats(force=True)
+        published = self._backend_call('scan', STATS_KEY_PREFIX) or {}
+        totals = {}
+        for stats in published.values():
+            for name, value in stats.items():
+                if isinstance(value, (int, float)) and name not in ('hit_rate', 'max_entries', 'max_bytes'):
+                    totals[name] = totals.get(name, 0) + value
+        if not published:
+            totals = {k: v for k, v in local_stats.items() if isinstance(v, (int, float))}
+
+        requests = totals.get('total_requests', 0)
+        totals['hit_rate'] = round(totals.get('hits', 0) / requests * 100, 2) if requests else 0
+        totals['workers'] = max(len(published), 1)
+        return totals
+
+    def _publish_due(self):
+        return time.time() - self._last_published >= CACHE_STATS_PUBLISH_INTERVAL
+
+    def _maybe_publish_stats(self, force=False):
+        """Share this worker's counters through the L2 tier at most once per interval"""
+        if not force and not self._publish_due():
+            return
+        self._last_published = time.time()
+        stats = self.get_stats()
+        stats.pop('backend', None)
+        self._backend_call('set', STATS_KEY_PREFIX + self.worker_id, stats, CACHE_STATS_PUBLISH_INTERVAL * 4)
+        if hasattr(self.backend, 'cleanup_expired'):
+            self._backend_call('cleanup_expired')
+
+    def _backend_call(self, method, *args):
+        """Call the L2 backend, degrading to L1-only behaviour on errors"""
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            with self._lock:
+                self._stats['l2_errors'] += 1
+            logging.warning(f"Shared cache {method} failed: {str(e)}")
+            return None
+
     def cleanup_expired(self):
         """Remove expired entries"""
         with self._lock:
-            current_time = time.time()
-            expired_keys = []
-            
-            for key, entry in self._cache.items():
-                if current_time > entry['expires_at']:
-                    expired_keys.append(key)
-            
-            for key in expired_keys:
-                del self._cache[key]
-            
-            return len(expired_keys)
+            return self._purge_expired(time.time())
+
+    def _remove(self, key):
+        entry = self._cache.pop(key)
+        self._size_bytes -= entry['size']
+        return entry
+
+    def _purge_expired(self, current_time):
+        """Pop expired entries off the expiry heap, skipping stale heap records"""
+        removed = 0
+        heap = self._expiry_heap
+        while heap and heap[0][0] < current_time:
+            expires_at, key = heapq.heappop(heap)
+            entry = self._cache.get(key)
+            # The key may have been overwritten or evicted since this record was pushed
+            if entry is not None and entry['expires_at'] == expires_at:
+                self._remove(key)
+                self._stats['expirations'] += 1
+                removed += 1
+        return removed
+
+    def _evict_over_capacity(self):
+        """Evict least recently used entries until both limits are satisfied"""
+        while self._cache and (len(self._cache) > self.max_entries or self._size_bytes > self.max_bytes):
+            key = next(iter(self._cache))
+            self._remove(key)
+            self._stats['evictions'] += 1
+
+    def _compact_heap(self):
+        """Drop stale heap records once they outnumber live entries"""
+        if len(self._expiry_heap) > 2 * len(self._cache) + 64:
+            self._expiry_heap = [(entry['expires_at'], key) for key, entry in self._cache.items()]
+            heapq.heapify(self._expiry_heap)
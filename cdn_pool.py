@@ -0,0 +1,197 @@
+import logging
+import random
+import threading
+import time
+from config import (
+    CDN_POOL_SIZE, CDN_POOL_REFRESH_INTERVAL, CDN_EWMA_ALPHA,
+    CDN_EJECT_FAILURES, CDN_EJECT_SECONDS, CDN_HOST_TTL
+)
+
+# Latency assumed for a host that has only failed so far
+INITIAL_LATENCY = 1.0
+MAX_EJECT_SECONDS = 600
+# Share of picks sent to a random healthy host so demoted hosts get a chance to recover
+EXPLORE_RATE = 0.05
+
+class _Host:
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0
+        self.last_discovered = time.time()
+
+    def score(self):
+        """Lower is better: expected latency inflated by the recent error rate"""
+        if self.requests == 0:
+            # Untried hosts go first so every host gets measured
+            return 0
+        latency = self.latency if self.latency is not None else INITIAL_LATENCY
+        return latency * (1 + 4 * self.error_rate)
+
+class CdnPool:
+    """Keeps several upstream CDN hosts, scores them by EWMA latency and error rate,
+    ejects hosts after repeated failures and refreshes the pool in the background."""
+
+    def __init__(self, discover_fn, size: int = CDN_POOL_SIZE, refresh_interval: float = CDN_POOL_REFRESH_INTERVAL):
+        # discover_fn() returns one CDN host name (or None); it may return a different host each call
+        self.discover_fn = discover_fn
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._first_lock = threading.Lock()
+        self._refresh_now = threading.Event()
+        self._thread = None
+        self._stats = {
+            'picks': 0,
+            'ejections': 0,
+            'refreshes': 0,
+            'discovery_errors': 0
+        }
+
+    def pick(self, exclude=()):
+        """Best healthy host (not in exclude), or None while the pool is empty"""
+        self.start()
+        now = time.time()
+        with self._lock:
+            candidates = [h for h in self._hosts.values() if h.name not in exclude]
+            if not candidates:
+                return None
+            healthy = [h for h in candidates if h.ejected_until <= now]
+            self._stats['picks'] += 1
+            if healthy:
+                if len(healthy) > 1 and random.random() < EXPLORE_RATE:
+                    return random.choice(healthy).name
+                return min(healthy, key=_Host.score).name
+        # Everything is ejected: use the host that comes back soonest and look for new ones
+        self._refresh_now.set()
+        return min(candidates, key=lambda h: h.ejected_until).name
+
+    def add(self, name):
+        """Register a discovered host (or mark an existing one as still advertised)"""
+        with self._lock:
+            host = self._hosts.get(name)
+            if host is None:
+                self._hosts[name] = _Host(name)
+                logging.info(f"CDN pool added {name}")
+            else:
+                host.last_discovered = time.time()
+
+    def record(self, name, latency, ok):
+        """Feed one request outcome into the host's EWMA latency and error rate"""
+        with self._lock:
+            host = self._hosts.get(name)
+            if host is None:
+                return
+            host.requests += 1
+            host.error_rate += CDN_EWMA_ALPHA * ((0.0 if ok else 1.0) - host.error_rate)
+            if ok:
+                host.latency = latency if host.latency is None else host.latency + CDN_EWMA_ALPHA * (latency - host.latency)
+                host.consecutive_failures = 0
+                host.ejections = 0
+                return
+
+            host.failures += 1
+            host.consecutive_failures += 1
+            if host.consecutive_failures < CDN_EJECT_FAILURES or host.ejected_until > time.time():
+                return
+            # Back off exponentially for hosts that keep failing after coming back
+            host.ejections += 1
+            duration = min(CDN_EJECT_SECONDS * 2 ** (host.ejections - 1), MAX_EJECT_SECONDS)
+            host.ejected_until = time.time() + duration
+            host.consecutive_failures = 0
+            self._stats['ejections'] += 1
+            healthy = sum(1 for h in self._hosts.values() if h.ejected_until <= time.time())
+        logging.warning(f"CDN {name} ejected for {duration}s after {CDN_EJECT_FAILURES} consecutive failures")
+        if healthy < 2:
+            self._refresh_now.set()
+
+    def refresh(self, if_empty=False):
+        """Discover hosts until the pool is full (bounded number of discovery calls).
+
+        With if_empty, make at most one discovery call and only while the pool is
+        empty; the background thread fills the rest of the pool.
+        """
+        if if_empty:
+            self._discover_first()
+            return
+        with self._refresh_lock:
+            seen = set()
+            for _ in range(self.size * 2):
+                name = self._discover()
+                if name:
+                    self.add(name)
+                    seen.add(name)
+                if len(seen) >= self.size:
+                    break
+            self._prune()
+            self._stats['refreshes'] += 1
+
+    def _discover_first(self):
+        # Serialised so a cold start under load makes one discovery call, not one per request
+        with self._first_lock:
+            if self._hosts:
+                return
+            name = self._discover()
+            if name:
+                self.add(name)
+        self._refresh_now.set()
+
+    def _discover(self):
+        try:
+            return self.discover_fn()
+        except Exception as e:
+            self._stats['discovery_errors'] += 1
+            logging.warning(f"CDN discovery failed: {str(e)}")
+            return None
+
+    def start(self):
+        """Start the background refresher (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="cdn-pool-refresh", daemon=True)
+            self._thread.start()
+
+    def get_stats(self):
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hosts'] = {
+                h.name: {
+                    'latency_ms': round(h.latency * 1000, 1) if h.latency is not None else None,
+                    'error_rate': round(h.error_rate, 3),
+                    'requests': h.requests,
+                    'failures': h.failures,
+                    'ejected': h.ejected_until > now
+                }
+                for h in self._hosts.values()
+            }
+            return stats
+
+    def _prune(self):
+        """Forget hosts discovery stopped advertising, keeping the pool within size"""
+        now = time.time()
+        with self._lock:
+            stale = [h.name for h in self._hosts.values() if now - h.last_discovered > CDN_HOST_TTL]
+            for name in stale[:max(0, len(self._hosts) - 1)]:
+                del self._hosts[name]
+            overflow = len(self._hosts) - self.size
+            if overflow > 0:
+                worst = sorted(self._hosts.values(), key=lambda h: (h.ejected_until <= now, -h.score()))
+                for host in worst[:overflow]:
+                    del self._hosts[host.name]
+
+    def _run(self):
+        while True:
+            self.refresh()
+            self._refresh_now.wait(self.refresh_interval)
+            self._refresh_now.clear()
@@ -1,32 +1,138 @@
 import asyncio
 import logging
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
-from config import MONGO_DB_URI
+import threading
+import time
+from pymongo import MongoClient, ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from config import (
+    MONGO_DB_URI, STATS_RECONCILE_INTERVAL,
+    VIDEO_DOC_CACHE_TTL, VIDEO_DOC_NEGATIVE_TTL, VIDEO_DOC_CACHE_MAX_ENTRIES, WRITE_BEHIND_ENABLED
+)
+from cache_manager import CacheManager
+from query_profiler import SlowQueryProfiler
+from write_buffer import WriteBehindBuffer
+from video_ids import canonical_video_id
+import metrics
+
+STATS_DOC_ID = "video_counters"
+TELEGRAM_URL_FIELDS = {
+    "video": ("video_telegram_url", "videos_with_telegram_video"),
+    "audio": ("audio_telegram_url", "videos_with_telegram_audio")
+}
+
+# Field projections so lookups only ship the fields callers read
+VIDEO_INFO_PROJECTION = {"_id": 0, "video_id": 1, "title": 1, "duration": 1, "thumbnail": 1, "key": 1}
+# Everything the request path reads from a video document; this is what the document cache holds
+VIDEO_DOC_PROJECTION = dict(
+    VIDEO_INFO_PROJECTION,
+    video_telegram_url=1, video_quality=1, video_file_id=1, video_url_refreshed_at=1,
+    audio_telegram_url=1, audio_quality=1, audio_file_id=1, audio_url_refreshed_at=1
+)
 
 class DatabaseManager:
     def __init__(self):
         self.mongo_uri = MONGO_DB_URI
-        self.client = None
-        self.db = None
+        self._client = None
+        self._db = None
+        self._videos_collection = None
+        self._stats_collection = None
+        self._write_buffer = None
+        self._connected = False
+        self._connect_lock = threading.Lock()
         self.async_client = None
         self.async_db = None
-        self.setup_database()
+        self._reconciler = None
+        self._reconciler_lock = threading.Lock()
+        self.query_profiler = SlowQueryProfiler()
+        # Read-through cache of video documents keyed by video_id (False marks a known miss)
+        self.doc_cache = CacheManager(max_entries=VIDEO_DOC_CACHE_MAX_ENTRIES)
+        # The client is created on first use (or by warm_up) so importing this module does no I/O
+    
+    # Connection state is created lazily; these accessors connect on first use
+    @property
+    def client(self):
+        self._ensure_connected()
+        return self._client
+    
+    @property
+    def db(self):
+        self._ensure_connected()
+        return self._db
+    
+    @property
+    def videos_collection(self):
+        self._ensure_connected()
+        return self._videos_collection
+    
+    @property
+    def stats_collection(self):
+        self._ensure_connected()
+        return self._stats_collection
+    
+    @property
+    def write_buffer(self):
+        """Batches video writes off the request path (None writes through immediately)"""
+        self._ensure_connected()
+        return self._write_buffer
+    
+    def _ensure_connected(self):
+        if self._connected:
+            return
+        with self._connect_lock:
+            if not self._connected:
+                self.setup_database()
+                self._connected = True
+    
+    async def _ensure_connected_async(self):
+        """_ensure_connected for event loops: the sync client (and write-behind buffer) is built in an executor"""
+        if not self._connected:
+            await asyncio.get_running_loop().run_in_executor(None, self._ensure_connected)
     
     def setup_database(self):
         """Setup synchronous MongoDB connection"""
         try:
-            self.client = MongoClient(self.mongo_uri)
-            self.db = self.client.ytdownloader
-            self.videos_collection = self.db.videos
+            self._client = MongoClient(self.mongo_uri, event_listeners=[self.query_profiler])
+            self.query_profiler.client = self._client
+            self._db = self._client.ytdownloader
+            self._videos_collection = self._db.videos
+            # Incrementally maintained counters so stats never scan the videos collection
+            self._stats_collection = self._db.stats
+            if WRITE_BEHIND_ENABLED:
+                self._write_buffer = WriteBehindBuffer(
+                    self._videos_collection, self._increment_counters, insert_counter="total_videos"
+                )
             logging.info("Connected to MongoDB Atlas successfully")
         except Exception as e:
             logging.error(f"Failed to connect to MongoDB: {str(e)}")
             raise
     
+    def warm_up(self):
+        """Open a pooled connection and ensure indexes before the first request needs them"""
+        self.client.admin.command("ping")
+        self.ensure_indexes()
+    
+    async def warm_up_async(self):
+        """Open a pooled connection for the motor client on the running loop"""
+        if not self.async_client:
+            await self.setup_async_database()
+        await self.async_client.admin.command("ping")
+    
+    def ensure_indexes(self):
+        """Create the indexes every lookup relies on (no-op when they already exist)"""
+        try:
+            self.videos_collection.create_index([("video_id", ASCENDING)], unique=True, name="video_id_unique")
+            self.videos_collection.create_index([("video_telegram_url", ASCENDING)], sparse=True, name="video_telegram_url_sparse")
+            self.videos_collection.create_index([("audio_telegram_url", ASCENDING)], sparse=True, name="audio_telegram_url_sparse")
+            logging.info("MongoDB indexes ensured")
+        except Exception as e:
+            # e.g. duplicate video_id documents from before the unique index existed
+            logging.error(f"Failed to ensure MongoDB indexes: {str(e)}")
+    
     async def setup_async_database(self):
         """Setup asynchronous MongoDB connection"""
         try:
+            # Imported here: motor is only needed by the async serving mode
+            from motor.motor_asyncio import AsyncIOMotorClient
             self.async_client = AsyncIOMotorClient(self.mongo_uri)
             self.async_db = self.async_client.ytdownloader
             self.async_videos_collection = self.async_db.videos
@@ -37,36 +143,129 @@ class DatabaseManager:
     
     def find_video_by_url(self, video_url):
         """Find video data by URL - sync version"""
+        # Extract video ID from URL
+        video_id = self.extract_video_id(video_url)
+        if not video_id:
+            return None
+        return self.get_video(video_id)
+    
+    def get_video(self, video_id, fresh=False):
+        """Read-through lookup of a video document; fresh=True bypasses the cached copy"""
+        if not fresh:
+            cached = self.doc_cache.get(video_id)
+            if cached is not None:
+                return cached or None
+        
         try:
-            # Extract video ID from URL
-            video_id = self.extract_video_id(video_url)
-            if not video_id:
-                return None
-            
-            result = self.videos_collection.find_one({"video_id": video_id})
-            return result
+            with metrics.timed("mongo_lookup") as timer:
+                doc = self.videos_collection.find_one({"video_id": video_id}, VIDEO_DOC_PROJECTION)
+                timer.outcome = "found" if doc else "missing"
         except Exception as e:
             logging.error(f"Error finding video: {str(e)}")
             return None
+        
+        doc = self._with_pending(video_id, doc)
+        if doc:
+            self.doc_cache.set(video_id, doc, ttl=VIDEO_DOC_CACHE_TTL)
+        else:
+            self.doc_cache.set(video_id, False, ttl=VIDEO_DOC_NEGATIVE_TTL)
+        return doc
+    
+    def get_videos(self, video_ids):
+        """Read-through lookup of many video documents with one $in query; returns {video_id: doc}"""
+        found, missing = self._cached_videos(video_ids)
+        if missing:
+            try:
+                with metrics.timed("mongo_lookup"):
+                    docs = list(self.videos_collection.find({"video_id": {"$in": missing}}, VIDEO_DOC_PROJECTION))
+                self._cache_fetched_videos(missing, docs, found)
+            except Exception as e:
+                logging.error(f"Error finding videos: {str(e)}")
+        return found
+    
+    def _cached_videos(self, video_ids):
+        """Split video_ids into cached documents and ids that need a query"""
+        found = {}
+        missing = []
+        for video_id in dict.fromkeys(video_ids):
+            cached = self.doc_cache.get(video_id)
+            if cached is None:
+                missing.append(video_id)
+            elif cached:
+                found[video_id] = cached
+        return found, missing
+    
+    def _cache_fetched_videos(self, queried_ids, docs, found):
+        fetched = {doc["video_id"]: doc for doc in docs}
+        for video_id in queried_ids:
+            doc = self._with_pending(video_id, fetched.get(video_id))
+            if doc:
+                found[video_id] = doc
+                self.doc_cache.set(video_id, doc, ttl=VIDEO_DOC_CACHE_TTL)
+            else:
+                self.doc_cache.set(video_id, False, ttl=VIDEO_DOC_NEGATIVE_TTL)
+    
+    def _with_pending(self, video_id, doc):
+        """Overlay writes still queued in the write-behind buffer onto a fetched document"""
+        if self.write_buffer is None:
+            return doc
+        doc = self.write_buffer.overlay(video_id, doc)
+        if doc is None:
+            return None
+        return {k: v for k, v in doc.items() if k in VIDEO_DOC_PROJECTION}
+    
+    def _update_cached_video(self, video_id, fields):
+        """Apply a write to the cached document so readers see it without a round trip"""
+        cached = self.doc_cache.get(video_id)
+        if cached:
+            doc = dict(cached)
+        elif all(field in fields for field in VIDEO_INFO_PROJECTION if field != "_id"):
+            doc = {}
+        else:
+            # Partial write and nothing cached: drop any negative entry, next read refetches
+            self.doc_cache.delete(video_id)
+            return
+        doc.update({k: v for k, v in fields.items() if k in VIDEO_DOC_PROJECTION})
+        doc["video_id"] = video_id
+        self.doc_cache.set(video_id, doc, ttl=VIDEO_DOC_CACHE_TTL)
     
     async def find_video_by_url_async(self, video_url):
         """Find video data by URL - async version"""
+        video_id = self.extract_video_id(video_url)
+        if not video_id:
+            return None
+        return await self.get_video_async(video_id)
+    
+    async def get_video_async(self, video_id, fresh=False):
+        """Read-through lookup of a video document - async version sharing the document cache"""
+        if not fresh:
+            cached = self.doc_cache.get(video_id)
+            if cached is not None:
+                return cached or None
+        
         try:
             if not self.async_client:
                 await self.setup_async_database()
-            
-            video_id = self.extract_video_id(video_url)
-            if not video_id:
-                return None
-            
-            result = await self.async_videos_collection.find_one({"video_id": video_id})
-            return result
+            with metrics.timed("mongo_lookup") as timer:
+                doc = await self.async_videos_collection.find_one({"video_id": video_id}, VIDEO_DOC_PROJECTION)
+                timer.outcome = "found" if doc else "missing"
+            # _with_pending reads the write-behind buffer, which needs the sync client
+            await self._ensure_connected_async()
         except Exception as e:
             logging.error(f"Error finding video async: {str(e)}")
             return None
+        
+        doc = self._with_pending(video_id, doc)
+        if doc:
+            self.doc_cache.set(video_id, doc, ttl=VIDEO_DOC_CACHE_TTL)
+        else:
+            self.doc_cache.set(video_id, False, ttl=VIDEO_DOC_NEGATIVE_TTL)
+        return doc
     
     def save_video_data(self, video_data):
         """Save video data to MongoDB - sync version"""
+        if self.write_buffer is not None:
+            return self._buffer_video_data(video_data)
         try:
             # Upsert based on video_id
             result = self.videos_collection.update_one(
@@ -74,14 +273,52 @@ class DatabaseManager:
                 {"$set": video_data},
                 upsert=True
             )
+            if result.upserted_id is not None:
+                self._increment_counters({"total_videos": 1})
+            self._update_cached_video(video_data["video_id"], video_data)
             logging.info(f"Video data saved: {video_data['video_id']}")
             return True
         except Exception as e:
             logging.error(f"Error saving video data: {str(e)}")
             return False
     
+    def save_videos_bulk(self, videos):
+        """Upsert many video documents with a single unordered bulk_write"""
+        if not videos:
+            return True
+        if self.write_buffer is not None:
+            # The buffer flushes these (and anything else queued) as one bulk write
+            return all([self._buffer_video_data(video_data) for video_data in videos])
+        requests = [UpdateOne({"video_id": v["video_id"]}, {"$set": v}, upsert=True) for v in videos]
+        try:
+            result = self.videos_collection.bulk_write(requests, ordered=False)
+            upserted, failed = result.upserted_count, set()
+        except BulkWriteError as e:
+            # Unordered: everything except the reported writes was applied
+            upserted = e.details.get("nUpserted", 0)
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            logging.error(f"Bulk save failed for {len(failed)} of {len(videos)} videos")
+        except Exception as e:
+            logging.error(f"Error bulk saving video data: {str(e)}")
+            return False
+        
+        if upserted:
+            self._increment_counters({"total_videos": upserted})
+        for index, video_data in enumerate(videos):
+            if index not in failed:
+                self._update_cached_video(video_data["video_id"], video_data)
+        logging.info(f"Bulk saved {len(videos) - len(failed)} videos ({upserted} new)")
+        return not failed
+    
     async def save_video_data_async(self, video_data):
         """Save video data to MongoDB - async version"""
+        try:
+            await self._ensure_connected_async()
+        except Exception as e:
+            logging.error(f"Error saving video data async: {str(e)}")
+            return False
+        if self.write_buffer is not None:
+            return self._buffer_video_data(video_data)
         try:
             if not self.async_client:
                 await self.setup_async_database()
@@ -91,37 +328,164 @@ class DatabaseManager:
                 {"$set": video_data},
                 upsert=True
             )
+            if result.upserted_id is not None:
+                await self.async_db.stats.update_one(
+                    {"_id": STATS_DOC_ID}, {"$inc": {"total_videos": 1}}, upsert=True
+                )
+            self._update_cached_video(video_data["video_id"], video_data)
             logging.info(f"Video data saved async: {video_data['video_id']}")
             return True
         except Exception as e:
             logging.error(f"Error saving video data async: {str(e)}")
             return False
     
+    def _buffer_video_data(self, video_data):
+        """Queue a video upsert on the write-behind buffer; readers see it immediately"""
+        self.write_buffer.add(video_data["video_id"], video_data, upsert=True)
+        self._update_cached_video(video_data["video_id"], video_data)
+        logging.info(f"Video data queued: {video_data['video_id']}")
+        return True
+    
+    async def get_videos_async(self, video_ids):
+        """Async version of get_videos"""
+        found, missing = self._cached_videos(video_ids)
+        if missing:
+            try:
+                if not self.async_client:
+                    await self.setup_async_database()
+                with metrics.timed("mongo_lookup"):
+                    cursor = self.async_videos_collection.find({"video_id": {"$in": missing}}, VIDEO_DOC_PROJECTION)
+                    docs = await cursor.to_list(length=None)
+                await self._ensure_connected_async()
+                self._cache_fetched_videos(missing, docs, found)
+            except Exception as e:
+                logging.error(f"Error finding videos async: {str(e)}")
+        return found
+    
+    async def save_videos_bulk_async(self, videos):
+        """Async version of save_videos_bulk"""
+        if not videos:
+            return True
+        try:
+            await self._ensure_connected_async()
+        except Exception as e:
+            logging.error(f"Error bulk saving video data async: {str(e)}")
+            return False
+        if self.write_buffer is not None:
+            return all([self._buffer_video_data(video_data) for video_data in videos])
+        requests = [UpdateOne({"video_id": v["video_id"]}, {"$set": v}, upsert=True) for v in videos]
+        try:
+            if not self.async_client:
+                await self.setup_async_database()
+            result = await self.async_videos_collection.bulk_write(requests, ordered=False)
+            upserted, failed = result.upserted_count, set()
+        except BulkWriteError as e:
+            upserted = e.details.get("nUpserted", 0)
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            logging.error(f"Bulk save failed async for {len(failed)} of {len(videos)} videos")
+        except Exception as e:
+            logging.error(f"Error bulk saving video data async: {str(e)}")
+            return False
+        
+        if upserted:
+            await self.async_db.stats.update_one(
+                {"_id": STATS_DOC_ID}, {"$inc": {"total_videos": upserted}}, upsert=True
+            )
+        for index, video_data in enumerate(videos):
+            if index not in failed:
+                self._update_cached_video(video_data["video_id"], video_data)
+        logging.info(f"Bulk saved async {len(videos) - len(failed)} videos ({upserted} new)")
+        return not failed
+    
     def extract_video_id(self, url):
         """Extract YouTube video ID from URL"""
-        import re
-        patterns = [
-            r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([^&\n?#]+)',
-            r'youtube\.com\/v\/([^&\n?#]+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        return None
+        return canonical_video_id(url)
     
-    def get_stats(self):
-        """Get database statistics"""
+    def save_telegram_upload(self, video_id, file_type, update_data):
+        """Record a finished Telegram upload and bump the matching counter"""
+        url_field, counter = TELEGRAM_URL_FIELDS[file_type]
+        if self.write_buffer is not None:
+            # The flush applies the same $exists guard, so the counter still moves once per URL
+            self.write_buffer.add(video_id, update_data, first_set=(url_field, counter))
+            self._update_cached_video(video_id, update_data)
+            return True
+        try:
+            # Guarded update only matches documents that did not have the URL yet
+            result = self.videos_collection.update_one(
+                {"video_id": video_id, url_field: {"$exists": False}},
+                {"$set": update_data}
+            )
+            if result.modified_count:
+                self._increment_counters({counter: 1})
+            else:
+                self.videos_collection.update_one({"video_id": video_id}, {"$set": update_data})
+            self._update_cached_video(video_id, update_data)
+            return True
+        except Exception as e:
+            logging.error(f"Error saving Telegram upload: {str(e)}")
+            return False
+    
+    def update_video(self, video_id, fields):
+        """$set fields on an existing video document (e.g. a refreshed Telegram URL)"""
+        if self.write_buffer is not None:
+            self.write_buffer.add(video_id, fields)
+        else:
+            try:
+                self.videos_collection.update_one({"video_id": video_id}, {"$set": fields})
+            except Exception as e:
+                logging.error(f"Error updating video {video_id}: {str(e)}")
+                return False
+        self._update_cached_video(video_id, fields)
+        return True
+    
+    def _increment_counters(self, increments):
         try:
-            total_videos = self.videos_collection.count_documents({})
-            video_count = self.videos_collection.count_documents({"video_telegram_url": {"$exists": True}})
-            audio_count = self.videos_collection.count_documents({"audio_telegram_url": {"$exists": True}})
+            self.stats_collection.update_one({"_id": STATS_DOC_ID}, {"$inc": increments}, upsert=True)
+        except Exception as e:
+            # Counters are best effort; the background reconciler corrects drift
+            logging.warning(f"Failed to update stats counters: {str(e)}")
+    
+    def reconcile_stats(self):
+        """Recount the videos collection and overwrite the counters document"""
+        counters = {
+            "total_videos": self.videos_collection.count_documents({}),
+            "videos_with_telegram_video": self.videos_collection.count_documents({"video_telegram_url": {"$exists": True}}),
+            "videos_with_telegram_audio": self.videos_collection.count_documents({"audio_telegram_url": {"$exists": True}})
+        }
+        self.stats_collection.update_one(
+            {"_id": STATS_DOC_ID},
+            {"$set": dict(counters, reconciled_at=time.time())},
+            upsert=True
+        )
+        logging.info(f"Reconciled video counters: {counters}")
+        return counters
+    
+    def start_stats_reconciler(self, interval=STATS_RECONCILE_INTERVAL):
+        """Periodically recount in a daemon thread (idempotent)"""
+        with self._reconciler_lock:
+            if self._reconciler is not None:
+                return
             
+            def reconcile_loop():
+                while True:
+                    try:
+                        self.reconcile_stats()
+                    except Exception as e:
+                        logging.error(f"Stats reconciliation failed: {str(e)}")
+                    time.sleep(interval)
+            
+            self._reconciler = threading.Thread(target=reconcile_loop, name="stats-reconciler", daemon=True)
+            self._reconciler.start()
+    
+    def get_stats(self):
+        """Get database statistics from the counters document (O(1))"""
+        self.start_stats_reconciler()
+        try:
+            counters = self.stats_collection.find_one({"_id": STATS_DOC_ID}, {"_id": 0, "reconciled_at": 0}) or {}
             return {
-                "total_videos": total_videos,
-                "videos_with_telegram_video": video_count,
-                "videos_with_telegram_audio": audio_count
+                "total_videos": counters.get("total_videos", 0),
+                "videos_with_telegram_video": counters.get("videos_with_telegram_video", 0),
+                "videos_with_telegram_audio": counters.get("videos_with_telegram_audio", 0)
             }
         except Exception as e:
             logging.error(f"Error getting stats: {str(e)}")
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from config import (
+    HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_DEFAULT_DELAY,
+    HEDGE_BUDGET, HEDGE_BURST, HEDGE_MAX_WORKERS
+)
+
+LATENCY_WINDOW = 500
+# Below this many samples the percentile is noise; use the configured default delay
+MIN_SAMPLES = 20
+
+class Hedger:
+    """Sends a duplicate request to another host when the first is slower than a latency percentile.
+
+    Hedges are paid for from a token bucket that earns `budget` tokens per request,
+    so they add at most that fraction of extra upstream load (plus a small burst).
+    """
+
+    def __init__(self, enabled: bool = HEDGE_ENABLED, percentile: float = HEDGE_PERCENTILE,
+                 budget: float = HEDGE_BUDGET, burst: float = HEDGE_BURST, max_workers: int = HEDGE_MAX_WORKERS):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._stats = {
+            'requests': 0,
+            'hedged': 0,
+            'hedge_wins': 0,
+            'over_budget': 0
+        }
+
+    def delay(self):
+        """Seconds to wait on the first request before hedging"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(HEDGE_MIN_DELAY, samples[index])
+
+    def run(self, fn, primary, pick_alternate):
+        """Return fn(primary), or fn(alternate) if that answers first once the delay has passed"""
+        self._earn()
+        first = self._executor.submit(self._timed, fn, primary)
+        try:
+            return first.result(timeout=self.delay())
+        except FutureTimeoutError:
+            pass
+
+        alternate = pick_alternate()
+        if alternate is None or not self._spend():
+            return first.result()
+
+        logging.info(f"Hedging slow request to {primary} with {alternate}")
+        hedge = self._executor.submit(self._timed, fn, alternate)
+        pending = {first, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count('hedge_wins')
+                    # The loser keeps running to its own timeout; threads cannot be cancelled
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def run_async(self, coro_fn, primary, pick_alternate):
+        """asyncio version of run(); the losing request is cancelled"""
+        self._earn()
+        tasks = [asyncio.ensure_future(self._timed_async(coro_fn, primary))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay())
+            if done:
+                return tasks[0].result()
+
+            alternate = pick_alternate()
+            if alternate is None or not self._spend():
+                return await tasks[0]
+
+            logging.info(f"Hedging slow request to {primary} with {alternate}")
+            tasks.append(asyncio.ensure_future(self._timed_async(coro_fn, alternate)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            self._count('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tokens'] = round(self._tokens, 2)
+            stats['enabled'] = self.enabled
+        stats['delay_ms'] = round(self.delay() * 1000, 1)
+        return stats
+
+    def _timed(self, fn, target):
+        start = time.time()
+        result = fn(target)
+        self._record(time.time() - start)
+        return result
+
+    async def _timed_async(self, coro_fn, target):
+        start = time.time()
+        result = await coro_fn(target)
+        self._record(time.time() - start)
+        return result
+
+    def _record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _earn(self):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def _spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                self._stats['over_budget'] += 1
+                return False
+            self._tokens -= 1
+            self._stats['hedged'] += 1
+            return True
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,218 @@
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from config import (
+    MEDIA_CACHE_ENABLED, MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_BASE_URL, MEDIA_CACHE_MAX_AGE
+)
+
+# Extensions generate_filename produces per file type, with the content types they are served as
+MEDIA_TYPES = {
+    'video': {'.mp4': 'video/mp4'},
+    'audio': {'.mp3': 'audio/mpeg', '.m4a': 'audio/mp4'}
+}
+PART_SUFFIX = ".part"
+# Partial files this old belong to a download that died with its process
+STALE_PART_SECONDS = 3600
+
+_SAFE_VIDEO_ID = re.compile(r'[A-Za-z0-9_-]+')
+
+class CachedMedia:
+    """A file in the media cache, as found by MediaCache.lookup"""
+    __slots__ = ('path', 'size', 'etag', 'content_type', 'filename')
+
+    def __init__(self, path, stat, content_type):
+        self.path = path
+        self.size = stat.st_size
+        # Same format as aiohttp's FileResponse, so both apps answer If-None-Match alike
+        self.etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        self.content_type = content_type
+        self.filename = os.path.basename(path)
+
+class MediaWriter:
+    """Receives a download chunk by chunk; the file becomes visible only when finish() commits it"""
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        self.size = 0
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.directory, suffix=PART_SUFFIX)
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        """Append a chunk; never raises, a failing or oversize write just drops the copy"""
+        if self._file is None:
+            return
+        self.size += len(chunk)
+        if self.size > self.cache.max_bytes:
+            logging.info(f"Not caching {self.path}: larger than the whole media cache")
+            self.abort()
+            return
+        try:
+            self._file.write(chunk)
+        except OSError as e:
+            logging.warning(f"Media cache write failed for {self.path}: {str(e)}")
+            self.abort()
+
+    def finish(self):
+        """Publish the complete file and evict older files beyond the size cap"""
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            self._file = None
+            self.cache._commit(self.temp_path, self.path, self.size)
+            self.temp_path = None
+        except OSError as e:
+            logging.warning(f"Media cache commit failed for {self.path}: {str(e)}")
+            self.abort()
+
+    def abort(self):
+        """Drop the partial file; a no-op once finished or aborted"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.temp_path is not None:
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
+            self.cache._record('aborted')
+        self.temp_path = None
+
+class MediaCache:
+    """Size-capped directory of downloaded media, evicting the least recently served bytes first.
+
+    Paths derive from (video_id, file_type), so every worker process shares the
+    same files without an index; a hit stamps the file's atime explicitly
+    (noatime mounts included) and eviction orders by it.
+    """
+
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES,
+                 base_url=MEDIA_CACHE_BASE_URL, enabled=MEDIA_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.base_url = base_url.rstrip("/")
+        self.max_age = MEDIA_CACHE_MAX_AGE
+        self.enabled = enabled
+        self._created = False
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stored': 0,
+            'stored_bytes': 0,
+            'evicted': 0,
+            'evicted_bytes': 0,
+            'aborted': 0
+        }
+
+    def _path(self, video_id, file_type, extension):
+        return os.path.join(self.directory, f"{video_id}.{file_type}{extension}")
+
+    def _record(self, stat, amount=1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def lookup(self, video_id, file_type):
+        """The cached file for a video, marked as recently used; None on a miss"""
+        if not self.enabled or file_type not in MEDIA_TYPES or not _SAFE_VIDEO_ID.fullmatch(video_id or ""):
+            return None
+        for extension, content_type in MEDIA_TYPES[file_type].items():
+            path = self._path(video_id, file_type, extension)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            try:
+                os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+            except OSError:
+                # A missed stamp only costs LRU accuracy
+                pass
+            self._record('hits')
+            return CachedMedia(path, stat, content_type)
+        self._record('misses')
+        return None
+
+    def url(self, video_id, file_type):
+        return f"{self.base_url}/{video_id}/{file_type}"
+
+    def is_local(self, url):
+        return self.enabled and url.startswith(f"{self.base_url}/")
+
+    def writer(self, video_id, file_type, extension):
+        """A MediaWriter for this file, or None when caching is off or the name is unusable"""
+        if not self.enabled or extension not in MEDIA_TYPES.get(file_type, {}) \
+                or not _SAFE_VIDEO_ID.fullmatch(video_id or ""):
+            return None
+        try:
+            if not self._created:
+                os.makedirs(self.directory, exist_ok=True)
+                self._created = True
+            return MediaWriter(self, self._path(video_id, file_type, extension))
+        except OSError as e:
+            logging.warning(f"Media cache unavailable: {str(e)}")
+            return None
+
+    def _commit(self, temp_path, path, size):
+        os.replace(temp_path, path)
+        with self._lock:
+            self._stats['stored'] += 1
+            self._stats['stored_bytes'] += size
+        logging.info(f"Cached {size} bytes at {path}")
+        try:
+            self._evict(keep=path)
+        except OSError as e:
+            logging.warning(f"Media cache eviction failed: {str(e)}")
+
+    def _evict(self, keep):
+        """Delete least recently served files until the directory fits in max_bytes"""
+        entries = []
+        total = 0
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(PART_SUFFIX):
+                    if now - stat.st_mtime > STALE_PART_SECONDS:
+                        self._remove(entry.path)
+                    continue
+                total += stat.st_size
+                entries.append((stat.st_atime, entry.path, stat.st_size))
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            # Readers that already opened the file keep streaming it
+            if self._remove(path):
+                total -= size
+                with self._lock:
+                    self._stats['evicted'] += 1
+                    self._stats['evicted_bytes'] += size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['enabled'] = self.enabled
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups * 100, 2) if lookups else 0
+        return stats
+
+# Global media cache instance
+media_cache = MediaCache()
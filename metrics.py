@@ -0,0 +1,133 @@
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds; covers sub-millisecond cache hits up to the 8s upstream timeout
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, in the Prometheus text format"""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # label values -> [per-bucket counts, sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, ("le", _format_bound(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram(
+    "ytdl_stage_duration_seconds",
+    "Time spent in each request-path stage, by outcome",
+    labels=("stage", "outcome")
+)
+TIER_REQUESTS = Counter(
+    "ytdl_tier_requests_total",
+    "Which tier answered each info or download lookup",
+    labels=("kind", "tier")
+)
+
+class timed:
+    """Time a block as `stage`; set .outcome on the timer to label it, exceptions record 'error'"""
+    # A plain class rather than @contextmanager: this wraps every cache lookup
+    __slots__ = ("stage", "outcome", "_start")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.outcome = "ok"
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.outcome = "error"
+        STAGE_SECONDS.observe(time.perf_counter() - self._start, self.stage, self.outcome)
+        return False
+
+def observe(stage, seconds, outcome="ok"):
+    STAGE_SECONDS.observe(seconds, stage, outcome)
+
+def record_tier(kind, tier):
+    """Count a lookup of kind ('info' or 'download') answered by tier"""
+    TIER_REQUESTS.inc(kind, tier)
+
+def tier_rates():
+    """Share of lookups answered by each tier, in percent, per kind"""
+    rates = {}
+    for (kind, tier), value in TIER_REQUESTS.values().items():
+        rates.setdefault(kind, {})[tier] = value
+    for kind, tiers in rates.items():
+        total = sum(tiers.values())
+        rates[kind] = {tier: round(value / total * 100, 2) for tier, value in tiers.items()}
+    return rates
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    lines = STAGE_SECONDS.render() + TIER_REQUESTS.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from config import PROBE_MAX_WORKERS, AVAILABILITY_TTL, UNAVAILABLE_TTL
+
+_PENDING = object()
+
+class QualityProber:
+    """Probe candidate qualities concurrently and return the best one that succeeds"""
+
+    def __init__(self, max_workers: int = PROBE_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quality-probe")
+
+    def probe(self, candidates, probe_fn, deadline=None):
+        """Run probe_fn for every candidate at once.
+
+        candidates must be in priority order. probe_fn returns a truthy result on
+        success and None on failure. Returns (candidate, result) for the highest
+        priority success as soon as every higher priority probe has failed, or
+        None if nothing succeeded within the deadline (seconds).
+        """
+        if not candidates:
+            return None
+
+        futures = {self._executor.submit(probe_fn, c): i for i, c in enumerate(candidates)}
+        results = [_PENDING] * len(candidates)
+        next_index = 0
+
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    logging.warning(f"Probe for {candidates[index]} raised: {str(e)}")
+                    results[index] = None
+
+                # Advance past failures; stop at the first success or unresolved probe
+                while next_index < len(candidates) and results[next_index] is not _PENDING:
+                    if results[next_index]:
+                        self._cancel(futures)
+                        return candidates[next_index], results[next_index]
+                    next_index += 1
+        except FuturesTimeoutError:
+            logging.warning(f"Probe deadline of {deadline}s exceeded for {candidates}")
+            self._cancel(futures)
+            # Settle for the best success that did arrive in time
+            for index, result in enumerate(results):
+                if result is not _PENDING and result:
+                    return candidates[index], result
+
+        return None
+
+    async def probe_async(self, candidates, probe_coro, deadline=None):
+        """asyncio version of probe(); probe_coro(candidate) is awaited for every candidate at once"""
+        if not candidates:
+            return None
+
+        tasks = [asyncio.ensure_future(probe_coro(c)) for c in candidates]
+        positions = {task: i for i, task in enumerate(tasks)}
+        results = [_PENDING] * len(candidates)
+        next_index = 0
+        pending = set(tasks)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + deadline if deadline is not None else None
+
+        try:
+            while pending:
+                timeout = None if end is None else max(0, end - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logging.warning(f"Probe deadline of {deadline}s exceeded for {candidates}")
+                    break
+                for task in done:
+                    index = positions[task]
+                    if task.exception() is not None:
+                        logging.warning(f"Probe for {candidates[index]} raised: {str(task.exception())}")
+                        results[index] = None
+                    else:
+                        results[index] = task.result()
+
+                while next_index < len(candidates) and results[next_index] is not _PENDING:
+                    if results[next_index]:
+                        return candidates[next_index], results[next_index]
+                    next_index += 1
+
+            # Deadline hit: settle for the best success that did arrive in time
+            for index, result in enumerate(results):
+                if result is not _PENDING and result:
+                    return candidates[index], result
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _cancel(self, futures):
+        """Cancel probes that have not started; running ones finish and are ignored"""
+        for future in futures:
+            future.cancel()
+
+class AvailabilityCache:
+    """Remembers which qualities exist (and which failed) per key and download type"""
+
+    def __init__(self, cache_manager, positive_ttl: int = AVAILABILITY_TTL, negative_ttl: int = UNAVAILABLE_TTL):
+        self.cache_manager = cache_manager
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._stats = {
+            'known_good_hits': 0,
+            'negative_hits': 0,
+            'probes_skipped': 0,
+            'recorded_available': 0,
+            'recorded_unavailable': 0
+        }
+
+    def _cache_key(self, key, download_type, quality):
+        return f"avail_{download_type}_{key}_{quality}"
+
+    def record(self, key, download_type, quality, available):
+        """Store a probe outcome; failures expire quickly so transient gaps heal"""
+        self.cache_manager.set(self._cache_key(key, download_type, quality), bool(available), ttl=self._ttl(available))
+        self._count_record(available)
+
+    async def record_async(self, key, download_type, quality, available):
+        """Async version of record, keeping shared-cache writes off the event loop"""
+        await self.cache_manager.set_async(
+            self._cache_key(key, download_type, quality), bool(available), ttl=self._ttl(available)
+        )
+        self._count_record(available)
+
+    def _ttl(self, available):
+        return self.positive_ttl if available else self.negative_ttl
+
+    def _count_record(self, available):
+        with self._lock:
+            self._stats['recorded_available' if available else 'recorded_unavailable'] += 1
+
+    def plan(self, key, download_type, candidates):
+        """Return the candidates worth probing, in priority order.
+
+        Known-unavailable qualities are dropped and everything below the best
+        known-good quality is cut, since that quality is expected to succeed.
+        """
+        planned = []
+        for quality in candidates:
+            status = self.cache_manager.get(self._cache_key(key, download_type, quality))
+            if self._plan_step(planned, quality, status):
+                break
+        return self._finish_plan(candidates, planned)
+
+    async def plan_async(self, key, download_type, candidates):
+        """Async version of plan, keeping shared-cache lookups off the event loop"""
+        planned = []
+        for quality in candidates:
+            status = await self.cache_manager.get_async(self._cache_key(key, download_type, quality))
+            if self._plan_step(planned, quality, status):
+                break
+        return self._finish_plan(candidates, planned)
+
+    def _plan_step(self, planned, quality, status):
+        """Add quality to planned unless known unavailable; True once a known-good quality ends the plan"""
+        if status is False:
+            with self._lock:
+                self._stats['negative_hits'] += 1
+            return False
+        planned.append(quality)
+        if status is True:
+            with self._lock:
+                self._stats['known_good_hits'] += 1
+            return True
+        return False
+
+    def _finish_plan(self, candidates, planned):
+        with self._lock:
+            self._stats['probes_skipped'] += len(candidates) - len(planned)
+        return planned
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,55 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import monitoring
+from config import SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN
+
+# Commands MongoDB can explain; everything else is only timed
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Session/transport fields the driver adds that explain must not receive
+DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+class SlowQueryProfiler(monitoring.CommandListener):
+    """Logs MongoDB commands slower than a threshold, with their query plan"""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, explain: bool = SLOW_QUERY_EXPLAIN):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.client = None
+        self._commands = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-explain")
+        self.slow_queries = 0
+
+    def started(self, event):
+        if self.explain and event.command_name in EXPLAINABLE_COMMANDS:
+            with self._lock:
+                self._commands[event.request_id] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event, "succeeded")
+
+    def failed(self, event):
+        self._finish(event, "failed")
+
+    def _finish(self, event, outcome):
+        with self._lock:
+            started = self._commands.pop(event.request_id, None)
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        self.slow_queries += 1
+        logging.warning(f"Slow MongoDB {event.command_name} {outcome} in {duration_ms:.1f}ms")
+        if started is not None and self.client is not None:
+            # Explain off the driver's thread; listeners must not block or issue commands inline
+            self._executor.submit(self._log_plan, event.command_name, *started)
+
+    def _log_plan(self, command_name, database_name, command):
+        try:
+            cmd = {k: v for k, v in command.items() if not k.startswith("$") and k not in DRIVER_FIELDS}
+            plan = self.client[database_name].command({"explain": cmd, "verbosity": "queryPlanner"})
+            winning = plan.get("queryPlanner", {}).get("winningPlan", plan)
+            logging.warning(f"Plan for slow {command_name}: {winning}")
+        except Exception as e:
+            logging.warning(f"Could not explain slow {command_name}: {str(e)}")
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into a single execution"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'executions': 0,
+            'shared': 0
+        }
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn once per key; concurrent callers wait and share its result or exception"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats['shared'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats['executions'] += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'executions': self._stats['executions'],
+                'shared': self._stats['shared'],
+                'in_flight': len(self._calls)
+            }
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight; callers await the leader's future"""
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {
+            'executions': 0,
+            'shared': 0
+        }
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        """Await coro_fn once per key; concurrent callers share its result or exception"""
+        future = self._calls.get(key)
+        if future is not None:
+            self._stats['shared'] += 1
+            # shield so one cancelled waiter does not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(coro_fn(*args, **kwargs))
+        self._calls[key] = future
+        self._stats['executions'] += 1
+        future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    def get_stats(self):
+        return {
+            'executions': self._stats['executions'],
+            'shared': self._stats['shared'],
+            'in_flight': len(self._calls)
+        }
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+# Imported first by the app modules, so this is (close to) process start
+_started = time.perf_counter()
+_last_mark = _started
+_lock = threading.Lock()
+_report = {
+    'phases_ms': {},
+    'ready_ms': None,
+    'warm_up_ms': {},
+    'warm_up_errors': {},
+    'warm_up_done': False
+}
+
+def _elapsed_ms(since):
+    return round((time.perf_counter() - since) * 1000, 1)
+
+def mark(phase):
+    """Record the time since the previous mark (or start) as `phase`"""
+    global _last_mark
+    now = time.perf_counter()
+    with _lock:
+        _report['phases_ms'][phase] = round((now - _last_mark) * 1000, 1)
+        _last_mark = now
+
+def ready():
+    """Record that the app can answer requests; warm-up may still be running"""
+    ready_ms = _elapsed_ms(_started)
+    with _lock:
+        _report['ready_ms'] = ready_ms
+        phases = ", ".join(f"{name} {ms}ms" for name, ms in _report['phases_ms'].items())
+    logging.info(f"Ready to serve after {ready_ms}ms ({phases})")
+
+def warm_up_in_background(steps):
+    """Run (name, fn) warm-up steps in parallel daemon threads while the app serves"""
+    threads = [
+        threading.Thread(target=_run_step, args=(name, fn), name=f"warm-up-{name}", daemon=True)
+        for name, fn in steps
+    ]
+    for thread in threads:
+        thread.start()
+
+    def wait_all():
+        for thread in threads:
+            thread.join()
+        with _lock:
+            _report['warm_up_done'] = True
+            steps_ms = ", ".join(f"{name} {ms}ms" for name, ms in _report['warm_up_ms'].items())
+        logging.info(f"Warm-up finished {_elapsed_ms(_started)}ms after start ({steps_ms})")
+
+    threading.Thread(target=wait_all, name="warm-up", daemon=True).start()
+
+async def warm_up_async(name, coro_fn):
+    """Run one async warm-up step on the current loop and record it like the threaded ones"""
+    start = time.perf_counter()
+    try:
+        await coro_fn()
+    except Exception as e:
+        _record_step(name, start, e)
+    else:
+        _record_step(name, start)
+
+def report():
+    with _lock:
+        return {
+            'phases_ms': dict(_report['phases_ms']),
+            'ready_ms': _report['ready_ms'],
+            'warm_up_ms': dict(_report['warm_up_ms']),
+            'warm_up_errors': dict(_report['warm_up_errors']),
+            'warm_up_done': _report['warm_up_done']
+        }
+
+def _run_step(name, fn):
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        _record_step(name, start, e)
+    else:
+        _record_step(name, start)
+
+def _record_step(name, start, error=None):
+    with _lock:
+        _report['warm_up_ms'][name] = _elapsed_ms(start)
+        if error is not None:
+            _report['warm_up_errors'][name] = str(error)
+    if error is not None:
+        # Not fatal: the component connects again on first use
+        logging.warning(f"Warm-up step {name} failed: {str(error)}")
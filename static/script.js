@@ -158,8 +158,8 @@ class YouTubeDownloader {
                     `${result.quality}p HD video` : 
                     `${result.format}${result.format && result.format.match(/^\d+$/) ? 'kbps' : ''} HD audio`;
                 
-                const sourceIcon = result.source === 'telegram' ? '⚡' : '🌐';
-                const sourceText = result.source === 'telegram' ? 'Telegram Cache' : 'Live';
+                const sourceLabels = {local: ['⚡', 'Local Cache'], telegram: ['⚡', 'Telegram Cache']};
+                const [sourceIcon, sourceText] = sourceLabels[result.source] || ['🌐', 'Live'];
                 
                 this.showAlert(`${sourceIcon} ${formatInfo} from ${sourceText} (${responseTime}ms)`, 'success');
             } else {
@@ -2,123 +2,364 @@ import asyncio
 import aiohttp
 import logging
 import os
+import threading
+import time
 from datetime import datetime
-from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID
+from config import (
+    TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID, TELEGRAM_API_URL, TELEGRAM_API_MODE, TELEGRAM_FILE_URL_BASE,
+    TELEGRAM_LOCAL_FILE_ROOT, TELEGRAM_MAX_UPLOAD_BYTES, TELEGRAM_UPLOAD_CHUNK_SIZE, TELEGRAM_STREAM_READ_TIMEOUT,
+    TELEGRAM_URL_UPLOAD_ENABLED, TELEGRAM_URL_UPLOAD_MAX_BYTES, TELEGRAM_URL_UPLOAD_TIMEOUT,
+    TELEGRAM_POOL_LIMIT, TELEGRAM_POOL_LIMIT_PER_HOST, TELEGRAM_KEEPALIVE_TIMEOUT, TELEGRAM_DNS_CACHE_TTL
+)
+import metrics
+
+class UploadTooLargeError(Exception):
+    """Raised mid-stream when a source file turns out to exceed the upload limit"""
+
+# Upload method per file extension: (form field, Bot API method, content type when streamed)
+SEND_METHODS = [
+    (('.mp4', '.mkv', '.avi'), ('video', 'sendVideo', 'video/mp4')),
+    (('.mp3', '.m4a', '.aac'), ('audio', 'sendAudio', 'audio/mpeg'))
+]
 
 class TelegramService:
     def __init__(self):
         self.bot_token = TELEGRAM_BOT_TOKEN
         self.channel_id = TELEGRAM_CHANNEL_ID
-        self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        self.api_url = TELEGRAM_API_URL
+        self.base_url = f"{self.api_url}/bot{self.bot_token}"
+        # 'cloud' or 'local' (self-hosted Bot API server); the upload limits below follow it
+        self.api_mode = TELEGRAM_API_MODE
+        self.file_url_base = TELEGRAM_FILE_URL_BASE.rstrip("/")
+        self.local_file_root = TELEGRAM_LOCAL_FILE_ROOT
+        self.max_upload_bytes = TELEGRAM_MAX_UPLOAD_BYTES
+        self.chunk_size = TELEGRAM_UPLOAD_CHUNK_SIZE
+        # The session's 300s total would cut off large streamed uploads; bound each read instead
+        self.stream_timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=TELEGRAM_STREAM_READ_TIMEOUT)
+        self.url_upload_enabled = TELEGRAM_URL_UPLOAD_ENABLED
+        self.url_upload_max_bytes = TELEGRAM_URL_UPLOAD_MAX_BYTES
+        # Long-lived pooled session, bound to the event loop that created it
+        self._session = None
+        self._session_loop = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'errors': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'total_latency_ms': 0.0,
+            'max_latency_ms': 0.0,
+            'sessions_created': 0,
+            'url_uploads': 0,
+            'url_upload_fallbacks': 0,
+            'proxied_uploads': 0
+        }
+    
+    async def get_session(self):
+        """Return the shared connection-pooled session, creating it on the current loop"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._session_loop is loop:
+            return self._session
+        
+        if self._session is not None and not self._session.closed:
+            # A session cannot be shared across event loops; the old loop owns its cleanup
+            logging.warning("Telegram session belongs to another event loop, creating a new one")
+        
+        connector = aiohttp.TCPConnector(
+            limit=TELEGRAM_POOL_LIMIT,
+            limit_per_host=TELEGRAM_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=TELEGRAM_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=TELEGRAM_DNS_CACHE_TTL
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=300),
+            trace_configs=[self._build_trace_config()]
+        )
+        self._session_loop = loop
+        with self._stats_lock:
+            self._stats['sessions_created'] += 1
+        return self._session
+    
+    async def close(self):
+        """Close the shared session; called when the owning event loop shuts down"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+    
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        connections = stats['connections_created'] + stats['connections_reused']
+        stats['connection_reuse_rate'] = round(stats['connections_reused'] / connections * 100, 2) if connections else 0
+        stats['avg_latency_ms'] = round(stats['total_latency_ms'] / stats['requests'], 2) if stats['requests'] else 0
+        stats['total_latency_ms'] = round(stats['total_latency_ms'], 2)
+        stats['max_latency_ms'] = round(stats['max_latency_ms'], 2)
+        stats['api_mode'] = self.api_mode
+        stats['max_upload_bytes'] = self.max_upload_bytes
+        stats['url_upload_max_bytes'] = self.url_upload_max_bytes
+        return stats
+    
+    def _build_trace_config(self):
+        """Trace hooks that count connection reuse and time each request"""
+        trace_config = aiohttp.TraceConfig()
+        
+        async def on_request_start(session, ctx, params):
+            ctx.start = time.perf_counter()
+        
+        async def on_request_end(session, ctx, params):
+            self._record_request(ctx, error=False)
+        
+        async def on_request_exception(session, ctx, params):
+            self._record_request(ctx, error=True)
+        
+        async def on_connection_create_end(session, ctx, params):
+            with self._stats_lock:
+                self._stats['connections_created'] += 1
+        
+        async def on_connection_reuseconn(session, ctx, params):
+            with self._stats_lock:
+                self._stats['connections_reused'] += 1
+        
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
     
-    async def upload_file_to_telegram(self, file_url, filename, caption=""):
-        """Upload file to Telegram channel and get download URL"""
+    def _record_request(self, ctx, error):
+        # Time to response headers; streamed bodies are not included
+        latency_ms = (time.perf_counter() - getattr(ctx, 'start', time.perf_counter())) * 1000
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            if error:
+                self._stats['errors'] += 1
+            self._stats['total_latency_ms'] += latency_ms
+            self._stats['max_latency_ms'] = max(self._stats['max_latency_ms'], latency_ms)
+    
+    async def upload_file_to_telegram(self, file_url, filename, caption="", sink=None):
+        """Upload a file from its source URL to the channel.
+
+        Video and audio within the URL-fetch limit are handed to Telegram as a URL,
+        so no bytes pass through this process; otherwise, or if Telegram cannot
+        fetch it, the source is streamed through us. A sink (media_cache.MediaWriter)
+        needs the bytes, so it always takes the streamed path. The result's
+        'ingest' says which path stored the file.
+        """
+        if self.url_upload_enabled and sink is None and self._send_method(filename) is not None:
+            start = time.perf_counter()
+            result = await self._upload_by_url(file_url, filename, caption)
+            seconds = time.perf_counter() - start
+            metrics.observe("telegram_ingest_url", seconds, "ok" if result else "failed")
+            if result:
+                self._count('url_uploads')
+                logging.info(f"Telegram fetched {filename} from its URL in {seconds:.1f}s")
+                return dict(result, ingest='url')
+            self._count('url_upload_fallbacks')
+            logging.info(f"Falling back to a streamed upload for {filename}")
+        
+        start = time.perf_counter()
+        result = await self._upload_proxied(file_url, filename, caption, sink)
+        seconds = time.perf_counter() - start
+        metrics.observe("telegram_ingest_proxy", seconds, "ok" if result else "failed")
+        if not result:
+            return None
+        self._count('proxied_uploads')
+        logging.info(f"Streamed {filename} through to Telegram in {seconds:.1f}s")
+        return dict(result, ingest='proxy')
+    
+    def _count(self, stat):
+        with self._stats_lock:
+            self._stats[stat] += 1
+    
+    def _send_method(self, filename):
+        """(form field, method, content type) for a video or audio filename; None for documents"""
+        for extensions, method in SEND_METHODS:
+            if filename.endswith(extensions):
+                return method
+        return None
+    
+    async def _upload_by_url(self, file_url, filename, caption):
+        """Have Telegram fetch file_url itself; None if it is too large or Telegram cannot fetch it"""
+        field, method, _ = self._send_method(filename)
+        try:
+            session = await self.get_session()
+            # Skip files known to exceed the URL-fetch limit; unknown sizes are left to Telegram
+            async with session.head(file_url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=10)) as head:
+                file_size = head.content_length if head.status == 200 else None
+            if file_size is not None and file_size > self.url_upload_max_bytes:
+                logging.info(f"{filename} is {file_size} bytes, above the URL upload limit")
+                return None
+            
+            data = {'chat_id': self.channel_id, 'caption': caption, field: file_url}
+            timeout = aiohttp.ClientTimeout(total=TELEGRAM_URL_UPLOAD_TIMEOUT)
+            with metrics.timed("telegram_upload") as timer:
+                async with session.post(f"{self.base_url}/{method}", data=data, timeout=timeout) as response:
+                    result = await response.json(content_type=None)
+                if not result.get('ok'):
+                    timer.outcome = "rejected"
+            if not result.get('ok'):
+                logging.warning(f"Telegram could not fetch {filename} by URL: {result.get('description')}")
+                return None
+            return await self._uploaded_file(result['result'], filename)
+        except Exception as e:
+            logging.warning(f"URL upload of {filename} failed: {str(e)}")
+            return None
+    
+    async def _uploaded_file(self, message, filename):
+        """Upload result for a sent message: its file_id and a download URL for the file"""
+        file_id = None
+        if 'video' in message:
+            file_id = message['video']['file_id']
+        elif 'audio' in message:
+            file_id = message['audio']['file_id']
+        elif 'document' in message:
+            file_id = message['document']['file_id']
+        
+        if not file_id:
+            logging.error("No file_id found in Telegram response")
+            return None
+        # Get file download URL
+        download_url = await self.get_file_download_url(file_id)
+        logging.info(f"Successfully uploaded {filename} to Telegram")
+        return {
+            'telegram_url': download_url,
+            'message_id': message['message_id'],
+            'file_id': file_id
+        }
+    
+    async def _upload_proxied(self, file_url, filename, caption, sink):
+        """Stream file from its source URL straight into a Telegram upload.
+
+        If given, sink receives a copy of every chunk and is finished once the
+        whole source has been read.
+        """
         try:
             logging.info(f"Starting Telegram upload for {filename}")
             
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300)) as session:
-                # Download file first
-                logging.info(f"Downloading file from: {file_url}")
-                async with session.get(file_url) as response:
-                    if response.status != 200:
-                        logging.error(f"Failed to download file: {response.status}")
-                        return None
-                    
-                    file_data = await response.read()
-                    file_size = len(file_data)
-                    logging.info(f"Downloaded file size: {file_size} bytes")
-                    
-                    # Check file size limit (50MB for Telegram)
-                    if file_size > 50 * 1024 * 1024:
-                        logging.error(f"File too large: {file_size} bytes (max 50MB)")
-                        return None
-                    
-                    # Prepare form data for Telegram upload
-                    data = aiohttp.FormData()
-                    data.add_field('chat_id', self.channel_id)
-                    data.add_field('caption', caption)
+            session = await self.get_session()
+            # Open the source download; the body is consumed chunk by chunk during upload
+            logging.info(f"Streaming file from: {file_url}")
+            download_start = time.perf_counter()
+            async with session.get(file_url, timeout=self.stream_timeout) as response:
+                # Time to the source's response headers; the body is transferred during the upload
+                download_seconds = time.perf_counter() - download_start
+                if response.status != 200:
+                    metrics.observe("telegram_download", download_seconds, "rejected")
+                    logging.error(f"Failed to download file: {response.status}")
+                    return None
+                
+                # Reject oversize files before any bytes are transferred when the size is known
+                file_size = response.content_length
+                if file_size is not None and file_size > self.max_upload_bytes:
+                    metrics.observe("telegram_download", download_seconds, "too_large")
+                    logging.error(f"File too large: {file_size} bytes (max {self.max_upload_bytes} bytes)")
+                    return None
+                metrics.observe("telegram_download", download_seconds)
+                logging.info(f"Source file size: {file_size if file_size is not None else 'unknown'} bytes")
+                
+                # Prepare form data for Telegram upload
+                data = aiohttp.FormData()
+                data.add_field('chat_id', self.channel_id)
+                data.add_field('caption', caption)
+                file_stream = self._stream_source(response, filename, sink)
+                
+                # Determine file type and upload accordingly
+                send_method = self._send_method(filename)
+                if send_method is not None:
+                    field, method, content_type = send_method
+                    data.add_field(field, file_stream, filename=filename, content_type=content_type)
+                    upload_url = f"{self.base_url}/{method}"
+                    logging.info(f"Uploading as {field}")
+                else:
+                    data.add_field('document', file_stream, filename=filename)
+                    upload_url = f"{self.base_url}/sendDocument"
+                    logging.info("Uploading as document")
+                
+                # Upload to Telegram
+                logging.info(f"Uploading to Telegram: {upload_url}")
+                # Includes streaming the source body, which is read as Telegram consumes it
+                with metrics.timed("telegram_upload") as timer:
+                    async with session.post(upload_url, data=data, timeout=self.stream_timeout) as upload_response:
+                        response_text = await upload_response.text()
+                        result = await upload_response.json() if upload_response.status == 200 else None
+                    if not result or not result.get('ok'):
+                        timer.outcome = "rejected"
+                logging.info(f"Telegram response status: {upload_response.status}")
+                
+                if upload_response.status == 200:
+                    logging.info(f"Telegram response: {result}")
                     
-                    # Determine file type and upload accordingly
-                    if filename.endswith(('.mp4', '.mkv', '.avi')):
-                        data.add_field('video', file_data, filename=filename, content_type='video/mp4')
-                        upload_url = f"{self.base_url}/sendVideo"
-                        logging.info("Uploading as video")
-                    elif filename.endswith(('.mp3', '.m4a', '.aac')):
-                        data.add_field('audio', file_data, filename=filename, content_type='audio/mpeg')
-                        upload_url = f"{self.base_url}/sendAudio"
-                        logging.info("Uploading as audio")
+                    if result.get('ok'):
+                        return await self._uploaded_file(result['result'], filename)
                     else:
-                        data.add_field('document', file_data, filename=filename)
-                        upload_url = f"{self.base_url}/sendDocument"
-                        logging.info("Uploading as document")
-                    
-                    # Upload to Telegram
-                    logging.info(f"Uploading to Telegram: {upload_url}")
-                    async with session.post(upload_url, data=data) as upload_response:
-                        response_text = await upload_response.text()
-                        logging.info(f"Telegram response status: {upload_response.status}")
-                        
-                        if upload_response.status == 200:
-                            result = await upload_response.json()
-                            logging.info(f"Telegram response: {result}")
-                            
-                            if result.get('ok'):
-                                # Get file info to create download URL
-                                message = result['result']
-                                file_id = None
-                                
-                                if 'video' in message:
-                                    file_id = message['video']['file_id']
-                                elif 'audio' in message:
-                                    file_id = message['audio']['file_id']
-                                elif 'document' in message:
-                                    file_id = message['document']['file_id']
-                                
-                                if file_id:
-                                    # Get file download URL
-                                    download_url = await self.get_file_download_url(file_id)
-                                    logging.info(f"Successfully uploaded {filename} to Telegram")
-                                    return {
-                                        'telegram_url': download_url,
-                                        'message_id': message['message_id'],
-                                        'file_id': file_id
-                                    }
-                                else:
-                                    logging.error("No file_id found in Telegram response")
-                                    return None
-                            else:
-                                logging.error(f"Telegram API error: {result}")
-                                return None
-                        else:
-                            logging.error(f"Failed to upload to Telegram: {upload_response.status}")
-                            logging.error(f"Telegram error response: {response_text}")
-                            return None
-                            
+                        logging.error(f"Telegram API error: {result}")
+                        return None
+                else:
+                    logging.error(f"Failed to upload to Telegram: {upload_response.status}")
+                    logging.error(f"Telegram error response: {response_text}")
+                    return None
+    
         except Exception as e:
+            # aiohttp wraps errors raised by the body generator in a connection error
+            too_large = e if isinstance(e, UploadTooLargeError) else e.__cause__
+            if isinstance(too_large, UploadTooLargeError):
+                logging.error(f"Aborted Telegram upload for {filename}: {str(too_large)}")
+                return None
             logging.error(f"Error uploading to Telegram: {str(e)}")
             import traceback
             logging.error(f"Full traceback: {traceback.format_exc()}")
             return None
     
+    async def _stream_source(self, response, filename, sink=None):
+        """Yield the source body in fixed-size chunks, enforcing the size limit as bytes arrive"""
+        transferred = 0
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            transferred += len(chunk)
+            if transferred > self.max_upload_bytes:
+                raise UploadTooLargeError(f"{filename} exceeded {self.max_upload_bytes} bytes")
+            if sink is not None:
+                # Buffered page-cache writes, cheap enough to do on the loop
+                sink.write(chunk)
+            yield chunk
+        logging.info(f"Streamed {transferred} bytes of {filename} to Telegram")
+        if sink is not None:
+            # Publishing may scan the cache directory to evict, so keep it off the loop
+            await asyncio.get_running_loop().run_in_executor(None, sink.finish)
+    
     async def get_file_download_url(self, file_id):
         """Get direct download URL for Telegram file"""
         try:
-            async with aiohttp.ClientSession() as session:
-                get_file_url = f"{self.base_url}/getFile"
-                params = {'file_id': file_id}
-                
-                async with session.get(get_file_url, params=params) as response:
+            session = await self.get_session()
+            get_file_url = f"{self.base_url}/getFile"
+            params = {'file_id': file_id}
+            
+            with metrics.timed("telegram_getfile") as timer:
+                async with session.get(get_file_url, params=params, timeout=aiohttp.ClientTimeout(total=30)) as response:
                     if response.status == 200:
                         result = await response.json()
                         if result.get('ok'):
                             file_path = result['result']['file_path']
-                            download_url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
-                            return download_url
+                            return self.file_url(file_path)
+                    timer.outcome = "rejected"
                     return None
         except Exception as e:
             logging.error(f"Error getting file download URL: {str(e)}")
             return None
     
+    def file_url(self, file_path):
+        """Download URL for a getFile file_path, or None if a local server's path cannot be mapped"""
+        if os.path.isabs(file_path):
+            # A local server started with --local returns a path on its own disk
+            root = self.local_file_root.rstrip("/")
+            if not root or not file_path.startswith(f"{root}/"):
+                logging.error(f"Cannot map local Bot API file path {file_path}; set TELEGRAM_LOCAL_FILE_ROOT")
+                return None
+            file_path = file_path[len(root) + 1:]
+        return f"{self.file_url_base}/{file_path}"
+    
     async def check_file_in_channel(self, video_id, file_type='video'):
         """Check if file exists in Telegram channel (placeholder - would need channel history search)"""
         # Note: This would require implementing a search through channel history
@@ -17,6 +17,7 @@ async def test_upload():
     print(f"Filename: {filename}")
     
     result = await telegram_service.upload_file_to_telegram(test_url, filename, caption)
+    await telegram_service.close()
     
     if result:
         print(f"✅ Upload successful!")
@@ -0,0 +1,32 @@
+import pytest
+from api_common import batch_items, invalid_batch_item
+from config import BATCH_MAX_ITEMS
+
+@pytest.mark.parametrize("data", [None, [], "urls", {}, {"urls": []}, {"urls": "https://youtu.be/x"}])
+def test_missing_or_empty_list_is_rejected(data):
+    assert batch_items(data, "urls") == (None, "Missing 'urls' list")
+
+def test_oversized_batch_is_rejected():
+    items, message = batch_items({"urls": ["u"] * (BATCH_MAX_ITEMS + 1)}, "urls")
+    assert items is None
+    assert message == f"At most {BATCH_MAX_ITEMS} urls per batch"
+
+def test_full_batch_is_accepted():
+    urls = ["u"] * BATCH_MAX_ITEMS
+    assert batch_items({"urls": urls}, "urls") == (urls, None)
+
+def test_non_string_url_is_reported_by_index():
+    items, message = batch_items({"urls": ["a", 3]}, "urls")
+    assert items == ["a", 3]
+    assert message == "urls[1] must be a string"
+
+def test_non_object_item_is_reported():
+    assert invalid_batch_item("items", [{"key": "k"}, "k"]) == "items[1] must be an object"
+
+@pytest.mark.parametrize("name", ["key", "video_id", "type"])
+def test_non_string_item_field_is_reported(name):
+    assert invalid_batch_item("items", [{"key": "k", name: 5}]) == f"items[0].{name} must be a string"
+
+def test_missing_and_null_fields_are_left_to_the_batch():
+    items = [{}, {"key": None, "video_id": None, "type": None}, {"key": "k", "video_id": "v", "type": "audio"}]
+    assert batch_items({"items": items}, "items") == (items, None)
@@ -0,0 +1,32 @@
+import asyncio
+import time
+from cache_manager import CacheManager
+from quality_prober import AvailabilityCache
+
+def test_availability_plan_skips_failures_and_stops_at_known_good():
+    availability = AvailabilityCache(CacheManager())
+    availability.record("k", "video", "1080", False)
+    availability.record("k", "video", "480", True)
+    assert availability.plan("k", "video", ["1080", "720", "480", "360"]) == ["720", "480"]
+    stats = availability.get_stats()
+    assert stats['negative_hits'] == 1
+    assert stats['known_good_hits'] == 1
+    assert stats['probes_skipped'] == 2
+
+def test_unavailable_qualities_are_retried_after_the_negative_ttl():
+    availability = AvailabilityCache(CacheManager(), positive_ttl=60, negative_ttl=0.01)
+    availability.record("k", "audio", "320", False)
+    assert availability.plan("k", "audio", ["320", "128"]) == ["128"]
+    time.sleep(0.02)
+    assert availability.plan("k", "audio", ["320", "128"]) == ["320", "128"]
+
+def test_async_plan_matches_sync_plan():
+    availability = AvailabilityCache(CacheManager())
+
+    async def main():
+        await availability.record_async("k", "video", "1080", False)
+        await availability.record_async("k", "video", "720", True)
+        return await availability.plan_async("k", "video", ["1080", "720", "480"])
+
+    assert asyncio.run(main()) == ["720"]
+    assert availability.get_stats()['recorded_unavailable'] == 1
@@ -0,0 +1,35 @@
+import time
+import pytest
+from cache_backends import CacheBackend, SQLiteBackend
+
+def test_backend_missing_a_method_fails_at_construction():
+    class NoScan(CacheBackend):
+        def get(self, key):
+            return None
+
+        def set(self, key, value, ttl):
+            pass
+
+        def delete(self, key):
+            pass
+
+    with pytest.raises(TypeError):
+        NoScan()
+
+def test_sqlite_backend_round_trip_and_scan(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.db"), prefix="t:")
+    backend.set("info:a", {"title": "A"}, ttl=60)
+    backend.set("info:b", ("url", "720"), ttl=0.05)
+    backend.set("other", 1, ttl=60)
+
+    value, remaining = backend.get("info:a")
+    assert value == {"title": "A"} and 0 < remaining <= 60
+    # JSON round trip turns tuples into lists
+    assert backend.get("info:b")[0] == ["url", "720"]
+    time.sleep(0.06)
+    assert backend.get("info:b") is None
+    assert backend.scan("info:") == {"info:a": {"title": "A"}}
+    assert backend.cleanup_expired() == 1
+
+    backend.delete("info:a")
+    assert backend.get("info:a") is None
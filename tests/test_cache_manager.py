@@ -0,0 +1,59 @@
+import time
+from cache_manager import CacheManager
+
+def test_get_returns_value_until_ttl_expires():
+    cache = CacheManager()
+    cache.set("a", 1, ttl=0.05)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.get_stats()['expirations'] == 1
+
+def test_lru_evicts_least_recently_used_entry():
+    cache = CacheManager(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.get_stats()['evictions'] == 1
+
+def test_byte_budget_evicts_and_rejects_oversize_values():
+    cache = CacheManager(max_bytes=2000)
+    cache.set("big", "x" * 5000)
+    assert cache.get("big") is None
+    assert cache.get_stats()['rejected'] == 1
+    for i in range(20):
+        cache.set(f"k{i}", "y" * 200)
+    stats = cache.get_stats()
+    assert stats['size_bytes'] <= 2000
+    assert cache.get("k19") is not None
+    assert cache.get("k0") is None
+
+def test_heap_reclaims_expired_entries_without_lookups():
+    cache = CacheManager()
+    for i in range(10):
+        cache.set(f"short{i}", i, ttl=0.01)
+    cache.set("long", "kept", ttl=60)
+    time.sleep(0.02)
+    # Any set purges whatever the expiry heap says is due
+    cache.set("other", 1)
+    assert cache.get_stats()['cache_size'] == 2
+    assert cache.get("long") == "kept"
+
+def test_reset_ttl_is_not_expired_by_stale_heap_entry():
+    cache = CacheManager()
+    cache.set("a", 1, ttl=0.01)
+    cache.set("a", 2, ttl=60)
+    time.sleep(0.02)
+    cache.cleanup_expired()
+    assert cache.get("a") == 2
+
+def test_get_with_ttl_reports_remaining_time():
+    cache = CacheManager()
+    cache.set("a", 1, ttl=10)
+    value, remaining = cache.get_with_ttl("a")
+    assert value == 1
+    assert 9 < remaining <= 10
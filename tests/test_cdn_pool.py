@@ -0,0 +1,105 @@
+import threading
+import time
+import pytest
+import cdn_pool
+from cdn_pool import CdnPool
+from config import CDN_EJECT_FAILURES, CDN_EJECT_SECONDS, CDN_HOST_TTL
+
+@pytest.fixture(autouse=True)
+def no_exploration(monkeypatch):
+    monkeypatch.setattr(cdn_pool, "EXPLORE_RATE", 0)
+
+def make_pool(hosts=(), discover_fn=lambda: None, size=4):
+    pool = CdnPool(discover_fn, size=size)
+    # Tests drive refreshes themselves instead of the background thread
+    pool._thread = object()
+    for name in hosts:
+        pool.add(name)
+    return pool
+
+def test_untried_hosts_are_picked_before_measured_ones():
+    pool = make_pool(["a", "b"])
+    pool.record("a", 0.01, True)
+    assert pool.pick() == "b"
+
+def test_lower_latency_and_fewer_errors_win():
+    pool = make_pool(["fast", "slow", "flaky"])
+    pool.record("fast", 0.1, True)
+    pool.record("slow", 0.5, True)
+    pool.record("flaky", 0.1, True)
+    pool.record("flaky", 0.1, False)
+    # Same latency as "fast", but the failure inflates its score
+    assert pool.pick() == "fast"
+    assert pool.pick(exclude={"fast"}) == "flaky"
+    assert pool.pick(exclude={"fast", "flaky"}) == "slow"
+
+def test_host_is_ejected_after_consecutive_failures():
+    pool = make_pool(["a", "b"])
+    pool.record("b", 0.5, True)
+    for _ in range(CDN_EJECT_FAILURES - 1):
+        pool.record("a", 0.1, False)
+    pool.record("a", 0.1, True)
+    # A success resets the run, so a few scattered failures do not eject
+    for _ in range(CDN_EJECT_FAILURES - 1):
+        pool.record("a", 0.1, False)
+    assert pool.get_stats()['ejections'] == 0
+
+    pool.record("a", 0.1, False)
+    stats = pool.get_stats()
+    assert stats['ejections'] == 1
+    assert stats['hosts']['a']['ejected'] is True
+    assert pool.pick() == "b"
+    # With every other host excluded, the ejected host is still returned
+    assert pool.pick(exclude={"b"}) == "a"
+
+def test_repeated_ejections_back_off():
+    pool = make_pool(["a"])
+    for ejection in range(3):
+        for _ in range(CDN_EJECT_FAILURES):
+            pool.record("a", 0.1, False)
+        host = pool._hosts["a"]
+        expected = min(CDN_EJECT_SECONDS * 2 ** ejection, cdn_pool.MAX_EJECT_SECONDS)
+        assert host.ejected_until - time.time() == pytest.approx(expected, abs=1)
+        host.ejected_until = 0
+
+def test_cold_start_makes_one_discovery_call():
+    calls = []
+
+    def discover():
+        calls.append(1)
+        time.sleep(0.05)
+        return "a"
+
+    pool = make_pool(discover_fn=discover)
+    threads = [threading.Thread(target=pool.refresh, kwargs={"if_empty": True}) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert pool.pick() == "a"
+
+def test_discovery_errors_are_counted_not_raised():
+    def discover():
+        raise ConnectionError("down")
+
+    pool = make_pool(discover_fn=discover, size=2)
+    pool.refresh()
+    stats = pool.get_stats()
+    assert stats['discovery_errors'] == 4
+    assert stats['hosts'] == {}
+
+def test_prune_drops_stale_hosts_and_the_worst_overflow():
+    pool = make_pool(["a", "b", "c", "old"], size=2)
+    pool._hosts["old"].last_discovered = time.time() - CDN_HOST_TTL - 1
+    pool.record("a", 0.1, True)
+    pool.record("b", 0.9, True)
+    pool.record("c", 0.3, True)
+    pool._prune()
+    assert set(pool.get_stats()['hosts']) == {"a", "c"}
+
+def test_last_stale_host_is_kept():
+    pool = make_pool(["old"])
+    pool._hosts["old"].last_discovered = time.time() - CDN_HOST_TTL - 1
+    pool._prune()
+    assert pool.pick() == "old"
@@ -0,0 +1,74 @@
+import base64
+import json
+import os
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+from ytmp4_service import (
+    AES_KEY, FIELD_SCAN_MIN_BYTES, INFO_FIELDS, decrypt_info_payload, decrypt_payload, extract_string_fields,
+    parse_payload
+)
+
+def encrypt(plaintext, padding=True):
+    """Encrypt bytes the way savetube does: AES-CBC, IV first, base64"""
+    iv = os.urandom(16)
+    data = pad(plaintext, AES.block_size) if padding else plaintext + b"\x00" * (-len(plaintext) % AES.block_size)
+    return base64.b64encode(iv + AES.new(AES_KEY, AES.MODE_CBC, iv).encrypt(data)).decode()
+
+def info(**overrides):
+    payload = {"title": "Video", "durationLabel": "3:21", "thumbnail": "https://i.ytimg.com/x.jpg", "key": "abc"}
+    payload.update(overrides)
+    return payload
+
+def test_decrypt_round_trips_pkcs7_and_zero_padding():
+    plaintext = json.dumps(info()).encode()
+    assert decrypt_payload(encrypt(plaintext)) == plaintext
+    assert decrypt_payload(encrypt(plaintext, padding=False)) == plaintext
+
+def test_decrypt_ignores_line_breaks_in_base64():
+    encrypted = encrypt(b'{"a": 1}')
+    assert decrypt_payload("\n".join(encrypted[i:i + 20] for i in range(0, len(encrypted), 20))) == b'{"a": 1}'
+
+def test_parse_payload_tolerates_stray_bytes():
+    assert parse_payload(b'\x01\x02{"a": 1}\x03') == {"a": 1}
+    with pytest.raises(Exception):
+        parse_payload(b"not json")
+
+def test_extract_decodes_escaped_quotes_and_unicode():
+    payload = info(title='He said "hi" \\ bye — ünï', thumbnail="a\\\"b")
+    for ensure_ascii in (True, False):
+        plaintext = json.dumps(payload, ensure_ascii=ensure_ascii).encode()
+        assert extract_string_fields(plaintext, INFO_FIELDS) == {name: payload[name] for name in INFO_FIELDS}
+
+def test_extract_handles_value_ending_in_escaped_backslash():
+    plaintext = json.dumps(info(title="ends with \\")).encode()
+    assert extract_string_fields(plaintext, ("title", "key")) == {"title": "ends with \\", "key": "abc"}
+
+def test_extract_gives_up_on_repeated_keys():
+    # A nested object reusing a field name could be the one json.loads keeps
+    plaintext = json.dumps(dict(info(), formats=[{"key": "nested"}])).encode()
+    assert extract_string_fields(plaintext, INFO_FIELDS) is None
+
+@pytest.mark.parametrize("value", [None, 42, ["a"], {"a": "b"}, True])
+def test_extract_gives_up_on_non_string_values(value):
+    plaintext = json.dumps(info(title=value)).encode()
+    assert extract_string_fields(plaintext, INFO_FIELDS) is None
+
+def test_extract_gives_up_on_missing_fields():
+    payload = info()
+    del payload["thumbnail"]
+    assert extract_string_fields(json.dumps(payload).encode(), INFO_FIELDS) is None
+
+def test_info_payload_falls_back_to_parse_payload():
+    filler = "x" * FIELD_SCAN_MIN_BYTES
+    # Large enough to be scanned, but the repeated key forces the full parse
+    payload = dict(info(), description=filler, formats=[{"key": "nested"}])
+    assert decrypt_info_payload(encrypt(json.dumps(payload).encode())) == {name: payload[name] for name in INFO_FIELDS}
+    # Non-string values come through the full parse unchanged
+    payload = dict(info(durationLabel=201), description=filler)
+    assert decrypt_info_payload(encrypt(json.dumps(payload).encode()))["durationLabel"] == 201
+
+def test_info_payload_scan_matches_full_parse():
+    payload = dict(info(title='Quote " and \\n'), description="y" * FIELD_SCAN_MIN_BYTES)
+    encrypted = encrypt(json.dumps(payload).encode())
+    assert decrypt_info_payload(encrypted) == {name: parse_payload(decrypt_payload(encrypted))[name] for name in INFO_FIELDS}
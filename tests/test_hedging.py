@@ -0,0 +1,78 @@
+import asyncio
+import time
+import pytest
+import hedging
+from hedging import Hedger, MIN_SAMPLES
+
+@pytest.fixture(autouse=True)
+def short_delay(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 0.02)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY", 0.01)
+
+def slow_primary(target):
+    time.sleep(0.1 if target == "primary" else 0)
+    return target
+
+def test_fast_primary_is_not_hedged():
+    hedger = Hedger(budget=1, burst=5)
+    assert hedger.run(lambda target: target, "primary", lambda: "alternate") == "primary"
+    assert hedger.get_stats()['hedged'] == 0
+
+def test_hedges_stop_when_the_budget_is_spent():
+    hedger = Hedger(budget=0.25, burst=2)
+    results = [hedger.run(slow_primary, "primary", lambda: "alternate") for _ in range(3)]
+    # The bucket starts full (2 tokens) and each request earns a quarter token, up to the burst
+    assert results == ["alternate", "alternate", "primary"]
+    stats = hedger.get_stats()
+    assert (stats['hedged'], stats['hedge_wins'], stats['over_budget']) == (2, 2, 1)
+
+    # Two more requests bring the bucket back to one token, which the second of them spends
+    results = [hedger.run(slow_primary, "primary", lambda: "alternate") for _ in range(2)]
+    assert results == ["primary", "alternate"]
+    assert hedger.get_stats()['hedged'] == 3
+
+def test_no_alternate_waits_for_the_primary():
+    hedger = Hedger(budget=1, burst=5)
+    assert hedger.run(slow_primary, "primary", lambda: None) == "primary"
+    stats = hedger.get_stats()
+    assert (stats['hedged'], stats['tokens']) == (0, 5)
+
+def test_failed_hedge_falls_back_to_the_primary():
+    def fn(target):
+        if target == "alternate":
+            raise ConnectionError("down")
+        return slow_primary(target)
+
+    hedger = Hedger(budget=1, burst=5)
+    assert hedger.run(fn, "primary", lambda: "alternate") == "primary"
+    assert hedger.get_stats()['hedge_wins'] == 0
+
+def test_delay_follows_the_latency_percentile():
+    hedger = Hedger(percentile=90)
+    assert hedger.delay() == 0.02
+    for index in range(MIN_SAMPLES * 5):
+        hedger._record(index / 1000)
+    assert hedger.delay() == pytest.approx(0.09)
+
+def test_async_hedge_cancels_the_slow_primary():
+    cancelled = []
+
+    async def fn(target):
+        if target == "primary":
+            try:
+                await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                cancelled.append(target)
+                raise
+        return target
+
+    async def main():
+        hedger = Hedger(budget=0.5, burst=1)
+        results = [await hedger.run_async(fn, "primary", lambda: "alternate") for _ in range(2)]
+        return results, hedger.get_stats()
+
+    results, stats = asyncio.run(main())
+    # Half a token is left after the first hedge, so the second request waits for the primary
+    assert results == ["alternate", "primary"]
+    assert cancelled == ["primary"]
+    assert (stats['hedged'], stats['over_budget']) == (1, 1)
@@ -0,0 +1,82 @@
+import os
+import time
+from media_cache import MediaCache, STALE_PART_SECONDS
+
+def make_cache(tmp_path, max_bytes=1000):
+    return MediaCache(str(tmp_path), max_bytes=max_bytes, base_url="/media/", enabled=True)
+
+def store(cache, video_id, size, atime=None):
+    writer = cache.writer(video_id, "audio", ".mp3")
+    writer.write(b"x" * size)
+    writer.finish()
+    if atime is not None:
+        os.utime(writer.path, (atime, atime))
+    return writer.path
+
+def test_lookup_hits_committed_files_only(tmp_path):
+    cache = make_cache(tmp_path)
+    writer = cache.writer("abc", "audio", ".m4a")
+    writer.write(b"data")
+    assert cache.lookup("abc", "audio") is None
+    writer.finish()
+
+    media = cache.lookup("abc", "audio")
+    assert (media.size, media.content_type, media.filename) == (4, "audio/mp4", "abc.audio.m4a")
+    assert cache.lookup("abc", "video") is None
+    assert cache.lookup("../abc", "audio") is None
+    assert cache.writer("abc", "audio", ".exe") is None
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['stored'], stats['stored_bytes']) == (1, 2, 1, 4)
+
+def test_least_recently_served_files_are_evicted_first(tmp_path):
+    cache = make_cache(tmp_path)
+    now = time.time()
+    old = store(cache, "old", 400, atime=now - 300)
+    served = store(cache, "served", 400, atime=now - 200)
+    # A hit stamps the file as recently used
+    cache.lookup("served", "audio")
+    new = store(cache, "new", 400)
+
+    assert not os.path.exists(old)
+    assert os.path.exists(served) and os.path.exists(new)
+    stats = cache.get_stats()
+    assert (stats['evicted'], stats['evicted_bytes']) == (1, 400)
+
+def test_newly_committed_file_is_kept_even_if_oldest(tmp_path):
+    cache = make_cache(tmp_path)
+    now = time.time()
+    other = store(cache, "other", 600, atime=now)
+    writer = cache.writer("big", "audio", ".mp3")
+    writer.write(b"x" * 600)
+    # Simulate a slow download: its file keeps an old atime
+    os.utime(writer.temp_path, (now - 1000, now - 1000))
+    writer.finish()
+
+    assert os.path.exists(writer.path)
+    assert not os.path.exists(other)
+
+def test_oversize_download_is_dropped(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10)
+    writer = cache.writer("abc", "audio", ".mp3")
+    temp_path = writer.temp_path
+    writer.write(b"x" * 8)
+    writer.write(b"x" * 8)
+    writer.finish()
+
+    assert not os.path.exists(temp_path)
+    assert cache.lookup("abc", "audio") is None
+    assert cache.get_stats()['aborted'] == 1
+
+def test_stale_part_files_are_removed_on_eviction(tmp_path):
+    cache = make_cache(tmp_path)
+    stale = cache.writer("dead", "audio", ".mp3")
+    live = cache.writer("live", "audio", ".mp3")
+    old = time.time() - STALE_PART_SECONDS - 10
+    os.utime(stale.temp_path, (old, old))
+    store(cache, "abc", 10)
+
+    assert not os.path.exists(stale.temp_path)
+    assert os.path.exists(live.temp_path)
+    temp_path = live.temp_path
+    live.abort()
+    assert not os.path.exists(temp_path)
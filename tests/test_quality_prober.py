@@ -0,0 +1,50 @@
+import asyncio
+import time
+from quality_prober import QualityProber
+
+def delayed(outcomes):
+    """probe_fn returning outcomes[candidate] = (delay, result)"""
+    def probe(candidate):
+        delay, result = outcomes[candidate]
+        time.sleep(delay)
+        return result
+    return probe
+
+def test_highest_priority_success_wins_even_when_slower():
+    prober = QualityProber(4)
+    outcomes = {"1080": (0.05, "url-1080"), "720": (0.0, "url-720"), "480": (0.0, "url-480")}
+    assert prober.probe(["1080", "720", "480"], delayed(outcomes)) == ("1080", "url-1080")
+
+def test_failures_fall_through_to_next_candidate():
+    prober = QualityProber(4)
+    outcomes = {"1080": (0.0, None), "720": (0.02, "url-720"), "480": (0.0, "url-480")}
+    assert prober.probe(["1080", "720", "480"], delayed(outcomes)) == ("720", "url-720")
+
+def test_exceptions_count_as_failures():
+    prober = QualityProber(2)
+
+    def probe(candidate):
+        if candidate == "1080":
+            raise RuntimeError("upstream down")
+        return f"url-{candidate}"
+
+    assert prober.probe(["1080", "720"], probe) == ("720", "url-720")
+
+def test_deadline_settles_for_best_arrived_success():
+    prober = QualityProber(4)
+    outcomes = {"1080": (0.5, "url-1080"), "720": (0.0, "url-720")}
+    assert prober.probe(["1080", "720"], delayed(outcomes), deadline=0.05) == ("720", "url-720")
+
+def test_nothing_succeeds():
+    prober = QualityProber(2)
+    assert prober.probe(["1080", "720"], lambda candidate: None) is None
+    assert prober.probe([], lambda candidate: "x") is None
+
+def test_async_probe_keeps_priority_order():
+    prober = QualityProber(1)
+
+    async def probe(candidate):
+        await asyncio.sleep({"1080": 0.03, "720": 0.0}[candidate])
+        return None if candidate == "480" else f"url-{candidate}"
+
+    assert asyncio.run(prober.probe_async(["1080", "720", "480"], probe)) == ("1080", "url-1080")
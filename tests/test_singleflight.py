@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import pytest
+from singleflight import AsyncSingleFlight, SingleFlight
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(1)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", work))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.get_stats()['shared'] < 4:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["result"] * 5
+    assert flight.get_stats() == {'executions': 1, 'shared': 4, 'in_flight': 0}
+
+def test_errors_propagate_and_are_not_cached():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert flight.do("k", lambda: 2) == 2
+    assert flight.in_flight() == 0
+
+def test_async_callers_share_one_execution():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*[flight.do("k", work) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert calls == [1]
+    assert flight.get_stats() == {'executions': 1, 'shared': 4, 'in_flight': 0}
@@ -0,0 +1,180 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import pytest
+from pymongo.errors import DuplicateKeyError
+from upload_scheduler import UploadScheduler, MongoJobStore, SQLiteJobStore, job_key
+
+def _matches(doc, query):
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(_matches(doc, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(field)
+            if "$lt" in condition and (value is None or not value < condition["$lt"]):
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+class FakeJobCollection:
+    """The subset of a pymongo collection MongoJobStore uses, with a unique _id"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def update_one(self, query, update, upsert=False):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                doc.update(update["$set"])
+                return
+        if upsert:
+            if query["_id"] in self.docs:
+                raise DuplicateKeyError("duplicate key")
+            self.docs[query["_id"]] = dict(update["$set"], _id=query["_id"])
+
+    def find_one_and_update(self, query, update, sort, return_document):
+        (field, _), = sort
+        docs = sorted((doc for doc in self.docs.values() if _matches(doc, query)), key=lambda doc: doc[field])
+        if not docs:
+            return None
+        docs[0].update(update["$set"])
+        return dict(docs[0])
+
+    def update_many(self, query, update):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                doc.update(update["$set"])
+
+    def delete_one(self, query):
+        for key, doc in list(self.docs.items()):
+            if _matches(doc, query):
+                del self.docs[key]
+                return
+
+@pytest.fixture(params=["mongo", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "mongo":
+        collection = FakeJobCollection()
+        return MongoJobStore(lambda: collection)
+    return SQLiteJobStore(str(tmp_path / "jobs.db"))
+
+def make_job(video_id, file_type="video", created_at=None):
+    return {"video_id": video_id, "download_url": "u", "file_type": file_type, "quality": "720",
+            "created_at": time.time() if created_at is None else created_at}
+
+def test_live_lease_blocks_other_owners(store):
+    now = time.time()
+    assert store.save(make_job("v1"), "a", now + 60) is True
+    # The owner may re-save its own job, nobody else may take it over
+    assert store.save(make_job("v1"), "a", now + 60) is True
+    assert store.save(make_job("v1"), "b", now + 60) is False
+    assert store.claim("b", now + 60, 10) == []
+
+def test_expired_and_released_jobs_are_claimed_oldest_first(store):
+    now = time.time()
+    store.save(make_job("new", created_at=now), "a", now + 60)
+    store.save(make_job("old", created_at=now - 10), "dead", now - 1)
+    store.release("a")
+    claimed = store.claim("b", now + 60, 10)
+    assert [job["video_id"] for job in claimed] == ["old", "new"]
+    assert store.claim("c", now + 60, 10) == []
+
+def test_claim_respects_limit(store):
+    now = time.time()
+    for index in range(3):
+        store.save(make_job(f"v{index}", created_at=now + index), "dead", now - 1)
+    assert [job["video_id"] for job in store.claim("b", now + 60, 2)] == ["v0", "v1"]
+
+def test_renew_keeps_the_lease_alive(store):
+    now = time.time()
+    store.save(make_job("v1"), "a", now - 1)
+    store.renew("a", [job_key("v1", "video")], now + 60)
+    assert store.claim("b", now + 60, 10) == []
+
+def test_delete_only_removes_the_owners_job(store):
+    now = time.time()
+    store.save(make_job("v1"), "a", now - 1)
+    store.delete(job_key("v1", "video"), "b")
+    store.delete(job_key("v1", "other"), "a")
+    assert [job["video_id"] for job in store.claim("b", now + 60, 10)] == ["v1"]
+    store.delete(job_key("v1", "video"), "b")
+    assert store.claim("c", time.time() + 60, 10) == []
+
+class Recorder:
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.runs = []
+        self.lock = threading.Lock()
+
+    async def __call__(self, job):
+        with self.lock:
+            self.runs.append(job_key(job["video_id"], job["file_type"]))
+        await asyncio.sleep(self.delay)
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.02)
+
+@pytest.fixture
+def schedulers():
+    started = []
+    yield started
+    for scheduler in started:
+        scheduler.stop()
+
+def test_duplicate_submits_run_once(schedulers):
+    handler = Recorder()
+    scheduler = UploadScheduler(handler, workers=1)
+    schedulers.append(scheduler)
+    assert scheduler.submit("v1", "u", "video", "720") is True
+    assert scheduler.submit("v1", "u", "video", "720") is False
+    assert scheduler.submit("v1", "u", "audio", "128") is True
+    wait_for(lambda: scheduler.get_stats()['completed'] == 2)
+    assert sorted(handler.runs) == ["v1:audio", "v1:video"]
+    assert scheduler.get_stats()['deduplicated'] == 1
+
+def test_two_schedulers_on_one_store_upload_once(schedulers, tmp_path):
+    path = str(tmp_path / "jobs.db")
+    handler = Recorder()
+    first = UploadScheduler(handler, SQLiteJobStore(path), workers=1)
+    second = UploadScheduler(handler, SQLiteJobStore(path), workers=1)
+    schedulers.extend([first, second])
+    first.submit("v1", "u", "video", "720")
+    wait_for(lambda: first.get_stats()['running'] == 1)
+    second.submit("v1", "u", "video", "720")
+    wait_for(lambda: first.get_stats()['completed'] == 1 and second.get_stats()['claimed_elsewhere'] == 1)
+    assert handler.runs == ["v1:video"]
+
+def test_store_outage_still_uploads(schedulers):
+    class BrokenStore:
+        def __getattr__(self, name):
+            def fail(*args):
+                raise ConnectionError("down")
+            return fail
+
+    handler = Recorder(delay=0)
+    scheduler = UploadScheduler(handler, BrokenStore(), workers=1)
+    schedulers.append(scheduler)
+    scheduler.submit("v1", "u", "video", "720")
+    wait_for(lambda: scheduler.get_stats()['completed'] == 1)
+    assert scheduler.get_stats()['claimed_elsewhere'] == 0
+
+def test_orphaned_job_is_claimed_and_uploaded(schedulers, tmp_path):
+    path = str(tmp_path / "jobs.db")
+    SQLiteJobStore(path).save(make_job("v1", "audio"), "dead", time.time() - 1)
+    handler = Recorder(delay=0)
+    scheduler = UploadScheduler(handler, SQLiteJobStore(path), workers=1)
+    schedulers.append(scheduler)
+    scheduler.start()
+    wait_for(lambda: scheduler.get_stats()['completed'] == 1)
+    assert handler.runs == ["v1:audio"]
+    assert scheduler.get_stats()['restored'] == 1
+    # The finished job is deleted from the store
+    wait_for(lambda: sqlite3.connect(path).execute("SELECT COUNT(*) FROM upload_jobs").fetchone()[0] == 0)
@@ -0,0 +1,34 @@
+import pytest
+from video_ids import canonical_video_id, info_cache_key
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+@pytest.mark.parametrize("url", [
+    VIDEO_ID,
+    f"https://www.youtube.com/watch?v={VIDEO_ID}",
+    f"https://youtube.com/watch?feature=share&v={VIDEO_ID}&t=42",
+    f"https://m.youtube.com/watch?v={VIDEO_ID}",
+    f"https://music.youtube.com/watch?v={VIDEO_ID}&list=RD",
+    f"https://youtu.be/{VIDEO_ID}?si=abc",
+    f"https://www.youtube.com/shorts/{VIDEO_ID}",
+    f"https://www.youtube.com/live/{VIDEO_ID}?feature=shared",
+    f"https://www.youtube.com/embed/{VIDEO_ID}",
+    f"https://www.youtube-nocookie.com/embed/{VIDEO_ID}",
+    f"  HTTPS://WWW.YOUTUBE.COM/watch?v={VIDEO_ID}  ",
+])
+def test_url_forms_map_to_one_id(url):
+    assert canonical_video_id(url) == VIDEO_ID
+
+@pytest.mark.parametrize("url", [
+    "https://example.com/watch?v=dQw4w9WgXcQ",
+    "https://notyoutube.com/watch?v=dQw4w9WgXcQ",
+    f"https://www.youtube.com/watch?v={VIDEO_ID}extra",
+    "https://www.youtube.com/channel/UC1234567890",
+    "not a url",
+])
+def test_non_video_urls_have_no_id(url):
+    assert canonical_video_id(url) is None
+
+def test_info_cache_key_is_shared_by_variants():
+    assert info_cache_key(f"https://youtu.be/{VIDEO_ID}") == info_cache_key(f"https://www.youtube.com/watch?v={VIDEO_ID}")
+    assert info_cache_key("https://example.com/x") == "info_https://example.com/x"
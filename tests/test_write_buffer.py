@@ -0,0 +1,100 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from write_buffer import WriteBehindBuffer
+
+class Result:
+    def __init__(self, upserted_count=0, modified_count=0):
+        self.upserted_count = upserted_count
+        self.modified_count = modified_count
+
+class FakeCollection:
+    """Records every bulk_write and answers with scripted results or exceptions"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.bulks = []
+
+    def bulk_write(self, requests, ordered):
+        assert ordered is False
+        self.bulks.append(list(requests))
+        outcome = self.outcomes.pop(0) if self.outcomes else Result()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+def make_buffer(collection):
+    counts = []
+    buffer = WriteBehindBuffer(collection, counts.append, insert_counter="total_videos", interval=3600)
+    # Flushes are driven by the test, not the background thread
+    buffer._start = lambda: None
+    return buffer, counts
+
+def test_merged_writes_flush_as_one_bulk_and_count_inserts():
+    collection = FakeCollection(Result(upserted_count=2))
+    buffer, counts = make_buffer(collection)
+    buffer.add("a", {"title": "A"}, upsert=True)
+    buffer.add("a", {"title": "A2"}, upsert=True)
+    buffer.add("b", {"title": "B"}, upsert=True)
+    assert buffer.overlay("a", None)["title"] == "A2"
+
+    assert buffer.flush() == 2
+    assert collection.bulks == [[
+        UpdateOne({"video_id": "a"}, {"$set": {"title": "A2"}}, upsert=True),
+        UpdateOne({"video_id": "b"}, {"$set": {"title": "B"}}, upsert=True)
+    ]]
+    assert counts == [{"total_videos": 2}]
+    stats = buffer.get_stats()
+    assert (stats['writes'], stats['merged'], stats['flushed_videos'], stats['queued']) == (3, 1, 2, 0)
+
+def test_first_set_fields_are_guarded_and_overwritten_when_present():
+    # Main bulk, then the guarded bulk (one of two documents lacked the field), then the overwrite
+    collection = FakeCollection(Result(upserted_count=1), Result(modified_count=1), Result(modified_count=2))
+    buffer, counts = make_buffer(collection)
+    buffer.add("a", {"video_telegram_url": "ta"}, first_set=("video_telegram_url", "with_video"))
+    buffer.add("b", {"title": "B"}, upsert=True)
+    buffer.add("b", {"video_telegram_url": "tb"}, first_set=("video_telegram_url", "with_video"))
+    buffer.flush()
+
+    main, guarded, overwrites = collection.bulks
+    assert main == [UpdateOne({"video_id": "b"}, {"$set": {"title": "B"}}, upsert=True)]
+    assert guarded == [
+        UpdateOne({"video_id": "a", "video_telegram_url": {"$exists": False}}, {"$set": {"video_telegram_url": "ta"}}),
+        UpdateOne({"video_id": "b", "video_telegram_url": {"$exists": False}}, {"$set": {"video_telegram_url": "tb"}})
+    ]
+    assert overwrites == [
+        UpdateOne({"video_id": "a"}, {"$set": {"video_telegram_url": "ta"}}),
+        UpdateOne({"video_id": "b"}, {"$set": {"video_telegram_url": "tb"}})
+    ]
+    assert counts == [{"total_videos": 1, "with_video": 1}]
+
+def test_rejected_main_write_does_not_skip_guarded_writes():
+    rejected = BulkWriteError({"writeErrors": [{"index": 0, "errmsg": "duplicate key"}], "nUpserted": 1, "nModified": 0})
+    collection = FakeCollection(rejected, Result(modified_count=1))
+    buffer, counts = make_buffer(collection)
+    buffer.add("a", {"title": "A"}, upsert=True)
+    buffer.add("c", {"title": "C"}, upsert=True)
+    buffer.add("b", {"audio_telegram_url": "tb"}, first_set=("audio_telegram_url", "with_audio"))
+    buffer.flush()
+
+    assert len(collection.bulks) == 2
+    assert counts == [{"total_videos": 1, "with_audio": 1}]
+    # Rejected documents are dropped, not retried
+    assert buffer.get_stats()['queued'] == 0
+    assert buffer.get_stats()['errors'] == 1
+
+def test_failed_bulk_is_requeued_and_merged_with_newer_writes():
+    collection = FakeCollection(ConnectionError("down"), Result(upserted_count=1))
+    buffer, counts = make_buffer(collection)
+    buffer.add("a", {"title": "A"}, upsert=True)
+    buffer.flush()
+    assert counts == []
+    assert buffer.get_stats()['queued'] == 1
+    assert buffer.overlay("a", None)["title"] == "A"
+
+    buffer.add("a", {"duration": "1:00"}, upsert=True)
+    buffer.flush()
+    assert collection.bulks[-1] == [
+        UpdateOne({"video_id": "a"}, {"$set": {"title": "A", "duration": "1:00"}}, upsert=True)
+    ]
+    assert counts == [{"total_videos": 1}]
+    assert buffer.get_stats()['errors'] == 1
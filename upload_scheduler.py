@@ -0,0 +1,387 @@
+import asyncio
+import atexit
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from config import UPLOAD_WORKERS, UPLOAD_QUEUE_MAX, UPLOAD_QUEUE_STORE, UPLOAD_QUEUE_SQLITE_PATH, UPLOAD_JOB_LEASE
+
+# Audio uploads are small and quick, so they go ahead of video
+TYPE_PRIORITY = {'audio': 0, 'video': 1}
+DEMAND_TRACK_MAX = 10000
+# Seconds stop() waits for the loop thread to run its shutdown hooks
+SHUTDOWN_TIMEOUT = 10
+
+def job_key(video_id, file_type):
+    return f"{video_id}:{file_type}"
+
+class MongoJobStore:
+    """Persists queued upload jobs in a MongoDB collection.
+
+    Every process shares the collection, so a job carries the owner that may run
+    it and a lease expiry; jobs are taken over only once unowned or expired.
+    """
+
+    def __init__(self, get_collection):
+        # Resolved on first use so building the store does not connect to MongoDB
+        self._get_collection = get_collection
+
+    @property
+    def collection(self):
+        return self._get_collection()
+
+    def _claimable(self, now):
+        # Jobs persisted before leases existed have no owner field, which {"owner": None} matches
+        return [{"owner": None}, {"lease_until": {"$lt": now}}]
+
+    def save(self, job, owner, lease_until):
+        """Store the job under this owner; False if another owner holds a live lease on it"""
+        key = job_key(job["video_id"], job["file_type"])
+        try:
+            self.collection.update_one(
+                {"_id": key, "$or": self._claimable(time.time()) + [{"owner": owner}]},
+                {"$set": dict(job, owner=owner, lease_until=lease_until)},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The filter did not match an existing job, so the upsert collided with it
+            return False
+        return True
+
+    def claim(self, owner, lease_until, limit):
+        """Atomically take over up to limit unowned or expired jobs, oldest first"""
+        jobs = []
+        while len(jobs) < limit:
+            doc = self.collection.find_one_and_update(
+                {"$or": self._claimable(time.time())},
+                {"$set": {"owner": owner, "lease_until": lease_until}},
+                sort=[("created_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                break
+            jobs.append({k: v for k, v in doc.items() if k not in ("_id", "owner", "lease_until")})
+        return jobs
+
+    def renew(self, owner, keys, lease_until):
+        self.collection.update_many({"_id": {"$in": keys}, "owner": owner}, {"$set": {"lease_until": lease_until}})
+
+    def delete(self, key, owner):
+        self.collection.delete_one({"_id": key, "owner": owner})
+
+    def release(self, owner):
+        """Hand this owner's remaining jobs back for any process to claim"""
+        self.collection.update_many({"owner": owner}, {"$set": {"owner": None, "lease_until": None}})
+
+class SQLiteJobStore:
+    """Local stand-in for MongoJobStore backed by a SQLite file, with the same claim semantics"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS upload_jobs (job_key TEXT PRIMARY KEY, payload TEXT NOT NULL, created_at REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(upload_jobs)")}
+        for column, column_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE upload_jobs ADD COLUMN {column} {column_type}")
+        self._conn.commit()
+
+    def save(self, job, owner, lease_until):
+        """Store the job under this owner; False if another owner holds a live lease on it"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO upload_jobs (job_key, payload, created_at, owner, lease_until) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(job_key) DO UPDATE SET payload = excluded.payload, created_at = excluded.created_at, "
+                "owner = excluded.owner, lease_until = excluded.lease_until "
+                "WHERE upload_jobs.owner IS NULL OR upload_jobs.owner = excluded.owner OR upload_jobs.lease_until < ?",
+                (job_key(job["video_id"], job["file_type"]), json.dumps(job), job["created_at"], owner, lease_until,
+                 time.time())
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def claim(self, owner, lease_until, limit):
+        """Atomically take over up to limit unowned or expired jobs, oldest first"""
+        with self._lock:
+            # One UPDATE statement holds the database write lock, so processes never claim the same row
+            self._conn.execute(
+                "UPDATE upload_jobs SET owner = ?, lease_until = ? WHERE job_key IN ("
+                "SELECT job_key FROM upload_jobs WHERE owner IS NULL OR lease_until < ? ORDER BY created_at LIMIT ?)",
+                (owner, lease_until, time.time(), limit)
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT payload FROM upload_jobs WHERE owner = ? ORDER BY created_at", (owner,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def renew(self, owner, keys, lease_until):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE upload_jobs SET lease_until = ? WHERE job_key = ? AND owner = ?",
+                [(lease_until, key, owner) for key in keys]
+            )
+            self._conn.commit()
+
+    def delete(self, key, owner):
+        with self._lock:
+            self._conn.execute("DELETE FROM upload_jobs WHERE job_key = ? AND owner = ?", (key, owner))
+            self._conn.commit()
+
+    def release(self, owner):
+        """Hand this owner's remaining jobs back for any process to claim"""
+        with self._lock:
+            self._conn.execute("UPDATE upload_jobs SET owner = NULL, lease_until = NULL WHERE owner = ?", (owner,))
+            self._conn.commit()
+
+def create_job_store():
+    """Build the job store selected by UPLOAD_QUEUE_STORE"""
+    if UPLOAD_QUEUE_STORE == "sqlite":
+        return SQLiteJobStore(UPLOAD_QUEUE_SQLITE_PATH)
+    from database import db_manager
+    return MongoJobStore(lambda: db_manager.db.upload_jobs)
+
+class UploadScheduler:
+    """Runs Telegram uploads on one long-lived event loop with a fixed pool of workers.
+
+    Jobs are deduplicated per (video_id, type), ordered by type and demand, capped
+    at max_queue pending jobs, and persisted so they survive process restarts.
+    Persisted jobs are leased to one scheduler at a time, so several worker
+    processes sharing a job store never upload the same file twice.
+    """
+
+    def __init__(self, handler, job_store=None, workers: int = UPLOAD_WORKERS, max_queue: int = UPLOAD_QUEUE_MAX):
+        self.handler = handler
+        self.job_store = job_store
+        self.workers = workers
+        self.max_queue = max_queue
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease = UPLOAD_JOB_LEASE
+        self.loop = None
+        self._queue = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._pending = {}
+        self._queued_seq = {}
+        self._running = set()
+        self._persisting = {}
+        self._demand = {}
+        self._shutdown_hooks = []
+        self._stats = {
+            'submitted': 0,
+            'deduplicated': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+            'restored': 0,
+            'claimed_elsewhere': 0
+        }
+
+    def start(self):
+        """Start the scheduler thread and its event loop (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run_loop, name="upload-scheduler", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """Stop workers and wait for the shutdown hooks; queued jobs stay in the job store for the next start"""
+        if self.loop is None or not self.loop.is_running():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        # The thread is a daemon: returning before its finally block ran would skip the hooks at exit
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logging.warning(f"Upload scheduler did not shut down within {timeout}s")
+
+    def add_shutdown_hook(self, hook):
+        """Register a coroutine function to await when the scheduler loop shuts down"""
+        self._shutdown_hooks.append(hook)
+
+    def run_coroutine(self, coro):
+        """Schedule a coroutine on the scheduler loop from any thread"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def record_demand(self, video_id):
+        """Count a request for video_id so popular uploads are scheduled first"""
+        with self._lock:
+            if len(self._demand) >= DEMAND_TRACK_MAX and video_id not in self._demand:
+                self._demand.clear()
+            self._demand[video_id] = self._demand.get(video_id, 0) + 1
+
+    def submit(self, video_id, download_url, file_type, quality):
+        """Queue an upload; returns False if it was deduplicated or rejected"""
+        self.start()
+        key = job_key(video_id, file_type)
+        with self._lock:
+            if key in self._running:
+                self._stats['deduplicated'] += 1
+                return False
+            if key in self._pending:
+                # Already queued: re-push with the current (possibly higher) priority
+                self._stats['deduplicated'] += 1
+                self._enqueue_locked(key, self._pending[key])
+                return False
+            if len(self._pending) >= self.max_queue:
+                self._stats['rejected'] += 1
+                logging.warning(f"Upload queue full ({self.max_queue}), rejecting {key}")
+                return False
+
+            job = {
+                "video_id": video_id,
+                "download_url": download_url,
+                "file_type": file_type,
+                "quality": quality,
+                "created_at": time.time()
+            }
+            self._pending[key] = job
+            self._stats['submitted'] += 1
+            if self.job_store is not None:
+                self.loop.call_soon_threadsafe(self._persist, job)
+            self._enqueue_locked(key, job)
+        return True
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._pending) - len(self._running)
+            stats['running'] = len(self._running)
+            stats['workers'] = self.workers
+            return stats
+
+    def _priority(self, job):
+        demand = self._demand.get(job["video_id"], 0)
+        return (TYPE_PRIORITY.get(job["file_type"], len(TYPE_PRIORITY)), -demand)
+
+    def _enqueue_locked(self, key, job):
+        seq = next(self._seq)
+        self._queued_seq[key] = seq
+        entry = (self._priority(job), seq, key)
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, entry)
+
+    def _persist(self, job):
+        key = job_key(job["video_id"], job["file_type"])
+        self._persisting[key] = self.loop.run_in_executor(
+            None, self._call_store, "save", job, self.owner, time.time() + self.lease
+        )
+
+    def _call_store(self, method, *args):
+        try:
+            return getattr(self.job_store, method)(*args)
+        except Exception as e:
+            logging.error(f"Upload job store {method} failed: {str(e)}")
+            return None
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._queue = asyncio.PriorityQueue()
+        for _ in range(self.workers):
+            self.loop.create_task(self._worker())
+        self.loop.create_task(self._lease_loop())
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            for hook in self._shutdown_hooks:
+                try:
+                    self.loop.run_until_complete(hook())
+                except Exception as e:
+                    logging.error(f"Upload scheduler shutdown hook failed: {str(e)}")
+            if self.job_store is not None:
+                # Unfinished jobs go back to the store for another process to claim right away
+                self._call_store("release", self.owner)
+            self.loop.close()
+
+    async def _lease_loop(self):
+        """Claim persisted jobs no live process owns, then keep renewing the leases on ours"""
+        if self.job_store is None:
+            return
+        while True:
+            await self._claim()
+            await asyncio.sleep(self.lease / 3)
+            with self._lock:
+                keys = list(self._pending)
+            if keys:
+                await self.loop.run_in_executor(
+                    None, self._call_store, "renew", self.owner, keys, time.time() + self.lease
+                )
+
+    async def _claim(self):
+        """Queue jobs left behind by stopped or crashed processes"""
+        with self._lock:
+            limit = self.max_queue - len(self._pending)
+        if limit <= 0:
+            return
+        jobs = await self.loop.run_in_executor(
+            None, self._call_store, "claim", self.owner, time.time() + self.lease, limit
+        )
+        restored = 0
+        with self._lock:
+            for job in jobs or []:
+                key = job_key(job["video_id"], job["file_type"])
+                if key in self._pending:
+                    continue
+                self._pending[key] = job
+                self._stats['restored'] += 1
+                restored += 1
+                self._enqueue_locked(key, job)
+        if restored:
+            logging.info(f"Claimed {restored} queued upload jobs")
+
+    async def _worker(self):
+        while True:
+            _, seq, key = await self._queue.get()
+            with self._lock:
+                job = self._pending.get(key)
+                # Skip superseded entries left behind by re-prioritisation
+                if job is None or key in self._running or self._queued_seq.get(key) != seq:
+                    continue
+                self._running.add(key)
+
+            # A job another process already leased is theirs to upload. A failed save (None) is
+            # not a lease conflict, so the job still uploads here rather than being lost
+            persisting = self._persisting.pop(key, None)
+            if persisting is not None and await persisting is False:
+                with self._lock:
+                    self._pending.pop(key, None)
+                    self._queued_seq.pop(key, None)
+                    self._running.discard(key)
+                    self._stats['claimed_elsewhere'] += 1
+                logging.info(f"Upload job {key} is leased by another process, skipping")
+                continue
+
+            try:
+                await self.handler(job)
+                outcome = 'completed'
+            except Exception as e:
+                logging.error(f"Upload job {key} failed: {str(e)}")
+                outcome = 'failed'
+
+            with self._lock:
+                self._pending.pop(key, None)
+                self._queued_seq.pop(key, None)
+                self._running.discard(key)
+                self._stats[outcome] += 1
+            if self.job_store is not None:
+                await self.loop.run_in_executor(None, self._call_store, "delete", key, self.owner)
@@ -0,0 +1,32 @@
+import re
+from functools import lru_cache
+from config import VIDEO_ID_CACHE_SIZE
+
+# YouTube video IDs are 11 characters of the URL-safe base64 alphabet
+_ID = r'([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])'
+# Any subdomain (www., m., music., gaming.) and the privacy-enhanced embed host
+_HOST = r'(?:^|[/.@])(?:youtube\.com|youtube-nocookie\.com)'
+
+_PATTERNS = (
+    # watch?v=ID, with v anywhere in the query string
+    re.compile(_HOST + r'/watch/?\?(?:[^#]*?&)?v=' + _ID, re.IGNORECASE),
+    re.compile(_HOST + r'/(?:shorts|live|embed|v|e)/' + _ID, re.IGNORECASE),
+    re.compile(r'(?:^|[/.@])youtu\.be/' + _ID, re.IGNORECASE)
+)
+_BARE_ID = re.compile(r'[A-Za-z0-9_-]{11}')
+
+@lru_cache(maxsize=VIDEO_ID_CACHE_SIZE)
+def canonical_video_id(url):
+    """Video ID for any YouTube URL form (watch, youtu.be, shorts, live, embed, music, mobile), or None"""
+    url = url.strip()
+    if _BARE_ID.fullmatch(url):
+        return url
+    for pattern in _PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return match.group(1)
+    return None
+
+def info_cache_key(url):
+    """Cache key for a URL's video info, stable across URL variants and processes"""
+    return f"info_{canonical_video_id(url) or url}"
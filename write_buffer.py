@@ -0,0 +1,224 @@
+import atexit
+import logging
+import threading
+import time
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from config import WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_INTERVAL
+
+class WriteBehindBuffer:
+    """Collects $set writes per video_id and flushes them as unordered bulk writes.
+
+    Writes for the same video are merged (later fields win). A flush runs when
+    max_batch videos are queued, every interval seconds, and at exit. Pending
+    writes stay readable through overlay() until they are committed.
+    """
+
+    def __init__(self, collection, on_counts, insert_counter=None,
+                 max_batch: int = WRITE_BEHIND_MAX_BATCH, interval: float = WRITE_BEHIND_INTERVAL):
+        self.collection = collection
+        # Called with {counter: increment} after each flush
+        self.on_counts = on_counts
+        # Counter bumped for every document an upsert inserts
+        self.insert_counter = insert_counter
+        self.max_batch = max_batch
+        self.interval = interval
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+        self._stats = {
+            'writes': 0,
+            'merged': 0,
+            'flushes': 0,
+            'flushed_videos': 0,
+            'bulk_writes': 0,
+            'errors': 0
+        }
+
+    def add(self, video_id, fields, upsert=False, first_set=None):
+        """Queue a $set of fields for video_id.
+
+        first_set is a (field, counter) pair: counter is bumped only if field did not exist before.
+        """
+        self._start()
+        with self._lock:
+            entry = self._pending.get(video_id)
+            if entry is None:
+                entry = {"fields": {}, "upsert": False, "first_set": {}}
+                self._pending[video_id] = entry
+            else:
+                self._stats['merged'] += 1
+            self._stats['writes'] += 1
+            entry["fields"].update(fields)
+            entry["upsert"] = entry["upsert"] or upsert
+            if first_set is not None:
+                field, counter = first_set
+                entry["first_set"][field] = counter
+            if len(self._pending) >= self.max_batch:
+                self._wakeup.notify()
+
+    def overlay(self, video_id, doc):
+        """Return doc with the queued writes for video_id applied (read-your-writes)"""
+        with self._lock:
+            entries = [e for e in (self._flushing.get(video_id), self._pending.get(video_id)) if e is not None]
+        if not entries:
+            return doc
+        if doc is None and not any(e["upsert"] for e in entries):
+            # Updates to a document that does not exist yet match nothing when flushed
+            return None
+        merged = dict(doc or {})
+        for entry in entries:
+            merged.update(entry["fields"])
+        merged["video_id"] = video_id
+        return merged
+
+    def flush(self):
+        """Write everything queued so far; returns the number of videos flushed"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+            batch = self._flushing
+            try:
+                retry = self._write(batch)
+            except Exception as e:
+                self._stats['errors'] += 1
+                logging.error(f"Write-behind flush failed, will retry: {str(e)}")
+                with self._lock:
+                    self._requeue_locked(batch)
+            else:
+                if retry:
+                    with self._lock:
+                        self._requeue_locked(retry)
+                self._stats['flushes'] += 1
+                self._stats['flushed_videos'] += len(batch) - len(retry)
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            return len(batch)
+
+    def close(self):
+        """Stop the flusher thread and write whatever is still queued"""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self.flush()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._pending) + len(self._flushing)
+            return stats
+
+    def _write(self, batch):
+        """Apply a batch in dependency order, with one bulk write per group.
+
+        Each bulk fails on its own: documents rejected by MongoDB are logged and
+        dropped, and entries whose bulk failed outright are returned for retry.
+        """
+        counts = {}
+        retry = set()
+        # Plain field writes (and inserts) first so guarded writes can match new documents
+        main = []
+        guarded = {}
+        for video_id, entry in batch.items():
+            fields = {k: v for k, v in entry["fields"].items() if k not in entry["first_set"]}
+            if fields:
+                main.append((video_id, UpdateOne({"video_id": video_id}, {"$set": fields}, upsert=entry["upsert"])))
+            for field, counter in entry["first_set"].items():
+                guarded.setdefault((field, counter), []).append((video_id, entry["fields"][field]))
+
+        if main:
+            result = self._bulk(main, retry)
+            if self.insert_counter and result["nUpserted"]:
+                counts[self.insert_counter] = result["nUpserted"]
+
+        overwrites = []
+        for (field, counter), writes in guarded.items():
+            # Retried entries are rewritten whole next flush; their guarded writes wait for the main write
+            writes = [(video_id, value) for video_id, value in writes if video_id not in retry]
+            if not writes:
+                continue
+            # A separate bulk per counter so nModified maps onto exactly one counter
+            result = self._bulk([
+                (video_id, UpdateOne({"video_id": video_id, field: {"$exists": False}}, {"$set": {field: value}}))
+                for video_id, value in writes
+            ], retry)
+            if result["nModified"]:
+                counts[counter] = counts.get(counter, 0) + result["nModified"]
+            if result["nModified"] < len(writes):
+                # Some already had the field; overwrite it unconditionally like a plain update
+                overwrites.extend(
+                    (video_id, UpdateOne({"video_id": video_id}, {"$set": {field: value}}))
+                    for video_id, value in writes if video_id not in retry
+                )
+        if overwrites:
+            self._bulk(overwrites, retry)
+
+        if counts:
+            self.on_counts(counts)
+        logging.info(f"Write-behind flushed {len(batch) - len(retry)} videos")
+        return {video_id: batch[video_id] for video_id in retry}
+
+    def _bulk(self, writes, retry):
+        """Run (video_id, UpdateOne) pairs as one unordered bulk; returns its nUpserted/nModified.
+
+        Video ids of a bulk that failed outright are added to retry.
+        """
+        self._stats['bulk_writes'] += 1
+        video_ids = [video_id for video_id, _ in writes]
+        try:
+            result = self.collection.bulk_write([request for _, request in writes], ordered=False)
+            return {"nUpserted": result.upserted_count, "nModified": result.modified_count}
+        except BulkWriteError as e:
+            # Unordered: everything except the reported writes was applied, and those will not succeed on retry
+            self._stats['errors'] += 1
+            failed = [video_ids[error["index"]] for error in e.details.get("writeErrors", [])]
+            logging.error(f"Write-behind dropped {len(failed)} rejected writes: {failed}")
+            return {"nUpserted": e.details.get("nUpserted", 0), "nModified": e.details.get("nModified", 0)}
+        except Exception as e:
+            self._stats['errors'] += 1
+            logging.error(f"Write-behind bulk write failed, will retry {len(video_ids)} videos: {str(e)}")
+            retry.update(video_ids)
+            return {"nUpserted": 0, "nModified": 0}
+
+    def _requeue_locked(self, batch):
+        """Put a failed batch back underneath anything queued since"""
+        for video_id, entry in batch.items():
+            newer = self._pending.get(video_id)
+            if newer is not None:
+                entry["fields"].update(newer["fields"])
+                entry["upsert"] = entry["upsert"] or newer["upsert"]
+                entry["first_set"].update(newer["first_set"])
+            self._pending[video_id] = entry
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadline = time.time() + self.interval
+                while not self._closed and len(self._pending) < self.max_batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(remaining)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Write-behind flusher error: {str(e)}")
@@ -1,145 +1,289 @@
 import base64
 import json
+import os
 import requests
 import requests.adapters
+import sys
 import threading
 import time
 import logging
 import asyncio
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from Crypto.Cipher import AES
+from config import (
+    PROBE_MAX_WORKERS, VIDEO_PROBE_TIMEOUT, AUDIO_PROBE_TIMEOUT, PROBE_DEADLINE, ASYNC_UPSTREAM_POOL_LIMIT,
+    BATCH_CONCURRENCY, TELEGRAM_URL_TTL, DOWNLOAD_URL_TTL, REFRESH_AHEAD_FRACTION, TELEGRAM_REFRESH_TIMEOUT,
+    UPSTREAM_SCHEME, CDN_DISCOVERY_URL
+)
 from database import db_manager
-from telegram_service import telegram_service
+from singleflight import SingleFlight, AsyncSingleFlight
+from quality_prober import QualityProber, AvailabilityCache
+from upload_scheduler import UploadScheduler, create_job_store
+from cdn_pool import CdnPool
+from hedging import Hedger
+from video_ids import canonical_video_id, info_cache_key
+from media_cache import media_cache
+import metrics
+import startup
+
+# Qualities in priority order, with the per-probe timeout for each download type
+DOWNLOAD_CANDIDATES = {
+    'video': (["1080", "720", "480", "360"], VIDEO_PROBE_TIMEOUT),
+    'audio': (["320", "256", "192", "128", "mp3", "m4a"], AUDIO_PROBE_TIMEOUT)
+}
+
+AES_KEY = bytes.fromhex("C5D58EF67A7584E4A29F6C35BBC4EB12")
+# The fields _info_from_response reads from a decrypted /v2/info payload
+INFO_FIELDS = ("title", "durationLabel", "thumbnail", "key")
+# Below this size a full json.loads is cheaper than scanning for the fields
+FIELD_SCAN_MIN_BYTES = 8 * 1024
+
+# pycryptodome's AES module and unpad, resolved by load_crypto
+AES = None
+unpad = None
+
+def load_crypto():
+    """Import pycryptodome on first use (or by warm-up); loading its native code is slow"""
+    global AES, unpad
+    if AES is None:
+        from Crypto.Util.Padding import unpad
+        # Bound last: other threads check AES, so unpad is always set once it is
+        from Crypto.Cipher import AES
+
+def decrypt_payload(b64_encrypted, key=AES_KEY):
+    """AES-CBC decrypt a base64 payload (IV first) to plaintext bytes with the padding removed"""
+    if AES is None:
+        load_crypto()
+    # b64decode discards characters outside the alphabet, so line breaks and spaces need no cleanup
+    data = base64.b64decode(b64_encrypted)
+    plaintext = AES.new(key, AES.MODE_CBC, data[:16]).decrypt(data[16:])
+    try:
+        return unpad(plaintext, AES.block_size)
+    except ValueError:
+        # Not PKCS#7: treat as zero padding
+        return plaintext.rstrip(b"\x00")
+
+def parse_payload(plaintext):
+    """Parse decrypted JSON bytes, tolerating stray bytes around the object"""
+    try:
+        return json.loads(plaintext)
+    except ValueError:
+        pass
+    start, end = plaintext.find(b"{"), plaintext.rfind(b"}") + 1
+    if 0 <= start < end:
+        try:
+            return json.loads(plaintext[start:end])
+        except ValueError:
+            pass
+    logging.error(f"JSON decode error, decrypted data: {plaintext[:500]!r}...")
+    raise Exception("Failed to parse decrypted data")
+
+def extract_string_fields(plaintext, fields):
+    """Decode just the named string fields from JSON bytes without parsing the rest.
+
+    Returns None when that cannot be done safely (a field is missing, not a
+    string, or its name occurs more than once), so callers fall back to parse_payload.
+    """
+    result = {}
+    for name in fields:
+        marker = b'"' + name.encode() + b'":'
+        at = plaintext.find(marker)
+        if at < 0 or plaintext.find(marker, at + 1) >= 0:
+            return None
+        start = at + len(marker)
+        while plaintext[start:start + 1] in (b" ", b"\t", b"\n", b"\r"):
+            start += 1
+        if plaintext[start:start + 1] != b'"':
+            return None
+        end = start
+        while True:
+            end = plaintext.find(b'"', end + 1)
+            if end < 0:
+                return None
+            # A quote preceded by an odd number of backslashes is escaped
+            backslashes = 0
+            while plaintext[end - 1 - backslashes] == 0x5C:
+                backslashes += 1
+            if backslashes % 2 == 0:
+                break
+        value = plaintext[start + 1:end]
+        result[name] = json.loads(plaintext[start:end + 1]) if b"\\" in value else value.decode("utf-8")
+    return result
+
+def decrypt_info_payload(b64_encrypted):
+    """INFO_FIELDS of an encrypted /v2/info payload; large payloads are scanned, not fully parsed"""
+    plaintext = decrypt_payload(b64_encrypted)
+    fields = None
+    if len(plaintext) >= FIELD_SCAN_MIN_BYTES:
+        fields = extract_string_fields(plaintext, INFO_FIELDS)
+    if fields is None:
+        payload = parse_payload(plaintext)
+        fields = {name: payload[name] for name in INFO_FIELDS}
+    return fields
+
+def _telegram():
+    """The Telegram service, imported on first use (it pulls in aiohttp)"""
+    from telegram_service import telegram_service
+    return telegram_service
 
 class OptimizedYtmp4Service:
     def __init__(self, cache_manager):
-        self.hex_key = "C5D58EF67A7584E4A29F6C35BBC4EB12"
         self.cache_manager = cache_manager
         self.session = requests.Session()
         # Configure session with connection pooling
         adapter = requests.adapters.HTTPAdapter(
             pool_connections=20,
-            pool_maxsize=20,
+            pool_maxsize=max(20, PROBE_MAX_WORKERS),
             max_retries=3
         )
         self.session.mount('http://', adapter)
         self.session.mount('https://', adapter)
+        # Discovery fails fast: the pool retries on its next refresh instead of stalling a request
+        self._discovery_session = requests.Session()
+        self._discovery_session.mount('http://', requests.adapters.HTTPAdapter(max_retries=0))
+        self._discovery_session.mount('https://', requests.adapters.HTTPAdapter(max_retries=0))
         self._lock = threading.Lock()
+        # Health-scored upstream hosts, discovered in the background
+        self.cdn_pool = CdnPool(self._discover_cdn)
+        self.cdn_pool.start()
+        # Duplicates slow /v2/info calls to a second CDN within a load budget
+        self.hedger = Hedger()
+        # Coalesces concurrent upstream resolutions for the same video/key
+        self.inflight = SingleFlight()
+        self.async_inflight = AsyncSingleFlight()
+        # aiohttp session for the async request path, created on the serving loop
+        self._async_session = None
+        self._async_session_loop = None
+        # Shared pool for concurrent quality probes
+        self.prober = QualityProber(PROBE_MAX_WORKERS)
+        # Keys with a refresh-ahead in flight (cached download URLs and Telegram links)
+        self._refreshing = set()
+        self._refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="refresh-ahead")
+        self._refresh_tasks = set()
+        # Remembers which qualities exist per key so repeat resolutions skip known failures
+        self.availability = AvailabilityCache(cache_manager)
+        # Fixed pool of upload workers on one long-lived event loop
+        self.upload_scheduler = UploadScheduler(self._upload_job, create_job_store())
+        # The pooled Telegram session lives on the scheduler loop and closes with it
+        self.upload_scheduler.add_shutdown_hook(self._close_telegram)
+
+    def warm_up_steps(self):
+        """(name, fn) pairs that open connections and load libraries ahead of the first request"""
+        return [
+            ("mongo", db_manager.warm_up),
+            ("cdn_pool", lambda: self.cdn_pool.refresh(if_empty=True)),
+            ("crypto", load_crypto),
+            ("telegram", self._warm_up_telegram)
+        ]
 
-    def hex_to_bytes(self, hex_str):
-        return bytes.fromhex(hex_str)
+    def _warm_up_telegram(self):
+        # Starts the scheduler (restoring persisted jobs) and creates the pooled session on its loop
+        self.upload_scheduler.run_coroutine(_telegram().get_session()).result(timeout=TELEGRAM_REFRESH_TIMEOUT)
 
-    def b64_to_bytes(self, b64):
-        return base64.b64decode(b64.replace("\n", "").replace(" ", ""))
+    async def _close_telegram(self):
+        if "telegram_service" in sys.modules:
+            await _telegram().close()
 
     def decrypt(self, b64_encrypted):
-        try:
-            raw = self.hex_to_bytes(self.hex_key)
-            data = self.b64_to_bytes(b64_encrypted)
-            iv = data[:16]
-            cipher_data = data[16:]
-            cipher = AES.new(raw, AES.MODE_CBC, iv)
-            decrypted = cipher.decrypt(cipher_data)
-            decrypted = decrypted.rstrip(b"\x00")
-            
-            # Clean the decrypted data before JSON parsing
-            decrypted_str = decrypted.decode("utf-8")
-            # Remove any extra characters that might cause JSON parsing issues
-            decrypted_str = decrypted_str.strip()
-            
-            # Try to find the JSON part if there's extra data
-            json_start = decrypted_str.find('{')
-            json_end = decrypted_str.rfind('}') + 1
-            
-            if json_start >= 0 and json_end > json_start:
-                json_str = decrypted_str[json_start:json_end]
-                return json.loads(json_str)
-            else:
-                return json.loads(decrypted_str)
-                
-        except json.JSONDecodeError as e:
-            logging.error(f"JSON decode error: {str(e)}")
-            if 'decrypted_str' in locals():
-                logging.error(f"Decrypted data: {decrypted_str[:500]}...")  # Log first 500 chars
-            raise Exception("Failed to parse decrypted data")
+        """Decrypt an upstream payload into a dict"""
+        with metrics.timed("decrypt"):
+            return parse_payload(decrypt_payload(b64_encrypted))
+
+    def decrypt_info(self, b64_encrypted):
+        """Decrypt a /v2/info payload, decoding only INFO_FIELDS when the layout allows it"""
+        with metrics.timed("decrypt"):
+            return decrypt_info_payload(b64_encrypted)
 
     def get_cdn(self):
-        """Get CDN with caching for faster subsequent requests"""
-        cache_key = "current_cdn"
-        cdn = self.cache_manager.get(cache_key)
-        
-        if cdn:
-            return cdn
-            
-        retries = 3  # Reduced retries for faster response
-        while retries:
-            try:
-                r = self.session.get("https://media.savetube.me/api/random-cdn", timeout=3)
-                cdn = r.json().get("cdn")
-                if cdn:
-                    # Cache CDN for 5 minutes
-                    self.cache_manager.set(cache_key, cdn, ttl=300)
-                    return cdn
-            except Exception as e:
-                logging.warning(f"CDN fetch attempt failed: {str(e)}")
-                retries -= 1
-                time.sleep(0.5)  # Short delay between retries
-        
-        raise Exception("CDN fetch failed after retries")
+        """Best upstream CDN from the pool; only waits for discovery while the pool is empty"""
+        cdn = self.cdn_pool.pick()
+        if cdn is None:
+            self.cdn_pool.refresh(if_empty=True)
+            cdn = self.cdn_pool.pick()
+        if cdn is None:
+            raise Exception("CDN fetch failed: no CDN discovered")
+        return cdn
+
+    def _discover_cdn(self):
+        with metrics.timed("cdn_fetch") as timer:
+            r = self._discovery_session.get(CDN_DISCOVERY_URL, timeout=3)
+            cdn = r.json().get("cdn")
+            if not cdn:
+                timer.outcome = "empty"
+        return cdn
+
+    def _cache_lookup(self, cache_key):
+        """In-memory cache get, timed as the cache_lookup stage"""
+        with metrics.timed("cache_lookup") as timer:
+            value = self.cache_manager.get(cache_key)
+            timer.outcome = "hit" if value else "miss"
+        return value
+
+    def _cache_lookup_with_ttl(self, cache_key):
+        with metrics.timed("cache_lookup") as timer:
+            cached = self.cache_manager.get_with_ttl(cache_key)
+            timer.outcome = "hit" if cached is not None else "miss"
+        return cached
+
+    async def _cache_lookup_async(self, cache_key):
+        """Async version of _cache_lookup; shared-tier round trips run off the event loop"""
+        with metrics.timed("cache_lookup") as timer:
+            value = await self.cache_manager.get_async(cache_key)
+            timer.outcome = "hit" if value else "miss"
+        return value
+
+    async def _cache_lookup_with_ttl_async(self, cache_key):
+        with metrics.timed("cache_lookup") as timer:
+            cached = await self.cache_manager.get_with_ttl_async(cache_key)
+            timer.outcome = "hit" if cached is not None else "miss"
+        return cached
+
+    def _post_upstream(self, path, payload, timeout, cdn=None):
+        """POST to the best (or given) CDN and feed latency and outcome back into the pool"""
+        cdn = cdn or self.get_cdn()
+        start = time.time()
+        try:
+            r = self.session.post(f"{UPSTREAM_SCHEME}://{cdn}{path}", json=payload, timeout=timeout)
+        except Exception:
+            self.cdn_pool.record(cdn, time.time() - start, False)
+            raise
+        # 4xx answers (e.g. an unavailable quality) are the request's fault, not the host's
+        self.cdn_pool.record(cdn, time.time() - start, r.status_code < 500)
+        return r
 
     def get_info(self, url):
-        """Get video info with MongoDB and Telegram caching"""
-        # Step 1: Check MongoDB first (fastest)
+        """Get video info with in-memory, MongoDB and Telegram caching"""
+        # Step 1: Check in-memory cache (no network round trip)
+        cache_key = info_cache_key(url)
+        cached_info = self._cache_lookup(cache_key)
+        if cached_info:
+            logging.info("Returning cached video info")
+            metrics.record_tier("info", "memory")
+            return cached_info
+        
+        # Step 2: Check MongoDB (read-through document cache, one round trip at most)
         video_data = db_manager.find_video_by_url(url)
         if video_data:
             logging.info("Returning video info from MongoDB")
-            return {
-                "title": video_data["title"],
-                "duration": video_data["duration"],
-                "thumbnail": video_data["thumbnail"],
-                "key": video_data["key"],
-                "video_id": video_data["video_id"]
-            }
-        
-        # Step 2: Check in-memory cache
-        cache_key = f"info_{hash(url)}"
+            metrics.record_tier("info", "mongo")
+            return self._info_from_document(video_data)
+            
+        # Step 3: Fetch from external API (one upstream call per video at a time)
+        flight_key = info_cache_key(url)
+        info = self.inflight.do(flight_key, self._fetch_info, url, cache_key)
+        metrics.record_tier("info", "upstream")
+        return info
+
+    def _fetch_info(self, url, cache_key):
+        """Resolve video info from the external API and persist it"""
+        # Another caller may have finished the same resolution while we were waiting
         cached_info = self.cache_manager.get(cache_key)
         if cached_info:
-            logging.info("Returning cached video info")
             return cached_info
-            
-        # Step 3: Fetch from external API
-        cdn = self.get_cdn()
+
         try:
-            r = self.session.post(f"https://{cdn}/v2/info", 
-                                json={"url": url}, 
-                                timeout=8)
-            res = r.json()
-            
-            if not res.get("status"):
-                raise Exception(res.get("message", "Failed to fetch video info"))
-            
-            decrypted = self.decrypt(res["data"])
-            video_id = db_manager.extract_video_id(url)
-            
-            info = {
-                "title": decrypted["title"],
-                "duration": decrypted["durationLabel"],
-                "thumbnail": decrypted["thumbnail"],
-                "key": decrypted["key"],
-                "video_id": video_id
-            }
+            info, video_data = self._request_info(url)
             
             # Save to MongoDB for future use
-            video_data = {
-                "video_id": video_id,
-                "title": decrypted["title"],
-                "duration": decrypted["durationLabel"],
-                "thumbnail": decrypted["thumbnail"],
-                "key": decrypted["key"],
-                "url": url,
-                "created_at": time.time()
-            }
             db_manager.save_video_data(video_data)
             
             # Cache info for 1 hour
@@ -150,188 +294,855 @@ class OptimizedYtmp4Service:
             logging.error(f"Error getting video info: {str(e)}")
             raise
 
+    def _request_info(self, url):
+        """POST /v2/info for one URL (hedged across CDNs); returns (info, document to persist)"""
+        request = lambda cdn: self._post_upstream("/v2/info", {"url": url}, timeout=8, cdn=cdn).json()
+        with metrics.timed("upstream_info"):
+            primary = self.get_cdn()
+            if self.hedger.enabled:
+                res = self.hedger.run(request, primary, lambda: self.cdn_pool.pick(exclude=(primary,)))
+            else:
+                res = request(primary)
+        return self._info_from_response(url, res)
+
+    def get_info_batch(self, urls):
+        """Yield (index, info, error) for each URL as it resolves.
+
+        Cache hits come first, then one $in lookup for the rest, then upstream
+        resolution with bounded concurrency; new documents are saved with one bulk write.
+        """
+        misses = {}
+        for index, url in enumerate(urls):
+            cached_info = self._cache_lookup(info_cache_key(url))
+            if cached_info:
+                metrics.record_tier("info", "memory")
+                yield index, cached_info, None
+            else:
+                video_id = canonical_video_id(url)
+                misses.setdefault(video_id or url, (video_id, []))[1].append(index)
+
+        documents = db_manager.get_videos([video_id for video_id, _ in misses.values() if video_id])
+        unresolved = {}
+        for flight_key, (video_id, indexes) in misses.items():
+            if video_id in documents:
+                info = self._info_from_document(documents[video_id])
+                for index in indexes:
+                    metrics.record_tier("info", "mongo")
+                    yield index, info, None
+            else:
+                unresolved[flight_key] = indexes
+        if not unresolved:
+            return
+
+        # Same URL or video twice in one batch is only resolved once, and a video already
+        # being resolved by another request is waited for rather than fetched again
+        new_documents = []
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(unresolved)))
+        try:
+            futures = {}
+            for indexes in unresolved.values():
+                url = urls[indexes[0]]
+                cache_key = info_cache_key(url)
+                future = executor.submit(
+                    self.inflight.do, cache_key, self._fetch_batch_info, url, cache_key, new_documents
+                )
+                futures[future] = indexes
+            for future in as_completed(futures):
+                indexes = futures[future]
+                try:
+                    info = future.result()
+                except Exception as e:
+                    logging.error(f"Error getting video info in batch: {str(e)}")
+                    for index in indexes:
+                        yield index, None, str(e)
+                    continue
+                for index in indexes:
+                    # Other URL forms of the same video get their own cache entry
+                    self.cache_manager.set(info_cache_key(urls[index]), info, ttl=3600)
+                    metrics.record_tier("info", "upstream")
+                    yield index, info, None
+        finally:
+            # Runs even if the client disconnects mid-stream, so resolved videos are kept
+            executor.shutdown(wait=False, cancel_futures=True)
+            db_manager.save_videos_bulk(new_documents)
+
+    def _fetch_batch_info(self, url, cache_key, new_documents):
+        """_fetch_info for batch misses: the document joins new_documents for the batch's bulk write"""
+        cached_info = self.cache_manager.get(cache_key)
+        if cached_info:
+            return cached_info
+        info, video_data = self._request_info(url)
+        if video_data["video_id"]:
+            new_documents.append(video_data)
+        self.cache_manager.set(cache_key, info, ttl=3600)
+        return info
+
+    def get_download_batch(self, items):
+        """Yield (index, (download_url, quality), error) for each {key, video_id, type} item as it resolves"""
+        documents = db_manager.get_videos([item["video_id"] for item in items if item.get("video_id")])
+        pending = []
+        for index, item in enumerate(items):
+            key = item.get("key")
+            video_id = item.get("video_id")
+            file_type = item.get("type", "video")
+            if not key:
+                yield index, None, "Missing video key"
+                continue
+            if file_type not in DOWNLOAD_CANDIDATES:
+                yield index, None, "Invalid download type"
+                continue
+            
+            if video_id:
+                self.upload_scheduler.record_demand(video_id)
+                stored_result = self._stored_download(documents.get(video_id), file_type)
+                if stored_result:
+                    yield index, stored_result, None
+                    continue
+            
+            cache_key = f"{file_type}_{key}"
+            cached_result = self._cached_download(key, video_id, cache_key, file_type)
+            if cached_result:
+                metrics.record_tier("download", "memory")
+                yield index, cached_result, None
+            else:
+                pending.append((index, key, video_id, cache_key, file_type))
+        if not pending:
+            return
+
+        # Duplicate keys within the batch coalesce in the single-flight group
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(pending)))
+        try:
+            futures = {
+                executor.submit(self.inflight.do, cache_key, self._resolve_download, key, video_id, cache_key, file_type): index
+                for index, key, video_id, cache_key, file_type in pending
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield futures[future], None, str(e)
+                    continue
+                metrics.record_tier("download", "upstream")
+                yield futures[future], result, None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _info_from_document(self, video_data):
+        return {
+            "title": video_data["title"],
+            "duration": video_data["duration"],
+            "thumbnail": video_data["thumbnail"],
+            "key": video_data["key"],
+            "video_id": video_data["video_id"]
+        }
+
+    def _info_from_response(self, url, res):
+        """Decrypt a /v2/info response into (info, document to persist)"""
+        if not res.get("status"):
+            raise Exception(res.get("message", "Failed to fetch video info"))
+        
+        decrypted = self.decrypt_info(res["data"])
+        video_id = canonical_video_id(url)
+        
+        info = {
+            "title": decrypted["title"],
+            "duration": decrypted["durationLabel"],
+            "thumbnail": decrypted["thumbnail"],
+            "key": decrypted["key"],
+            "video_id": video_id
+        }
+        video_data = dict(info, url=url, created_at=time.time())
+        return info, video_data
+
     def get_best_quality_download(self, key, video_id=None):
         """Get highest quality video download with Telegram caching"""
-        # Step 1: Check MongoDB for Telegram URL first (super fast)
+        # Step 1: Serve a stored copy (local media cache, then Telegram via MongoDB)
         if video_id:
-            video_data = db_manager.videos_collection.find_one({"video_id": video_id})
-            if video_data and video_data.get("video_telegram_url"):
-                logging.info("Returning video from Telegram channel")
-                return video_data["video_telegram_url"], video_data.get("video_quality", "HD")
+            self.upload_scheduler.record_demand(video_id)
+            stored_result = self._stored_download(db_manager.get_video(video_id), 'video')
+            if stored_result:
+                return stored_result
         
         # Step 2: Check in-memory cache
         cache_key = f"video_{key}"
-        cached_result = self.cache_manager.get(cache_key)
+        cached_result = self._cached_download(key, video_id, cache_key, 'video')
         if cached_result:
             logging.info("Returning cached video download URL")
+            metrics.record_tier("download", "memory")
             return cached_result
             
-        # Step 3: Fetch from external API
-        qualities = ["1080", "720", "480", "360"]
-        
-        def check_quality(quality):
-            try:
-                cdn = self.get_cdn()
-                r = self.session.post(f"https://{cdn}/download", json={
-                    "downloadType": "video",
-                    "quality": quality,
-                    "key": key
-                }, timeout=8)
-                
-                if r.status_code == 200:
-                    res = r.json()
-                    if res.get("status") and res["data"].get("downloadUrl"):
-                        return res["data"]["downloadUrl"], quality
-                return None
-            except Exception as e:
-                logging.warning(f"Quality {quality} check failed: {str(e)}")
-                return None
-
-        # Try qualities in priority order
-        for quality in qualities:
-            logging.info(f"Trying video quality: {quality}p")
-            result = check_quality(quality)
-            if result:
-                download_url, found_quality = result
-                logging.info(f"Successfully found {found_quality}p video quality")
-                
-                # Cache for 30 minutes
-                self.cache_manager.set(cache_key, (download_url, found_quality), ttl=1800)
-                
-                # Background upload to Telegram (fire and forget)
-                if video_id:
-                    logging.info(f"Starting background upload for video {video_id}")
-                    self.background_upload_to_telegram(video_id, download_url, 'video', found_quality)
-                
-                return download_url, found_quality
-        
-        raise Exception("No HD video download URL found - all qualities failed")
+        # Step 3: Fetch from external API (one upstream resolution per key at a time)
+        result = self.inflight.do(cache_key, self._resolve_download, key, video_id, cache_key, 'video')
+        metrics.record_tier("download", "upstream")
+        return result
 
     def get_best_audio_download(self, key, video_id=None):
         """Get highest quality audio download with Telegram caching"""
-        # Step 1: Check MongoDB for Telegram URL first (super fast)
+        # Step 1: Serve a stored copy (local media cache, then Telegram via MongoDB)
         if video_id:
-            video_data = db_manager.videos_collection.find_one({"video_id": video_id})
-            if video_data and video_data.get("audio_telegram_url"):
-                logging.info("Returning audio from Telegram channel")
-                return video_data["audio_telegram_url"], video_data.get("audio_quality", "HD")
+            self.upload_scheduler.record_demand(video_id)
+            stored_result = self._stored_download(db_manager.get_video(video_id), 'audio')
+            if stored_result:
+                return stored_result
         
         # Step 2: Check in-memory cache
         cache_key = f"audio_{key}"
-        cached_result = self.cache_manager.get(cache_key)
+        cached_result = self._cached_download(key, video_id, cache_key, 'audio')
         if cached_result:
             logging.info("Returning cached audio download URL")
+            metrics.record_tier("download", "memory")
             return cached_result
             
-        # Step 3: Fetch from external API
-        audio_formats = ["320", "256", "192", "128", "mp3", "m4a"]
+        # Step 3: Fetch from external API (one upstream resolution per key at a time)
+        result = self.inflight.do(cache_key, self._resolve_download, key, video_id, cache_key, 'audio')
+        metrics.record_tier("download", "upstream")
+        return result
+
+    def _stored_download(self, video_data, file_type):
+        """(url, quality) for a file already on local disk or in Telegram, recording the tier; None otherwise"""
+        result = self._local_download(video_data, file_type)
+        if result:
+            metrics.record_tier("download", "local")
+            return result
+        result = self._telegram_download(video_data, file_type)
+        if result:
+            metrics.record_tier("download", "telegram")
+        return result
+
+    def _local_download(self, video_data, file_type):
+        """(media URL, quality) if the media cache holds this file"""
+        if not video_data or media_cache.lookup(video_data["video_id"], file_type) is None:
+            return None
+        logging.info(f"Returning {file_type} from the local media cache")
+        return media_cache.url(video_data["video_id"], file_type), video_data.get(f"{file_type}_quality", "HD")
+
+    def _telegram_download(self, video_data, file_type):
+        """Return (telegram_url, quality) if this file is stored in Telegram with a usable link"""
+        state = self._telegram_link_state(video_data, file_type)
+        if state is None:
+            return None
         
-        def check_audio_format(format_type):
-            try:
-                cdn = self.get_cdn()
-                r = self.session.post(f"https://{cdn}/download", json={
-                    "downloadType": "audio",
-                    "quality": format_type,
-                    "key": key
-                }, timeout=6)
-                
-                if r.status_code == 200:
-                    res = r.json()
-                    if res.get("status") and res["data"].get("downloadUrl"):
-                        return res["data"]["downloadUrl"], format_type
+        url = video_data[f"{file_type}_telegram_url"]
+        if state == 'expired':
+            url = self._refresh_telegram_url_now(video_data, file_type)
+            if not url:
                 return None
+        elif state == 'stale':
+            self._refresh_telegram_url_later(video_data, file_type)
+        logging.info(f"Returning {file_type} from Telegram channel")
+        return url, video_data.get(f"{file_type}_quality", "HD")
+
+    def _telegram_link_state(self, video_data, file_type):
+        """'fresh', 'stale' (inside the refresh-ahead window), 'expired', or None if unusable"""
+        if not video_data or not video_data.get(f"{file_type}_telegram_url"):
+            return None
+        if not video_data.get(f"{file_type}_file_id"):
+            # Uploaded before file_ids were stored: the link may be dead and cannot be renewed
+            return None
+        age = time.time() - video_data.get(f"{file_type}_url_refreshed_at", 0)
+        if age >= TELEGRAM_URL_TTL:
+            return 'expired'
+        if age >= TELEGRAM_URL_TTL * REFRESH_AHEAD_FRACTION:
+            return 'stale'
+        return 'fresh'
+
+    def _refresh_telegram_url_now(self, video_data, file_type):
+        """Renew an expired Telegram link while the request waits; None on failure"""
+        video_id = video_data["video_id"]
+        try:
+            return self.inflight.do(
+                f"telegram_{video_id}_{file_type}",
+                lambda: self.upload_scheduler.run_coroutine(
+                    self._refresh_telegram_url(video_id, file_type, video_data[f"{file_type}_file_id"])
+                ).result(timeout=TELEGRAM_REFRESH_TIMEOUT)
+            )
+        except Exception as e:
+            logging.warning(f"Telegram URL refresh failed for {file_type} {video_id}: {str(e)}")
+            return None
+
+    def _refresh_telegram_url_later(self, video_data, file_type):
+        """Renew a Telegram link that is about to expire without delaying the request"""
+        video_id = video_data["video_id"]
+        refresh_key = f"telegram_{video_id}_{file_type}"
+        if not self._start_refresh(refresh_key):
+            return
+        future = self.upload_scheduler.run_coroutine(
+            self._refresh_telegram_url(video_id, file_type, video_data[f"{file_type}_file_id"])
+        )
+        future.add_done_callback(lambda _: self._refreshing.discard(refresh_key))
+
+    async def _refresh_telegram_url(self, video_id, file_type, file_id):
+        """Fetch a new download link for file_id and store it with its refresh time"""
+        url = await _telegram().get_file_download_url(file_id)
+        if url:
+            fields = {f"{file_type}_telegram_url": url, f"{file_type}_url_refreshed_at": time.time()}
+            await asyncio.get_running_loop().run_in_executor(None, db_manager.update_video, video_id, fields)
+            logging.info(f"Refreshed Telegram URL for {file_type} {video_id}")
+        return url
+
+    def _start_refresh(self, refresh_key):
+        """Claim refresh_key; False if a refresh for it is already running"""
+        with self._lock:
+            if refresh_key in self._refreshing:
+                return False
+            self._refreshing.add(refresh_key)
+            return True
+
+    def _refresh_due(self, remaining_ttl, ttl):
+        return remaining_ttl < ttl * (1 - REFRESH_AHEAD_FRACTION)
+
+    def _cached_download(self, key, video_id, cache_key, file_type):
+        """Cached (download_url, quality), re-resolved in the background once it nears expiry"""
+        cached = self._cache_lookup_with_ttl(cache_key)
+        if cached is None:
+            return None
+        if self._refresh_due(cached[1], DOWNLOAD_URL_TTL) and self._start_refresh(cache_key):
+            future = self._refresh_executor.submit(
+                self.inflight.do, cache_key, self._resolve_download, key, video_id, cache_key, file_type, True
+            )
+            future.add_done_callback(lambda f: self._finish_refresh(cache_key, f.exception()))
+        return cached[0]
+
+    def _finish_refresh(self, refresh_key, error):
+        self._refreshing.discard(refresh_key)
+        if error is not None:
+            # The current entry stays until it expires; the next request retries
+            logging.warning(f"Refresh-ahead for {refresh_key} failed: {str(error)}")
+
+    def _resolve_download(self, key, video_id, cache_key, file_type, refresh=False):
+        """Probe the external API for the best available quality of file_type"""
+        if not refresh:
+            cached_result = self.cache_manager.get(cache_key)
+            if cached_result:
+                return cached_result
+
+        candidates, timeout = DOWNLOAD_CANDIDATES[file_type]
+        logging.info(f"Probing {file_type} qualities in parallel: {candidates}")
+        result = self._probe_best(key, file_type, candidates, timeout)
+        download = self._finish_download(result, video_id, file_type)
+        # Cache for 30 minutes
+        self.cache_manager.set(cache_key, download, ttl=DOWNLOAD_URL_TTL)
+        return download
+
+    def _finish_download(self, result, video_id, file_type):
+        """Check a probe result and queue its Telegram upload"""
+        if not result:
+            raise Exception(f"No HD {file_type} download URL found - all qualities failed")
+
+        quality, download_url = result
+        if file_type == 'video':
+            logging.info(f"Successfully found {quality}p video quality")
+        else:
+            quality_label = f"{quality}kbps" if quality.isdigit() else quality.upper()
+            logging.info(f"Successfully found {quality_label} audio quality")
+
+        # Background upload to Telegram (fire and forget)
+        if video_id:
+            logging.info(f"Starting background upload for {file_type} {video_id}")
+            self.background_upload_to_telegram(video_id, download_url, file_type, quality)
+
+        return download_url, quality
+
+    def _probe_best(self, key, download_type, candidates, timeout):
+        """Probe candidates in parallel, skipping qualities known to be unavailable"""
+        planned = self.availability.plan(key, download_type, candidates)
+        if planned != candidates:
+            logging.info(f"Availability cache narrowed {download_type} probes to {planned}")
+
+        probe_fn = lambda quality: self._probe_download(key, download_type, quality, timeout)
+        result = self.prober.probe(planned, probe_fn, deadline=PROBE_DEADLINE)
+        if result:
+            return result
+
+        # Cached knowledge was wrong or stale; fall back to everything not yet tried
+        remaining = [quality for quality in candidates if quality not in planned]
+        if remaining:
+            return self.prober.probe(remaining, probe_fn, deadline=PROBE_DEADLINE)
+        return None
+
+    def _probe_download(self, key, download_type, quality, timeout):
+        """Ask the external API for one quality; returns the download URL or None"""
+        start = time.perf_counter()
+        try:
+            r = self._post_upstream("/download", {
+                "downloadType": download_type,
+                "quality": quality,
+                "key": key
+            }, timeout=timeout)
+
+            res = r.json() if r.status_code == 200 else None
+        except Exception as e:
+            self._record_probe(download_type, quality, start, "error")
+            logging.warning(f"{download_type.title()} quality {quality} check failed: {str(e)}")
+            return None
+        answered, download_url = self._probe_result(download_type, quality, start, r.status_code, res)
+        if answered:
+            self.availability.record(key, download_type, quality, download_url is not None)
+        return download_url
+
+    def _record_probe(self, download_type, quality, start, outcome):
+        # One stage per quality so slow or flaky qualities stand out
+        metrics.observe(f"probe_{download_type}_{quality}", time.perf_counter() - start, outcome)
+
+    def _probe_result(self, download_type, quality, start, status, res):
+        """(answered, download_url) for a probe response; only answered outcomes go into the availability cache"""
+        if status != 200:
+            # 5xx, 429 and other refusals say nothing about the quality, so they are not cached
+            self._record_probe(download_type, quality, start, "error")
+            logging.warning(f"{download_type.title()} quality {quality} check got HTTP {status}")
+            return False, None
+        download_url = None
+        if res and res.get("status") and res["data"].get("downloadUrl"):
+            download_url = res["data"]["downloadUrl"]
+        self._record_probe(download_type, quality, start, "available" if download_url else "unavailable")
+        return True, download_url
+
+    # ---- Async request path (used by async_app.py) ----
+
+    async def get_async_session(self):
+        """Shared aiohttp session for upstream calls, bound to the serving event loop"""
+        loop = asyncio.get_running_loop()
+        if self._async_session is None or self._async_session.closed or self._async_session_loop is not loop:
+            # Imported here so the Flask app never loads aiohttp unless it uploads to Telegram
+            import aiohttp
+            self._async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=ASYNC_UPSTREAM_POOL_LIMIT, ttl_dns_cache=300)
+            )
+            self._async_session_loop = loop
+        return self._async_session
+
+    async def close_async(self):
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+
+    async def get_cdn_async(self):
+        """Async version of get_cdn sharing the same pool"""
+        cdn = self.cdn_pool.pick()
+        if cdn is None:
+            # Cold start only: discovery is a blocking call, keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.cdn_pool.refresh, True)
+            cdn = self.cdn_pool.pick()
+        if cdn is None:
+            raise Exception("CDN fetch failed: no CDN discovered")
+        return cdn
+
+    async def _post_upstream_async(self, path, payload, timeout, cdn=None):
+        """Async version of _post_upstream; returns (status, parsed JSON body or None)"""
+        import aiohttp
+        cdn = cdn or await self.get_cdn_async()
+        session = await self.get_async_session()
+        start = time.time()
+        try:
+            async with session.post(f"{UPSTREAM_SCHEME}://{cdn}{path}", json=payload,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                status = r.status
+                res = await r.json(content_type=None) if status == 200 else None
+        except Exception:
+            self.cdn_pool.record(cdn, time.time() - start, False)
+            raise
+        self.cdn_pool.record(cdn, time.time() - start, status < 500)
+        return status, res
+
+    async def get_info_async(self, url):
+        """Async version of get_info using aiohttp and the motor client"""
+        cache_key = info_cache_key(url)
+        cached_info = await self._cache_lookup_async(cache_key)
+        if cached_info:
+            logging.info("Returning cached video info")
+            metrics.record_tier("info", "memory")
+            return cached_info
+        
+        video_data = await db_manager.find_video_by_url_async(url)
+        if video_data:
+            logging.info("Returning video info from MongoDB")
+            metrics.record_tier("info", "mongo")
+            return self._info_from_document(video_data)
+        
+        flight_key = info_cache_key(url)
+        info = await self.async_inflight.do(flight_key, self._fetch_info_async, url, cache_key)
+        metrics.record_tier("info", "upstream")
+        return info
+
+    async def _fetch_info_async(self, url, cache_key):
+        cached_info = await self.cache_manager.get_async(cache_key)
+        if cached_info:
+            return cached_info
+
+        try:
+            info, video_data = await self._request_info_async(url)
+            
+            await db_manager.save_video_data_async(video_data)
+            
+            await self.cache_manager.set_async(cache_key, info, ttl=3600)
+            return info
+            
+        except Exception as e:
+            logging.error(f"Error getting video info: {str(e)}")
+            raise
+
+    async def _request_info_async(self, url):
+        async def request(cdn):
+            status, res = await self._post_upstream_async("/v2/info", {"url": url}, timeout=8, cdn=cdn)
+            if res is None:
+                raise Exception(f"Video info request failed with HTTP {status}")
+            return res
+
+        with metrics.timed("upstream_info"):
+            primary = await self.get_cdn_async()
+            if self.hedger.enabled:
+                res = await self.hedger.run_async(request, primary, lambda: self.cdn_pool.pick(exclude=(primary,)))
+            else:
+                res = await request(primary)
+        return self._info_from_response(url, res)
+
+    async def get_info_batch_async(self, urls):
+        """Async version of get_info_batch"""
+        misses = {}
+        for index, url in enumerate(urls):
+            cached_info = await self._cache_lookup_async(info_cache_key(url))
+            if cached_info:
+                metrics.record_tier("info", "memory")
+                yield index, cached_info, None
+            else:
+                video_id = canonical_video_id(url)
+                misses.setdefault(video_id or url, (video_id, []))[1].append(index)
+
+        documents = await db_manager.get_videos_async([video_id for video_id, _ in misses.values() if video_id])
+        unresolved = []
+        for video_id, indexes in misses.values():
+            if video_id in documents:
+                info = self._info_from_document(documents[video_id])
+                for index in indexes:
+                    metrics.record_tier("info", "mongo")
+                    yield index, info, None
+            else:
+                unresolved.append(indexes)
+        if not unresolved:
+            return
+
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        new_documents = []
+
+        async def resolve(indexes):
+            url = urls[indexes[0]]
+            cache_key = info_cache_key(url)
+            async with semaphore:
+                try:
+                    info = await self.async_inflight.do(
+                        cache_key, self._fetch_batch_info_async, url, cache_key, new_documents
+                    )
+                    return indexes, info, None
+                except Exception as e:
+                    logging.error(f"Error getting video info in batch: {str(e)}")
+                    return indexes, None, str(e)
+
+        tasks = [asyncio.ensure_future(resolve(indexes)) for indexes in unresolved]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indexes, info, error = await next_done
+                if error is not None:
+                    for index in indexes:
+                        yield index, None, error
+                    continue
+                for index in indexes:
+                    await self.cache_manager.set_async(info_cache_key(urls[index]), info, ttl=3600)
+                    metrics.record_tier("info", "upstream")
+                    yield index, info, None
+        finally:
+            for task in tasks:
+                task.cancel()
+            await db_manager.save_videos_bulk_async(new_documents)
+
+    async def _fetch_batch_info_async(self, url, cache_key, new_documents):
+        """Async version of _fetch_batch_info"""
+        cached_info = await self.cache_manager.get_async(cache_key)
+        if cached_info:
+            return cached_info
+        info, video_data = await self._request_info_async(url)
+        if video_data["video_id"]:
+            new_documents.append(video_data)
+        await self.cache_manager.set_async(cache_key, info, ttl=3600)
+        return info
+
+    async def get_download_batch_async(self, items):
+        """Async version of get_download_batch"""
+        documents = await db_manager.get_videos_async([item["video_id"] for item in items if item.get("video_id")])
+        pending = []
+        for index, item in enumerate(items):
+            key = item.get("key")
+            video_id = item.get("video_id")
+            file_type = item.get("type", "video")
+            if not key:
+                yield index, None, "Missing video key"
+                continue
+            if file_type not in DOWNLOAD_CANDIDATES:
+                yield index, None, "Invalid download type"
+                continue
+            
+            if video_id:
+                self.upload_scheduler.record_demand(video_id)
+                stored_result = await self._stored_download_async(documents.get(video_id), file_type)
+                if stored_result:
+                    yield index, stored_result, None
+                    continue
+            
+            cache_key = f"{file_type}_{key}"
+            cached_result = await self._cached_download_async(key, video_id, cache_key, file_type)
+            if cached_result:
+                metrics.record_tier("download", "memory")
+                yield index, cached_result, None
+            else:
+                pending.append((index, key, video_id, cache_key, file_type))
+        if not pending:
+            return
+
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def resolve(index, key, video_id, cache_key, file_type):
+            async with semaphore:
+                try:
+                    return index, await self.async_inflight.do(
+                        cache_key, self._resolve_download_async, key, video_id, cache_key, file_type
+                    ), None
+                except Exception as e:
+                    return index, None, str(e)
+
+        tasks = [asyncio.ensure_future(resolve(*args)) for args in pending]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, result, error = await next_done
+                if error is None:
+                    metrics.record_tier("download", "upstream")
+                yield index, result, error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_best_quality_download_async(self, key, video_id=None):
+        """Async version of get_best_quality_download"""
+        return await self._get_download_async(key, video_id, 'video')
+
+    async def get_best_audio_download_async(self, key, video_id=None):
+        """Async version of get_best_audio_download"""
+        return await self._get_download_async(key, video_id, 'audio')
+
+    async def _get_download_async(self, key, video_id, file_type):
+        if video_id:
+            self.upload_scheduler.record_demand(video_id)
+            stored_result = await self._stored_download_async(await db_manager.get_video_async(video_id), file_type)
+            if stored_result:
+                return stored_result
+        
+        cache_key = f"{file_type}_{key}"
+        cached_result = await self._cached_download_async(key, video_id, cache_key, file_type)
+        if cached_result:
+            logging.info(f"Returning cached {file_type} download URL")
+            metrics.record_tier("download", "memory")
+            return cached_result
+        
+        result = await self.async_inflight.do(cache_key, self._resolve_download_async, key, video_id, cache_key, file_type)
+        metrics.record_tier("download", "upstream")
+        return result
+
+    async def _stored_download_async(self, video_data, file_type):
+        """Async version of _stored_download"""
+        result = self._local_download(video_data, file_type)
+        if result:
+            metrics.record_tier("download", "local")
+            return result
+        result = await self._telegram_download_async(video_data, file_type)
+        if result:
+            metrics.record_tier("download", "telegram")
+        return result
+
+    async def _telegram_download_async(self, video_data, file_type):
+        """Async version of _telegram_download"""
+        state = self._telegram_link_state(video_data, file_type)
+        if state is None:
+            return None
+        
+        url = video_data[f"{file_type}_telegram_url"]
+        if state == 'expired':
+            video_id = video_data["video_id"]
+            try:
+                # Telegram calls run on the scheduler loop, which owns the pooled session
+                url = await self.async_inflight.do(
+                    f"telegram_{video_id}_{file_type}",
+                    lambda: asyncio.wait_for(asyncio.wrap_future(self.upload_scheduler.run_coroutine(
+                        self._refresh_telegram_url(video_id, file_type, video_data[f"{file_type}_file_id"])
+                    )), TELEGRAM_REFRESH_TIMEOUT)
+                )
             except Exception as e:
-                logging.warning(f"Audio format {format_type} check failed: {str(e)}")
+                logging.warning(f"Telegram URL refresh failed for {file_type} {video_id}: {str(e)}")
+                url = None
+            if not url:
                 return None
+        elif state == 'stale':
+            self._refresh_telegram_url_later(video_data, file_type)
+        logging.info(f"Returning {file_type} from Telegram channel")
+        return url, video_data.get(f"{file_type}_quality", "HD")
 
-        # Try formats in priority order
-        for fmt in audio_formats:
-            quality_label = f"{fmt}kbps" if fmt.isdigit() else fmt.upper()
-            logging.info(f"Trying audio quality: {quality_label}")
-            result = check_audio_format(fmt)
-            if result:
-                download_url, format_type = result
-                logging.info(f"Successfully found {quality_label} audio quality")
-                
-                # Cache for 30 minutes
-                self.cache_manager.set(cache_key, (download_url, format_type), ttl=1800)
-                
-                # Background upload to Telegram (fire and forget)
-                if video_id:
-                    logging.info(f"Starting background upload for audio {video_id}")
-                    self.background_upload_to_telegram(video_id, download_url, 'audio', format_type)
-                
-                return download_url, format_type
-        
-        raise Exception("No HD audio download URL found - all qualities failed")
+    async def _cached_download_async(self, key, video_id, cache_key, file_type):
+        """Async version of _cached_download; the refresh runs as a task on the serving loop"""
+        cached = await self._cache_lookup_with_ttl_async(cache_key)
+        if cached is None:
+            return None
+        if self._refresh_due(cached[1], DOWNLOAD_URL_TTL) and self._start_refresh(cache_key):
+            task = asyncio.ensure_future(self.async_inflight.do(
+                cache_key, self._resolve_download_async, key, video_id, cache_key, file_type, True
+            ))
+            self._refresh_tasks.add(task)
+
+            def done(task):
+                self._refresh_tasks.discard(task)
+                self._finish_refresh(cache_key, None if task.cancelled() else task.exception())
+
+            task.add_done_callback(done)
+        return cached[0]
+
+    async def _resolve_download_async(self, key, video_id, cache_key, file_type, refresh=False):
+        if not refresh:
+            cached_result = await self.cache_manager.get_async(cache_key)
+            if cached_result:
+                return cached_result
+
+        candidates, timeout = DOWNLOAD_CANDIDATES[file_type]
+        logging.info(f"Probing {file_type} qualities in parallel: {candidates}")
+        planned = await self.availability.plan_async(key, file_type, candidates)
+        if planned != candidates:
+            logging.info(f"Availability cache narrowed {file_type} probes to {planned}")
+        probe = lambda quality: self._probe_download_async(key, file_type, quality, timeout)
+        result = await self.prober.probe_async(planned, probe, deadline=PROBE_DEADLINE)
+        remaining = [quality for quality in candidates if quality not in planned]
+        if not result and remaining:
+            result = await self.prober.probe_async(remaining, probe, deadline=PROBE_DEADLINE)
+        download = self._finish_download(result, video_id, file_type)
+        await self.cache_manager.set_async(cache_key, download, ttl=DOWNLOAD_URL_TTL)
+        return download
+
+    async def _probe_download_async(self, key, download_type, quality, timeout):
+        start = time.perf_counter()
+        try:
+            status, res = await self._post_upstream_async("/download", {
+                "downloadType": download_type,
+                "quality": quality,
+                "key": key
+            }, timeout=timeout)
+        except Exception as e:
+            self._record_probe(download_type, quality, start, "error")
+            logging.warning(f"{download_type.title()} quality {quality} check failed: {str(e)}")
+            return None
+        answered, download_url = self._probe_result(download_type, quality, start, status, res)
+        if answered:
+            await self.availability.record_async(key, download_type, quality, download_url is not None)
+        return download_url
+    
+    def get_stats(self):
+        """Cache, coalescing, upload and database statistics for /api/cache-stats"""
+        db_stats = db_manager.get_stats()
+        return {
+            "cache": self.cache_manager.get_stats(),
+            "cache_cluster": self.cache_manager.get_cluster_stats(),
+            "documents": db_manager.doc_cache.get_stats(),
+            "write_behind": db_manager.write_buffer.get_stats() if db_manager.write_buffer else None,
+            "coalescing": self.inflight.get_stats(),
+            "async_coalescing": self.async_inflight.get_stats(),
+            "availability": self.availability.get_stats(),
+            "cdn_pool": self.cdn_pool.get_stats(),
+            "hedging": self.hedger.get_stats(),
+            "media_cache": media_cache.get_stats(),
+            "video_ids": canonical_video_id.cache_info()._asdict(),
+            "uploads": self.upload_scheduler.get_stats(),
+            "telegram": _telegram().get_stats() if "telegram_service" in sys.modules else None,
+            "tiers": metrics.tier_rates(),
+            "startup": startup.report(),
+            "database": db_stats,
+            "total_cached_videos": db_stats["videos_with_telegram_video"] + db_stats["videos_with_telegram_audio"]
+        }
     
     def background_upload_to_telegram(self, video_id, download_url, file_type, quality):
-        """Upload file to Telegram in background thread"""
-        def upload_task():
+        """Queue a Telegram upload on the background upload scheduler"""
+        if self.upload_scheduler.submit(video_id, download_url, file_type, quality):
+            logging.info(f"Queued background upload for {file_type} {video_id}")
+        else:
+            logging.info(f"Upload for {file_type} {video_id} already queued or queue full")
+
+    async def _upload_job(self, job):
+        """Upload one queued file to Telegram and record its URL in MongoDB"""
+        video_id = job["video_id"]
+        file_type = job["file_type"]
+        quality = job["quality"]
+        loop = asyncio.get_running_loop()
+        try:
+            logging.info(f"Background upload task started for {file_type} {video_id}")
+            
+            # Check if already uploaded
+            # Bypass the document cache: another worker may have uploaded this already
+            video_data = await loop.run_in_executor(
+                None, lambda: db_manager.get_video(video_id, fresh=True)
+            )
+            if not video_data:
+                logging.error(f"Video data not found for {video_id}")
+                return
+            
+            # Check if already uploaded to avoid duplicates (uploads without a file_id are redone
+            # once, since their links cannot be refreshed)
+            if file_type == 'video' and video_data.get("video_file_id"):
+                logging.info(f"Video {video_id} already uploaded to Telegram")
+                return
+            elif file_type == 'audio' and video_data.get("audio_file_id"):
+                logging.info(f"Audio {video_id} already uploaded to Telegram")
+                return
+            
+            logging.info(f"Proceeding with upload for {file_type} {video_id}")
+            
+            # Generate filename
+            filename = _telegram().generate_filename(
+                video_data["title"], video_id, file_type, quality
+            )
+            logging.info(f"Generated filename: {filename}")
+            
+            # Create caption
+            caption = f"🎬 {video_data['title']}\n📹 {quality}{'p' if file_type == 'video' else 'kbps'} {file_type.title()}"
+            
+            # Upload to Telegram, keeping a local copy of the same fetch when the media cache is on
+            logging.info(f"Starting Telegram upload for {filename}")
+            sink = media_cache.writer(video_id, file_type, os.path.splitext(filename)[1])
             try:
-                logging.info(f"Background upload task started for {file_type} {video_id}")
-                
-                # Check if already uploaded
-                video_data = db_manager.videos_collection.find_one({"video_id": video_id})
-                if not video_data:
-                    logging.error(f"Video data not found for {video_id}")
-                    return
-                
-                # Check if already uploaded to avoid duplicates
-                if file_type == 'video' and video_data.get("video_telegram_url"):
-                    logging.info(f"Video {video_id} already uploaded to Telegram")
-                    return
-                elif file_type == 'audio' and video_data.get("audio_telegram_url"):
-                    logging.info(f"Audio {video_id} already uploaded to Telegram")
-                    return
-                
-                logging.info(f"Proceeding with upload for {file_type} {video_id}")
+                result = await _telegram().upload_file_to_telegram(job["download_url"], filename, caption, sink)
+            finally:
+                if sink is not None:
+                    # No-op once the full source was read and published
+                    sink.abort()
+            
+            if result:
+                logging.info(f"Telegram upload successful for {file_type} {video_id} ({result['ingest']} ingest)")
+                # Update MongoDB with Telegram URL
+                update_data = {}
+                if file_type == 'video':
+                    update_data["video_telegram_url"] = result["telegram_url"]
+                    update_data["video_quality"] = quality
+                    update_data["video_message_id"] = result["message_id"]
+                    update_data["video_file_id"] = result["file_id"]
+                    update_data["video_url_refreshed_at"] = time.time()
+                else:
+                    update_data["audio_telegram_url"] = result["telegram_url"]
+                    update_data["audio_quality"] = quality
+                    update_data["audio_message_id"] = result["message_id"]
+                    update_data["audio_file_id"] = result["file_id"]
+                    update_data["audio_url_refreshed_at"] = time.time()
                 
-                # Generate filename
-                filename = telegram_service.generate_filename(
-                    video_data["title"], video_id, file_type, quality
+                await loop.run_in_executor(
+                    None, db_manager.save_telegram_upload, video_id, file_type, update_data
                 )
-                logging.info(f"Generated filename: {filename}")
-                
-                # Create caption
-                caption = f"🎬 {video_data['title']}\n📹 {quality}{'p' if file_type == 'video' else 'kbps'} {file_type.title()}"
                 
-                # Upload to Telegram
-                logging.info(f"Starting Telegram upload for {filename}")
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                result = loop.run_until_complete(
-                    telegram_service.upload_file_to_telegram(download_url, filename, caption)
-                )
-                loop.close()
+                logging.info(f"Successfully uploaded {file_type} {video_id} to Telegram and updated database")
+            else:
+                logging.error(f"Failed to upload {file_type} {video_id} to Telegram - no result returned")
                 
-                if result:
-                    logging.info(f"Telegram upload successful for {file_type} {video_id}")
-                    # Update MongoDB with Telegram URL
-                    update_data = {}
-                    if file_type == 'video':
-                        update_data["video_telegram_url"] = result["telegram_url"]
-                        update_data["video_quality"] = quality
-                        update_data["video_message_id"] = result["message_id"]
-                    else:
-                        update_data["audio_telegram_url"] = result["telegram_url"]
-                        update_data["audio_quality"] = quality
-                        update_data["audio_message_id"] = result["message_id"]
-                    
-                    db_manager.videos_collection.update_one(
-                        {"video_id": video_id},
-                        {"$set": update_data}
-                    )
-                    
-                    logging.info(f"Successfully uploaded {file_type} {video_id} to Telegram and updated database")
-                else:
-                    logging.error(f"Failed to upload {file_type} {video_id} to Telegram - no result returned")
-                    
-            except Exception as e:
-                logging.error(f"Background upload error for {video_id}: {str(e)}")
-                import traceback
-                logging.error(f"Full traceback: {traceback.format_exc()}")
-        
-        # Run in background thread
-        logging.info(f"Starting background thread for {file_type} {video_id}")
-        threading.Thread(target=upload_task, daemon=True).start()
+        except Exception as e:
+            logging.error(f"Background upload error for {video_id}: {str(e)}")
+            import traceback
+            logging.error(f"Full traceback: {traceback.format_exc()}")